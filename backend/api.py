@@ -1,7 +1,9 @@
 import base64
 import io
-from flask import jsonify, request, send_file, Response
+from flask import current_app, jsonify, request, send_file, Request, Response
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 import re
+from sqlalchemy import inspect
 
 from datetime import datetime, timedelta, timezone
 from flask_jwt_extended import (
@@ -10,26 +12,149 @@ from flask_jwt_extended import (
     get_jwt_identity,
     unset_jwt_cookies,
     jwt_required,
+    verify_jwt_in_request,
     JWTManager,
 )
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 import json
 import bcrypt
+import hashlib
+import logging
 import re
 
+# Default and largest number of suggestions /api/autosuggest returns
+AUTOSUGGEST_LIMIT = 10
+AUTOSUGGEST_MAX_LIMIT = 50
+# Default and largest page size of /api/search
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Default and largest page size of the landing feed and /api/filter, when paginated
+FEED_LIMIT = 30
+FEED_MAX_LIMIT = 100
+# Versioned image urls never change content, so they can be cached for a year
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+# Room left for the form fields around an image upload, on top of MAX_IMAGE_UPLOAD_BYTES
+IMAGE_UPLOAD_FORM_BYTES = 64 * 1024
+
+
+class UploadLimitedRequest(Request):
+    """
+    Limits the body of image uploads to MAX_IMAGE_UPLOAD_BYTES and the room left for their
+    form fields. Werkzeug enforces it while the body is read, including bodies sent without
+    a Content-Length, so an oversized upload is never spooled to disk. Other routes keep
+    the app's MAX_CONTENT_LENGTH.
+    """
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == "update_post_image":
+            return (
+                current_app.config["MAX_IMAGE_UPLOAD_BYTES"] + IMAGE_UPLOAD_FORM_BYTES
+            )
+        return super().max_content_length
+
+
 """
 Helper Methods 
 """
 
 
-def jsonify_event(event):
+def helper_image_url(event):
+    """
+    Returns the url of the event's image.
+    Stored images get a url versioned by their content hash, which can be cached forever.
+    """
+    if event.image_hash:
+        return f"/api/{event.id}/image?v={event.image_hash}"
+    return f"/api/{event.id}/image"
+
+
+def helper_image_etag(image_hash, size, encoding):
     """
-    Returns a json string of a single event
+    Returns the ETag of the given size and encoding of a stored image.
     """
-    from .datalayer.event import EventDataLayer
+    from .datalayer.image import ImageDataLayer
 
-    event_data = EventDataLayer()
-    tags = event_data.get_tags_for_event(event_id=event.id)
+    etag = image_hash
+    if size != ImageDataLayer.ORIGINAL:
+        etag = f"{etag}-{size}"
+    if encoding is not None:
+        etag = f"{etag}-{encoding}"
+    return etag
+
+
+def helper_accepted_image_encodings(image_data, uploaded_mimetype):
+    """
+    Returns the encodings of a stored image that the client accepts, mapped to their MIME type.
+    The uploaded format (None) is always accepted, the modern encodings only when the
+    Accept header names them, since */* does not guarantee the client can decode them.
+    """
+    accepted_mimetypes = {
+        value for value, quality in request.accept_mimetypes if quality > 0
+    }
+    mimetypes = {None: uploaded_mimetype}
+    for encoding, mimetype in image_data.get_image_encodings().items():
+        if mimetype in accepted_mimetypes:
+            mimetypes[encoding] = mimetype
+    return mimetypes
+
+
+def helper_cache_image(response, etag, versioned):
+    """
+    Adds the ETag and Cache-Control headers of an image response.
+    """
+    response.set_etag(etag)
+    if versioned:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Unversioned urls can change content, so they have to be revalidated
+        response.cache_control.no_cache = True
+    return response
+
+
+def helper_liked_event_ids():
+    """
+    Returns the set of ids of the events liked by the user of the request's JWT,
+    or None if the request has no valid JWT.
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return None
+    user_id = get_jwt_identity()
+    if user_id is None:
+        return None
+    from .datalayer.like import LikeDataLayer
+
+    like_data = LikeDataLayer()
+    return set(like_data.get_liked_event_ids(user_id))
+
+
+def jsonify_event(event, liked_event_ids=None):
+    """
+    Returns a json string of a single event.
+    Uses the event's preloaded tags, and only queries them if they were not loaded.
+    If the ids of the events the user liked are given, it says whether the user liked it.
+    """
+    if "tags" in inspect(event).unloaded:
+        from .datalayer.event import EventDataLayer
+
+        event_data = EventDataLayer()
+        tags = event_data.get_tags_for_event(event_id=event.id)
+    else:
+        tags = event.tags
     tag_names = [tag.name for tag in tags]
+    from .datalayer.like import LikeDataLayer
+
+    # Likes waiting to be written count right away, see LIKE_BUFFER_FLUSH_MS
+    like_count = event.like_count
+    pending_like_count = LikeDataLayer().get_pending_like_count(event.id)
+    if pending_like_count:
+        like_count = (like_count or 0) + pending_like_count
 
     json_event = {
         "id": event.id,
@@ -44,30 +169,56 @@ def jsonify_event(event):
         "author_id": event.author_id,
         "club": event.club,
         "is_published": event.is_published,
-        "like_count": event.like_count,
+        "like_count": like_count,
         "tags": tag_names,
+        "image_url": helper_image_url(event),
+        "image_placeholder": event.image_placeholder,
         # Add other fields here as needed
     }
+    if liked_event_ids is not None:
+        json_event["liked"] = event.id in liked_event_ids
     return json_event
 
 
 def jsonify_event_list(events):
     """
-    Returns a json string of a list of events
+    Returns a json string of a list of events, saying which ones the user liked if the request has a JWT
     """
+    liked_event_ids = helper_liked_event_ids()
     json_events = []
     for event in events:
-        json_event = jsonify_event(event)
+        json_event = jsonify_event(event, liked_event_ids)
         json_events.append(json_event)
     return jsonify(json_events)
 
 
+def jsonify_event_page(events, next_cursor):
+    """
+    Returns a json string of a page of events and the cursor of the next page
+    """
+    liked_event_ids = helper_liked_event_ids()
+    json_events = [jsonify_event(event, liked_event_ids) for event in events]
+    return jsonify({"results": json_events, "next_cursor": next_cursor})
+
+
+def helper_page_limit():
+    """
+    Returns the page size requested with the limit argument, or None when the whole list is requested.
+    """
+    if "limit" not in request.args and "cursor" not in request.args:
+        return None
+    limit = request.args.get("limit", default=FEED_LIMIT, type=int)
+    return max(1, min(limit, FEED_MAX_LIMIT))
+
+
 """
 Routes
 """
 
 
 def setup_routes(app):
+    app.request_class = UploadLimitedRequest
+
     @app.route("/api/get-all-tags", methods=["GET"])
     def get_all_tags():
         try:
@@ -124,25 +275,17 @@ def setup_routes(app):
 
     @app.route("/api/autosuggest", methods=["GET"])
     def autosuggest():
-        query = request.args.get("query").lower()
+        query = request.args.get("query", default="").lower()
+        limit = request.args.get("limit", default=AUTOSUGGEST_LIMIT, type=int)
+        # The number of suggestions is always bounded, whatever the client asks for
+        limit = max(1, min(limit, AUTOSUGGEST_MAX_LIMIT))
         try:
-            from .datalayer.event import EventDataLayer
+            # Answered from an in-memory index, without querying the database
+            from .datalayer.suggestion import SuggestionDataLayer
 
-            event_data = EventDataLayer()
-            results = event_data.get_search_results_by_keyword(query)
-            suggestions = []
-            for event in results:
-                if any(
-                    word.lower().startswith(query)
-                    for word in re.findall(r"\b\w+\b", event.title)
-                ):
-                    suggestions.append(event.title)
-                if event.club and any(
-                    word.lower().startswith(query)
-                    for word in re.findall(r"\b\w+\b", event.club)
-                ):
-                    suggestions.append(event.club)
-            return jsonify(list(set(suggestions)))
+            suggestion_data = SuggestionDataLayer()
+            suggestions = suggestion_data.get_suggestions(query, limit=limit)
+            return jsonify(suggestions)
         except Exception as e:
             error_message = str(e)
             return (
@@ -158,11 +301,22 @@ def setup_routes(app):
     @app.route("/api/search", methods=["GET"])
     def search():
         query = request.args.get("query")
+        sortby = request.args.get("sortby", None)
+        limit = request.args.get("limit", default=SEARCH_LIMIT, type=int)
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        cursor = request.args.get("cursor", None)
+        include_total = request.args.get("include_total", "false").lower() == "true"
         try:
             from .datalayer.event import EventDataLayer
 
             event_data = EventDataLayer()
-            results = event_data.get_search_results_by_keyword(query)
+            results, next_cursor, total = event_data.get_search_results_page(
+                query,
+                limit=limit,
+                cursor=cursor,
+                sort_by=sortby,
+                include_total=include_total,
+            )
             json_event = [
                 {
                     "id": event.id,
@@ -174,7 +328,18 @@ def setup_routes(app):
                 }
                 for event in results
             ]
-            return jsonify(json_event)
+            json_page = {"results": json_event, "next_cursor": next_cursor}
+            if include_total:
+                json_page["total"] = total
+            return jsonify(json_page)
+        except ValueError as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {"error": "Failed to look for post", "error_message": error_message}
+                ),
+                400,
+            )
         except Exception as e:
             error_message = str(e)
             return (
@@ -218,6 +383,8 @@ def setup_routes(app):
     @app.route("/api/update-post-image/<int:post_id>", methods=["POST"])
     def update_post_image(post_id):
         try:
+            # Larger request bodies are rejected while they are read, see UploadLimitedRequest
+
             # Check if the request contains a file in the 'image' field
             if "image" not in request.files:
                 return jsonify({"error": "No image file provided"}), 400
@@ -225,32 +392,42 @@ def setup_routes(app):
             # Retrieve the image file from the request
             uploaded_file = request.files["image"]
 
-            # Read the image file data
-            image_data = uploaded_file.read()
-
-            from .datalayer.event import EventDataLayer
-
-            event_data = EventDataLayer()
-            event_data.update_image(event_id=post_id, image=image_data)
-
-            # THIS IS FOR TESTING PURPOSES ONLY
-            # import io
-            # from pathlib import Path
-            # from PIL import Image
-
-            # # Process the image data
-            # image = Image.open(io.BytesIO(image_data))
-
-            # # Save the received image for testing purposes
-            # subdirectory_name = "output_images"
-            # output_directory = Path.cwd() / subdirectory_name
-            # output_directory.mkdir(parents=True, exist_ok=True)
+            # The image is streamed to disk, then validated, resized and stored
+            # out of band by the image worker
+            from .datalayer.image_job import ImageJobDataLayer
 
-            # output_image_path = output_directory / "received_image.png"
-            # image.save(output_image_path)
+            job_data = ImageJobDataLayer()
+            job_id = job_data.create_job(
+                event_id=post_id, image_stream=uploaded_file.stream
+            )
 
-            return jsonify({"message": "Image updated successfully"})
+            return (
+                jsonify(
+                    {
+                        "message": "Image upload accepted",
+                        "status": job_data.PENDING,
+                        "job_id": job_id,
+                    }
+                ),
+                202,
+            )
 
+        except RequestEntityTooLarge as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {"error": "Failed to update image", "error message": error_message}
+                ),
+                413,
+            )
+        except (TypeError, ValueError) as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {"error": "Failed to update image", "error message": error_message}
+                ),
+                400,
+            )
         except Exception as e:
             error_message = str(e)
             return (
@@ -260,6 +437,42 @@ def setup_routes(app):
                 500,
             )
 
+    @app.route("/api/image-jobs/<int:job_id>", methods=["GET"])
+    def get_image_job(job_id):
+        try:
+            from .datalayer.image_job import ImageJobDataLayer
+
+            job_data = ImageJobDataLayer()
+            job = job_data.get_job(job_id)
+
+            response = {
+                "job_id": job.id,
+                "event_id": job.event_id,
+                "status": job.status,
+            }
+            if job.status == job_data.FAILED:
+                response["error message"] = job.error
+            return jsonify(response)
+        except ValueError as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {"error": "Failed to get image job", "error message": error_message}
+                ),
+                404,
+            )
+        except Exception as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to process the request",
+                        "error message": error_message,
+                    }
+                ),
+                500,
+            )
+
     @app.route("/api/create-post", methods=["POST"])
     def create_post():
         try:
@@ -350,10 +563,27 @@ def setup_routes(app):
             from .datalayer.event import EventDataLayer
 
             event_data = EventDataLayer()
+            limit = helper_page_limit()
+            if limit is not None:
+                events, next_cursor = event_data.get_unexpired_events_page(
+                    limit, cursor=request.args.get("cursor", None)
+                )
+                return jsonify_event_page(events, next_cursor)
             events = event_data.get_all_unexpired_events()
 
             return jsonify_event_list(events)
 
+        except ValueError as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to get all events",
+                        "error message": error_message,
+                    }
+                ),
+                400,
+            )
         except Exception as e:
             error_message = str(e)
             return (
@@ -389,14 +619,107 @@ def setup_routes(app):
 
         try:
             event_data = EventDataLayer()
-            event = event_data.get_event_by_id(event_id)
-
-            if event.image:
-                # Assuming event.image is the binary image data
-                return Response(event.image, mimetype="image/png")
+            image = event_data.get_event_image(event_id)
+
+            if image.image_hash:
+                from .datalayer.image import ImageDataLayer
+
+                image_data = ImageDataLayer()
+                size = request.args.get("size", image_data.ORIGINAL)
+                try:
+                    image_data.helper_valid_size(size)
+                except ValueError as e:
+                    return (
+                        jsonify(
+                            {
+                                "error": "Failed to get event image",
+                                "error message": str(e),
+                            }
+                        ),
+                        400,
+                    )
+
+                versioned = request.args.get("v") == image.image_hash
+                mimetypes = helper_accepted_image_encodings(
+                    image_data, image.image_mimetype
+                )
+                etags = {
+                    encoding: helper_image_etag(image.image_hash, size, encoding)
+                    for encoding in mimetypes
+                }
+                # Answer revalidations from the hash alone, without opening the image
+                for etag in etags.values():
+                    if request.if_none_match.contains(etag):
+                        response = helper_cache_image(
+                            Response(status=304), etag, versioned
+                        )
+                        response.vary.add("Accept")
+                        return response
+
+                # Variants are only generated by the image worker, never while a client waits
+                image_paths = {}
+                for encoding in mimetypes:
+                    variant_path = image_data.get_stored_image_variant_path(
+                        image.image_hash, size, encoding
+                    )
+                    if variant_path is not None:
+                        image_paths[encoding] = variant_path
+                if len(image_paths) < len(mimetypes):
+                    from .datalayer.image_job import ImageJobDataLayer
+
+                    try:
+                        ImageJobDataLayer().create_variants_job(
+                            event_id, image.image_hash
+                        )
+                    except Exception as e:
+                        # The variants that are stored can still be served
+                        logging.warning(
+                            f"Failed to queue the variants of image {image.image_hash}: {e}"
+                        )
+                fallback = False
+                if None not in image_paths:
+                    # Serve the original until the resized variant is generated
+                    original_path = image_data.get_stored_image_variant_path(
+                        image.image_hash, image_data.ORIGINAL
+                    )
+                    if original_path is not None:
+                        image_paths[None] = original_path
+                        etags[None] = helper_image_etag(
+                            image.image_hash, image_data.ORIGINAL, None
+                        )
+                        fallback = True
+                if not image_paths:
+                    return jsonify({"error": "Image not found"}), 404
+
+                # Serve the smallest encoding the client accepts. send_file streams it
+                # from disk and answers Range and If-Range requests with partial content.
+                encoding = min(
+                    image_paths,
+                    key=lambda encoding: image_paths[encoding].stat().st_size,
+                )
+                response = send_file(
+                    image_paths[encoding],
+                    mimetype=mimetypes[encoding],
+                    etag=etags[encoding],
+                )
+                # The original stands in for the variant, so it must not be cached for good
+                versioned = versioned and not (fallback and encoding is None)
+                response = helper_cache_image(response, etags[encoding], versioned)
+                response.vary.add("Accept")
+                return response
+            elif image.image:
+                # Image that has not been moved to the image store yet
+                image_hash = hashlib.sha256(image.image).hexdigest()
+                response = send_file(
+                    io.BytesIO(image.image), mimetype="image/png", etag=image_hash
+                )
+                return helper_cache_image(response, image_hash, versioned=False)
 
             else:
                 return jsonify({"error": "Image not found"})
+        except HTTPException:
+            # For example a Range that cannot be satisfied
+            raise
         except Exception as e:
             error_message = str(e)
             return (
@@ -582,6 +905,23 @@ def setup_routes(app):
             start_time = request.args.get("start_time", None)
             end_time = request.args.get("end_time", None)
             sortby = request.args.get("sortby", None)
+            # "substring" matches free text anywhere in the location and club
+            match = request.args.get("match", EventDataLayer.MATCH_EXACT)
+            limit = helper_page_limit()
+            if limit is not None:
+                events, next_cursor = event_data.search_filter_sort_page(
+                    limit,
+                    cursor=request.args.get("cursor", None),
+                    keyword=query,
+                    tag_name=tagname,
+                    location=location,
+                    club=club,
+                    start_time=start_time,
+                    end_time=end_time,
+                    sort_by=sortby,
+                    match=match,
+                )
+                return jsonify_event_page(events, next_cursor)
             events = event_data.search_filter_sort(
                 keyword=query,
                 tag_name=tagname,
@@ -590,8 +930,20 @@ def setup_routes(app):
                 start_time=start_time,
                 end_time=end_time,
                 sort_by=sortby,
+                match=match,
             )
             return jsonify_event_list(events)
+        except ValueError as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to search sort and filter events",
+                        "error message": error_message,
+                    }
+                ),
+                400,
+            )
         except Exception as e:
             error_message = str(e)
             return (
@@ -613,10 +965,27 @@ def setup_routes(app):
             from .datalayer.like import LikeDataLayer
 
             like_data = LikeDataLayer()
+            limit = helper_page_limit()
+            if limit is not None:
+                favourite_events, next_cursor = like_data.get_liked_events_page(
+                    userid, limit, cursor=request.args.get("cursor", None)
+                )
+                return jsonify_event_page(favourite_events, next_cursor)
             favourite_events = like_data.get_liked_events(user_id=userid)
 
             return jsonify_event_list(favourite_events)
 
+        except ValueError as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to get favourite posts",
+                        "error message": error_message,
+                    }
+                ),
+                400,
+            )
         except Exception as e:
             error_message = str(e)
             return (
@@ -629,6 +998,36 @@ def setup_routes(app):
                 500,
             )
 
+    @app.route("/api/likes/ids", methods=["GET"])
+    @jwt_required()
+    def my_liked_event_ids():
+        try:
+            user_id = get_jwt_identity()
+            from .datalayer.like import LikeDataLayer
+
+            like_data = LikeDataLayer()
+            event_ids = like_data.get_liked_event_ids(user_id)
+
+            # Clients revalidate with the ETag, and get a 304 while the likes are unchanged
+            response = jsonify(event_ids)
+            response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add("Authorization")
+            return response.make_conditional(request)
+
+        except Exception as e:
+            error_message = str(e)
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to get liked post ids",
+                        "error message": error_message,
+                    }
+                ),
+                500,
+            )
+
     @app.route("/api/like/<int:event_id>", methods=["POST"])
     @jwt_required()
     def like_post(event_id):
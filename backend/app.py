@@ -6,7 +6,6 @@ import json
 import os
 from pathlib import Path
 
-
 # from models import User
 from datetime import datetime, timedelta, timezone
 from flask_jwt_extended import (
@@ -37,6 +36,20 @@ if url.startswith("postgres://"):
 SQLALCHEMY_DATABASE_URI = url
 app.config["SQLALCHEMY_DATABASE_URI"] = SQLALCHEMY_DATABASE_URI
 
+# Uploaded images are stored on disk, keyed by the hash of their content
+IMAGE_STORE = "image-store"
+app.config["IMAGE_STORE_PATH"] = os.getenv(
+    "IMAGE_STORE_PATH", str(Path(basedir).joinpath(IMAGE_STORE))
+)
+# Largest accepted image upload, enforced while the upload is streamed to disk
+app.config["MAX_IMAGE_UPLOAD_BYTES"] = int(
+    os.getenv("MAX_IMAGE_UPLOAD_BYTES", 10 * 1024 * 1024)
+)
+# Seconds between the refreshes of a web worker's in-memory autosuggest index from the database
+app.config["SUGGESTION_INDEX_MAX_AGE"] = int(os.getenv("SUGGESTION_INDEX_MAX_AGE", 60))
+# Milliseconds between flushes of the likes a web worker buffers, 0 writes every like right away
+app.config["LIKE_BUFFER_FLUSH_MS"] = int(os.getenv("LIKE_BUFFER_FLUSH_MS", 0))
+
 bootstrap = Bootstrap(app)
 # Initialize DB
 db = SQLAlchemy(app)
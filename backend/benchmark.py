@@ -0,0 +1,220 @@
+"""
+Benchmark of the hot queries of the datalayers, without and with the indexes of models.py.
+
+Usage (from the repository root):
+    python -m backend.benchmark [--events 100000] [--repeat 20] [--database-url URL]
+
+Fills a scratch database with generated users, tags, events and likes, then times
+every query with only the primary keys and unique constraints, and again once the
+indexes are created (see `python -m backend.migrate indexes`). The database is a
+temporary SQLite file unless --database-url names an empty database to fill.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from .app import db
+from .models import (
+    Event,
+    Like,
+    Tag,
+    User,
+    event_tags,
+    filter_key,
+    EVENT_ALPHABETICAL_KEY,
+    EVENT_TRENDING_KEY,
+)
+
+USER_COUNT = 1000
+TAG_COUNT = 20
+MAX_LIKES_PER_EVENT = 5
+# Events are generated over the past years and the next months, like a feed that grew over time
+PAST_DAYS = 4 * 365
+UPCOMING_DAYS = 180
+LOCATIONS = ["Toronto", "UC College", "Hart House", "Robarts Library", "Bahen Centre"]
+PAGE_SIZE = 30
+
+
+def fill_database(connection, event_count):
+    """
+    Inserts the generated rows, in batches.
+    """
+    rng = random.Random(0)
+    now = datetime.now()
+    connection.execute(
+        User.__table__.insert(),
+        [
+            {
+                "id": user_id,
+                "username": f"user{user_id}",
+                "email": f"user{user_id}@example.com",
+                "password_hash": "benchmark",
+                "password_salt": "benchmark",
+            }
+            for user_id in range(1, USER_COUNT + 1)
+        ],
+    )
+    connection.execute(
+        Tag.__table__.insert(),
+        [{"id": tag_id, "name": f"Tag {tag_id}"} for tag_id in range(1, TAG_COUNT + 1)],
+    )
+
+    batch_size = 10000
+    for first_id in range(1, event_count + 1, batch_size):
+        events, tags, likes = [], [], []
+        for event_id in range(first_id, min(first_id + batch_size, event_count + 1)):
+            start_time = now + timedelta(
+                hours=rng.randint(-PAST_DAYS * 24, UPCOMING_DAYS * 24)
+            )
+            location = rng.choice(LOCATIONS)
+            club = f"Club {rng.randint(1, 500)}"
+            like_users = rng.sample(
+                range(1, USER_COUNT + 1), rng.randint(0, MAX_LIKES_PER_EVENT)
+            )
+            events.append(
+                {
+                    "id": event_id,
+                    "title": f"Event {rng.randint(1, 10 ** 6)}",
+                    "description": "Generated by the benchmark",
+                    "location": location,
+                    "location_key": filter_key(location),
+                    "start_time": start_time,
+                    "end_time": start_time + timedelta(hours=rng.randint(1, 4)),
+                    "author_id": rng.randint(1, USER_COUNT),
+                    "is_published": True,
+                    "like_count": len(like_users),
+                    "club": club,
+                    "club_key": filter_key(club),
+                }
+            )
+            tags.append({"event_id": event_id, "tag_id": rng.randint(1, TAG_COUNT)})
+            for user_id in like_users:
+                likes.append({"user_id": user_id, "event_id": event_id})
+        connection.execute(Event.__table__.insert(), events)
+        connection.execute(event_tags.insert(), tags)
+        connection.execute(Like.__table__.insert(), likes)
+
+
+def hot_queries():
+    """
+    Returns the queries to time, by name. They are the queries of the datalayers,
+    reduced to the columns their filters and orders need.
+    """
+    now = datetime.now()
+    unexpired = Event.end_time > now
+    return {
+        "unexpired feed page": select(Event.id)
+        .where(unexpired)
+        .order_by(Event.id)
+        .limit(PAGE_SIZE),
+        "date range filter": select(Event.id).where(
+            unexpired,
+            Event.start_time >= now + timedelta(days=30),
+            Event.end_time < now + timedelta(days=31),
+        ),
+        "location filter": select(Event.id)
+        .where(unexpired, Event.location_key == filter_key("Hart House"))
+        .order_by(Event.id)
+        .limit(PAGE_SIZE),
+        "tag filter": select(Event.id)
+        .join(event_tags)
+        .where(unexpired, event_tags.c.tag_id == 3)
+        .order_by(Event.id)
+        .limit(PAGE_SIZE),
+        "alphabetical page": select(Event.id)
+        .where(unexpired)
+        .order_by(EVENT_ALPHABETICAL_KEY, Event.id)
+        .limit(PAGE_SIZE),
+        "trending page": select(Event.id)
+        .where(unexpired)
+        .order_by(EVENT_TRENDING_KEY.desc(), Event.id)
+        .limit(PAGE_SIZE),
+        "events of a tag": select(Event.id)
+        .join(event_tags)
+        .where(event_tags.c.tag_id == 3),
+        "authored events": select(Event.id).where(Event.author_id == 7),
+        "liked events": select(Like.event_id).where(Like.user_id == 7),
+        "favourites page": select(Event.id)
+        .join(Like, Like.event_id == Event.id)
+        .where(Like.user_id == 7)
+        .order_by(Like.id.desc())
+        .limit(PAGE_SIZE),
+        "like lookup": select(Like.id).where(Like.user_id == 7, Like.event_id == 7),
+        "likes of an event": select(func.count(Like.id)).where(Like.event_id == 7),
+    }
+
+
+def time_queries(connection, repeat):
+    """
+    Returns the median latency in milliseconds of every hot query.
+    """
+    latencies = {}
+    for name, query in hot_queries().items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(query).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        latencies[name] = statistics.median(timings)
+    return latencies
+
+
+def analyze(connection):
+    if connection.dialect.name in ("sqlite", "postgresql"):
+        connection.execute(text("ANALYZE"))
+
+
+def run_benchmark(database_url, event_count, repeat):
+    """
+    Returns the median latencies of the hot queries without and with the indexes.
+    """
+    engine = create_engine(database_url)
+    indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+    with engine.begin() as connection:
+        db.metadata.create_all(connection)
+        for index in indexes:
+            connection.execute(DropIndex(index, if_exists=True))
+        fill_database(connection, event_count)
+        analyze(connection)
+    with engine.connect() as connection:
+        before = time_queries(connection, repeat)
+
+    with engine.begin() as connection:
+        for index in indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+        analyze(connection)
+    with engine.connect() as connection:
+        after = time_queries(connection, repeat)
+    engine.dispose()
+    return before, after
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.benchmark")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or "sqlite:///{}".format(
+            os.path.join(directory, "benchmark.db")
+        )
+        before, after = run_benchmark(database_url, args.events, args.repeat)
+
+    print(f"Median latency at {args.events} events, in milliseconds")
+    print(f"{'query':<22}{'before':>10}{'after':>10}")
+    for name in before:
+        print(f"{name:<22}{before[name]:>10.2f}{after[name]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
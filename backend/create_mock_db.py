@@ -49,6 +49,17 @@ def create_mock_events():
     with open(image_file_path, "rb") as image_file:
         image_data = image_file.read()
 
+    # Every mock event shares the same image, which the image store only keeps once
+    from .datalayer.image import ImageDataLayer
+
+    image_hash, image_size, image_mimetype = ImageDataLayer().store_image(image_data)
+    image_fields = dict(
+        image_hash=image_hash,
+        image_size=image_size,
+        image_mimetype=image_mimetype,
+        image_placeholder=ImageDataLayer().create_placeholder(image_hash),
+    )
+
     events = [
         (Event(
             title="Fall Career Week",
@@ -61,7 +72,7 @@ def create_mock_events():
             is_published=True,
             like_count=0,
             club="YNCN, You're Next Career Networks",
-            image=image_data
+            **image_fields
         ),
         ["Career Development"]),
         (Event(
@@ -75,7 +86,7 @@ def create_mock_events():
             is_published=True,
             like_count=10,
             club="Origami club",
-            image=image_data
+            **image_fields
         ),[]),
         (Event(
             title="Community Soccer Match",
@@ -88,7 +99,7 @@ def create_mock_events():
             is_published=True,
             like_count=5,
             club="Skule Soccer",
-            image=image_data
+            **image_fields
         ),[]),
         (Event(
             title="Hockey Game",
@@ -100,7 +111,7 @@ def create_mock_events():
             author_id=None,
             is_published=True,
             like_count=10,
-            image=image_data
+            **image_fields
         ),
         ["Clubs & Organizations", "Arts & Culture", "Academic"]),
         (Event(
@@ -114,7 +125,7 @@ def create_mock_events():
             is_published=True,
             like_count=5,
             club="Lesa",
-            image=image_data
+            **image_fields
         ),[]),
         (Event(
             title="Skateboard Contest",
@@ -126,7 +137,7 @@ def create_mock_events():
             author_id=None,
             is_published=True,
             like_count=10,
-            image=image_data
+            **image_fields
         ),[])
     ]
     return events
@@ -3,6 +3,7 @@ class DataLayer():
     ALREADY_EXISTS = "already exists"
     SHOULD_NOT_BE_EMPTY = "should not be empty"
     SHOULD_BE_LESS_THAN_255_CHARACTERS = "should be less than 255 characters"
+    SHOULD_BE_AT_MOST = "should be at most"
     IS_NOT_GIVEN_IN_CORRECT_FORMAT = "is not given in correct format"
     UNABLE_TO_POST = "unable to post"
     WAS_NOT_PUBLISHED = "was not published"
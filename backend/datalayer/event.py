@@ -1,10 +1,25 @@
 from ..app import app, db
-from ..models import User, Event, Tag, event_tags
+from ..models import (
+    User,
+    Event,
+    Tag,
+    event_tags,
+    filter_key,
+    EVENT_ALPHABETICAL_KEY,
+    EVENT_TRENDING_KEY,
+)
 from .abstract import DataLayer
-
-from datetime import datetime
+from .image import ImageDataLayer
+from .search import SearchDataLayer
+from .suggestion import SuggestionDataLayer
+
+from datetime import datetime, timedelta
+import base64
+import binascii
+import json
 import logging
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_, not_, func, case, select
+from sqlalchemy.orm import selectinload
 from PIL import Image
 import io
 
@@ -20,7 +35,11 @@ class Event(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     is_published = db.Column(db.Boolean, nullable=False, default=False)
     like_count = db.Column(db.Integer, default=0)
-    image = db.Column(db.LargeBinary, nullable=True)
+    image = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    image_hash = db.Column(db.Text, nullable=True)
+    image_size = db.Column(db.Integer, nullable=True)
+    image_mimetype = db.Column(db.Text, nullable=True)
+    image_placeholder = db.Column(db.Text, nullable=True)
     club = db.Column(db.Text)
     
      # Define a many-to-many relationship with tags through the event_tags table
@@ -29,6 +48,21 @@ class Event(db.Model):
 
 
 class EventDataLayer(DataLayer):
+    # The sort modes of search_filter_sort, every other sort_by sorts by id
+    SORT_NAMES = ["alphabetical", "date", "trending", "relevance"]
+    # Type of the sort key in the position of a page sorted by each sort name, the date
+    # in ISO format. Pages sorted by id are positioned by the id alone.
+    CURSOR_KEY_TYPES = {
+        "id": None,
+        "alphabetical": (str,),
+        "date": (str,),
+        "trending": (int,),
+        "relevance": (int, float),
+    }
+    # Locations and clubs are filtered by their whole value, or by a part of it for free text
+    MATCH_EXACT = "exact"
+    MATCH_SUBSTRING = "substring"
+
     def helper_check_times(self, start_time: datetime, end_time: datetime) -> bool:
         """
         Given a start and end time, it returns whether both are valid.
@@ -124,6 +158,20 @@ class EventDataLayer(DataLayer):
                 raise TypeError(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
         return True
 
+    def helper_set_image(self, event: Event, image: bytes):
+        """
+        Given an event and an image, it stores the image in the image store
+        and points the event at it.
+        """
+        image_data = ImageDataLayer()
+        image_hash, image_size, image_mimetype = image_data.store_image(image)
+        event.image_hash = image_hash
+        event.image_size = image_size
+        event.image_mimetype = image_mimetype
+        event.image_placeholder = image_data.create_placeholder(image_hash)
+        # The bytes now live in the image store rather than the database
+        event.image = None
+
     def create_event(
         self,
         title,
@@ -163,12 +211,14 @@ class EventDataLayer(DataLayer):
         event.author_id = author_id
         event.is_published = is_published
         event.club = club
-        event.image = image
+        if image is not None:
+            self.helper_set_image(event, image)
 
         with app.app_context():
             # Add the event to the database
             db.session.add(event)
             db.session.commit()
+            SearchDataLayer().index_trigrams(event.id, title, club)
 
             event.tags = []
             if tags:
@@ -179,23 +229,238 @@ class EventDataLayer(DataLayer):
 
             # Commit the changes to the session after adding tags
             db.session.commit()
+
+            SuggestionDataLayer().index_event(
+                event.id, title, club, event.like_count, event.end_time
+            )
             return event.id
 
-    def get_search_results_by_keyword(self, keyword):
-        keyword_word_pattern = "% {}%".format(keyword)
-        keyword_start_pattern = "{}%".format(keyword)
+    def get_search_results_by_keyword(self, keyword, sort_by=None):
+        """
+        Returns the events with a word starting with the keyword, ordered by id, or best
+        match first if sort_by is "relevance".
+        When there are few of them, they are followed by the events whose title or club
+        is similar to the keyword, most similar first.
+        Uses the search indexes, see datalayer/search.py.
+        """
+        search_data = SearchDataLayer()
         with app.app_context():
-            query = Event.query.filter(
-                or_(
-                    Event.title.ilike(keyword_word_pattern),
-                    Event.club.ilike(keyword_word_pattern),
-                    Event.title.ilike(keyword_start_pattern),
-                    Event.club.ilike(keyword_start_pattern),
-                )
-            )
+            relevance = None
+            if sort_by == "relevance":
+                relevance = search_data.keyword_relevance(keyword)
+            if relevance is not None:
+                query = Event.query.join(
+                    relevance, relevance.c.event_id == Event.id
+                ).order_by(relevance.c.relevance.desc(), Event.id)
+            else:
+                query = Event.query.filter(
+                    search_data.keyword_filter(keyword)
+                ).order_by(Event.id)
             results = query.all()
+
+            if search_data.helper_use_fuzzy(keyword, len(results)):
+                similar = search_data.fuzzy_similarity(keyword)
+                found_ids = [event.id for event in results]
+                results += (
+                    Event.query.join(similar, similar.c.event_id == Event.id)
+                    .filter(Event.id.notin_(found_ids))
+                    .order_by(similar.c.similarity.desc(), Event.id)
+                    .all()
+                )
             return results
 
+    def helper_encode_cursor(self, position: dict) -> str:
+        """
+        Given the position after the last event of a page, it returns an opaque cursor
+        for the next page.
+        """
+        data = json.dumps(position, default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode("ascii")
+
+    def helper_decode_cursor(self, cursor: str) -> dict:
+        """
+        Given a cursor returned with a page, it returns the position it points at.
+        """
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (binascii.Error, UnicodeError, ValueError):
+            position = None
+        if not isinstance(position, dict):
+            logging.info(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+            raise ValueError(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+        return position
+
+    def helper_valid_position(self, after, key_types=None) -> bool:
+        """
+        Given the position of a cursor, it returns whether it is a list of a sort key of one of
+        key_types, unless key_types is None, and an event id.
+        """
+        expected = ([key_types] if key_types is not None else []) + [(int,)]
+        return (
+            isinstance(after, list)
+            and len(after) == len(expected)
+            and all(
+                isinstance(value, types) and not isinstance(value, bool)
+                for value, types in zip(after, expected)
+            )
+        )
+
+    def helper_decode_page_cursor(self, cursor: str, sort_name: str):
+        """
+        Given a cursor of a page sorted by sort_name, it returns the position it points at,
+        or None for the first page.
+        """
+        if not cursor:
+            return None
+        position = self.helper_decode_cursor(cursor)
+        after = position.get("after")
+        key_types = self.CURSOR_KEY_TYPES[sort_name]
+        valid = position.get("sort") == sort_name and (
+            self.helper_valid_position(after, key_types)
+            # Without a keyword, pages sorted by relevance are sorted by id
+            or (sort_name == "relevance" and self.helper_valid_position(after))
+        )
+        if valid and sort_name == "date":
+            try:
+                after[0] = datetime.fromisoformat(after[0])
+            except (TypeError, ValueError):
+                valid = False
+        if not valid:
+            logging.info(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+            raise ValueError(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+        return after
+
+    def helper_keyset_page(self, query, limit, after=None, key=None, descending=False):
+        """
+        Given an event query, it returns up to limit (or all) of its events after the given position,
+        each with its own position, and whether there are more events.
+        Events are ordered by key then id, or by id if key is None. The position of an
+        event is [key, id], or [id], so deep pages are found by the index like the first.
+        """
+        if key is None:
+            if after is not None:
+                query = query.filter(Event.id > after[-1])
+            query = query.order_by(Event.id)
+        else:
+            query = query.add_columns(key.label("sort_key"))
+            if after is not None:
+                last_key, last_id = after
+                beyond = key < last_key if descending else key > last_key
+                query = query.filter(
+                    or_(beyond, and_(key == last_key, Event.id > last_id))
+                )
+            query = query.order_by(key.desc() if descending else key, Event.id)
+
+        if limit is None:
+            rows = query.all()
+        else:
+            rows = query.limit(limit + 1).all()
+        page = []
+        for row in rows[:limit]:
+            if key is None:
+                page.append((row, [row.id]))
+            else:
+                page.append((row[0], [row.sort_key, row[0].id]))
+        return page, limit is not None and len(rows) > limit
+
+    def get_search_results_page(
+        self, keyword, limit, cursor=None, sort_by=None, include_total=False
+    ):
+        """
+        Returns a page of get_search_results_by_keyword: a tuple of up to limit events,
+        the cursor of the next page or None if it is the last one, and the total number
+        of results if include_total is set, otherwise None.
+        """
+        search_data = SearchDataLayer()
+        position = self.helper_decode_cursor(cursor) if cursor else {}
+        phase = position.get("phase", "exact")
+        after = position.get("after")
+        seen = position.get("seen", 0)
+        # Exact matches are positioned by their id, or their relevance and id, and
+        # typo-tolerant matches by their similarity and id
+        key_types = (int, float)
+        if phase == "exact" and sort_by != "relevance":
+            key_types = None
+        valid = (
+            phase in ("exact", "fuzzy")
+            and isinstance(seen, int)
+            and not isinstance(seen, bool)
+            and (after is None or self.helper_valid_position(after, key_types))
+        )
+        if not valid:
+            logging.info(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+            raise ValueError(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+        page = []
+        next_position = None
+
+        with app.app_context():
+            keyword_filter = search_data.keyword_filter(keyword)
+            if phase == "exact":
+                relevance = None
+                if sort_by == "relevance":
+                    relevance = search_data.keyword_relevance(keyword)
+                if relevance is not None:
+                    query = Event.query.join(
+                        relevance, relevance.c.event_id == Event.id
+                    )
+                    page, more = self.helper_keyset_page(
+                        query, limit, after, relevance.c.relevance, descending=True
+                    )
+                else:
+                    page, more = self.helper_keyset_page(
+                        Event.query.filter(keyword_filter), limit, after
+                    )
+                seen += len(page)
+                if more:
+                    next_position = {
+                        "phase": "exact",
+                        "after": page[-1][1],
+                        "seen": seen,
+                    }
+                elif search_data.helper_use_fuzzy(keyword, seen):
+                    phase = "fuzzy"
+                    after = None
+
+            if phase == "fuzzy":
+                # Typo-tolerant matches follow the exact ones, most similar first.
+                # With a full page, this only checks whether there are any.
+                similar = search_data.fuzzy_similarity(keyword)
+                query = Event.query.join(
+                    similar, similar.c.event_id == Event.id
+                ).filter(not_(keyword_filter))
+                fuzzy_page, more = self.helper_keyset_page(
+                    query,
+                    limit - len(page),
+                    after,
+                    similar.c.similarity,
+                    descending=True,
+                )
+                page += fuzzy_page
+                if more:
+                    last_position = page[-1][1] if fuzzy_page else None
+                    next_position = {"phase": "fuzzy", "after": last_position}
+
+            total = None
+            if include_total:
+                total = (
+                    db.session.query(func.count(Event.id))
+                    .filter(keyword_filter)
+                    .scalar()
+                )
+                if search_data.helper_use_fuzzy(keyword, total):
+                    similar = search_data.fuzzy_similarity(keyword)
+                    total += (
+                        db.session.query(func.count(Event.id))
+                        .join(similar, similar.c.event_id == Event.id)
+                        .filter(not_(keyword_filter))
+                        .scalar()
+                    )
+
+        next_cursor = None
+        if next_position is not None:
+            next_cursor = self.helper_encode_cursor(next_position)
+        return [event for event, _ in page], next_cursor, total
+
     def update_event(
         self,
         event_id,
@@ -235,7 +500,8 @@ class EventDataLayer(DataLayer):
             event.is_published = is_published
             event.club = club
             if image is not None:
-                event.image = image
+                self.helper_set_image(event, image)
+            SearchDataLayer().index_trigrams(event_id, title, club)
             db.session.commit()
 
             event.tags = []
@@ -248,6 +514,10 @@ class EventDataLayer(DataLayer):
             # Commit the changes to the session after adding tags
             db.session.commit()
 
+            SuggestionDataLayer().index_event(
+                event_id, title, club, event.like_count, event.end_time
+            )
+
     def get_all_events(self):
         """
         Returns all events.
@@ -259,17 +529,38 @@ class EventDataLayer(DataLayer):
     def get_all_unexpired_events(self):
         """
         Returns all events that are not happening in the past.
-        Orders them by event_id.
+        Orders them by event_id. Tags are preloaded in one batched query.
         """
         with app.app_context():
             current_time = datetime.now()
             unexpired_events = (
-                Event.query.filter(Event.end_time > current_time)
+                Event.query.options(selectinload(Event.tags))
+                .filter(Event.end_time > current_time)
                 .order_by(Event.id)
                 .all()
             )
             return unexpired_events
 
+    def get_unexpired_events_page(self, limit, cursor=None):
+        """
+        Returns a page of get_all_unexpired_events: a tuple of up to limit events and the
+        cursor of the next page, or None if it is the last one.
+        """
+        after = self.helper_decode_page_cursor(cursor, "id")
+        with app.app_context():
+            current_time = datetime.now()
+            query = Event.query.options(selectinload(Event.tags)).filter(
+                Event.end_time > current_time
+            )
+            page, more = self.helper_keyset_page(query, limit, after)
+
+        next_cursor = None
+        if more:
+            next_cursor = self.helper_encode_cursor(
+                {"sort": "id", "after": page[-1][1]}
+            )
+        return [event for event, _ in page], next_cursor
+
     def get_all_locations(self):
         with app.app_context():
             current_time = datetime.now()
@@ -319,10 +610,12 @@ class EventDataLayer(DataLayer):
 
     def get_event_by_id(self, id):
         """
-        Returns the event with the given id.
+        Returns the event with the given id, with its tags preloaded.
         """
         with app.app_context():
-            event = Event.query.filter_by(id=id).first()
+            event = (
+                Event.query.options(selectinload(Event.tags)).filter_by(id=id).first()
+            )
             if event is None:
                 logging.info(f"Event with id {id} {self.DOES_NOT_EXIST}")
                 raise ValueError(f"Event with id {id} {self.DOES_NOT_EXIST}")
@@ -339,15 +632,22 @@ class EventDataLayer(DataLayer):
                 raise ValueError(
                     f"Event with id {id} does not exist and cannot be deleted"
                 )
+            SearchDataLayer().remove_trigrams(id)
             db.session.delete(event)
             db.session.commit()
 
+        SuggestionDataLayer().remove_event(id)
+
     def get_authored_events(self, author_id):
         """
-        Returns all events authored by the given author_id.
+        Returns all events authored by the given author_id, with their tags preloaded.
         """
         with app.app_context():
-            events = Event.query.filter_by(author_id=author_id).all()
+            events = (
+                Event.query.options(selectinload(Event.tags))
+                .filter_by(author_id=author_id)
+                .all()
+            )
             if events is None:
                 logging.info(f"Event with author_id {author_id} {self.DOES_NOT_EXIST}")
                 raise ValueError(f"Event with id {author_id} {self.DOES_NOT_EXIST}")
@@ -363,21 +663,51 @@ class EventDataLayer(DataLayer):
                 return []
             return event.tags
 
+    def get_event_image(self, event_id):
+        """
+        Returns the image_hash and image_mimetype of the event with the given id.
+        For events whose image has not been moved to the image store yet, the
+        legacy image bytes are returned as image instead.
+        This is the only read path that loads the deferred image column.
+        """
+        with app.app_context():
+            row = (
+                db.session.query(
+                    Event.image_hash,
+                    Event.image_mimetype,
+                    case((Event.image_hash.is_(None), Event.image)).label("image"),
+                )
+                .filter(Event.id == event_id)
+                .first()
+            )
+            if row is None:
+                logging.info(f"Event with id {event_id} {self.DOES_NOT_EXIST}")
+                raise ValueError(f"Event with id {event_id} {self.DOES_NOT_EXIST}")
+            return row
+
     def update_image(self, event_id, image):
         with app.app_context():
             event = Event.query.filter_by(id=event_id).first()
             if image is not None:
-                try:
-                    # make sure the image can be opened (given in correct format)
-                    Image.open(io.BytesIO(image))
-                except Exception as e:
-                    logging.info(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
-                    raise TypeError(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
-
-            event.image = image
+                # store_image makes sure the image can be opened (given in correct format)
+                self.helper_set_image(event, image)
+            else:
+                event.image = None
+                event.image_hash = None
+                event.image_size = None
+                event.image_mimetype = None
+                event.image_placeholder = None
             db.session.commit()
 
-    def search_filter_sort(
+    def helper_start_of_day(self, day) -> datetime:
+        """
+        Given a date as a "%Y-%m-%d" string or a datetime, it returns the datetime its day starts at.
+        """
+        if isinstance(day, str):
+            return datetime.strptime(day, "%Y-%m-%d")
+        return datetime.combine(day.date(), datetime.min.time())
+
+    def helper_filter_query(
         self,
         tag_name=None,
         location=None,
@@ -386,101 +716,181 @@ class EventDataLayer(DataLayer):
         end_time=None,
         keyword=None,
         sort_by=None,
+        match=MATCH_EXACT,
     ):
         """
-        Returns a list of Event objects based on the optional tag name, search keyword, and sort criteria.
+        Returns a tuple of the query of the unexpired events matching the optional tag name,
+        location, club, times and search keyword, and the key they are sorted by with whether
+        it is descending (see helper_keyset_page), or None if no event can match.
+        The location and club are matched case-insensitively, as a whole by their indexed keys,
+        or anywhere in the value if match is MATCH_SUBSTRING.
+        Must be called in an app context.
         """
+        # Base query without any filters
+        query = Event.query.options(selectinload(Event.tags))
 
-        with app.app_context():
-            # Base query without any filters
-            query = Event.query
+        # Always get the unexpired events
+        current_time = datetime.now()
+        query = query.filter(Event.end_time > current_time)
 
-            # Always get the unexpired events
-            current_time = datetime.now()
-            query = query.filter(Event.end_time > current_time)
+        # Add tag filter if tag_name is provided
+        if tag_name is not None and tag_name != "All":
+            tag = Tag.query.filter_by(name=tag_name).first()
+            # if a field doesn't exist, then the result will be empty
+            if tag is None:
+                return None
+            query = query.join(event_tags).join(Tag).filter(Tag.id == tag.id)
+
+        if location is not None and len(location) > 0 and location != "All":
+            if match == self.MATCH_SUBSTRING:
+                query = query.filter(Event.location.ilike("%{}%".format(location)))
+            else:
+                query = query.filter(Event.location_key == filter_key(location))
 
-            # Add search filters if keyword is provided
-            if keyword is not None and len(keyword) > 0:
-                keyword_word_pattern = "% {}%".format(keyword)
-                keyword_start_pattern = "{}%".format(keyword)
+        if club is not None and len(club) > 0 and club != "All":
+            if match == self.MATCH_SUBSTRING:
+                query = query.filter(Event.club.ilike("%{}%".format(club)))
+            else:
+                query = query.filter(Event.club_key == filter_key(club))
+
+        if start_time is not None and end_time is not None:
+            if " " in str(start_time) and " " in str(end_time):
+                start_datetime = (
+                    datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+                    if isinstance(start_time, str)
+                    else start_time
+                )
+                end_datetime = (
+                    datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
+                    if isinstance(end_time, str)
+                    else end_time
+                )
                 query = query.filter(
-                    or_(
-                        Event.title.ilike(keyword_word_pattern),
-                        Event.club.ilike(keyword_word_pattern),
-                        Event.title.ilike(keyword_start_pattern),
-                        Event.club.ilike(keyword_start_pattern),
+                    Event.start_time >= start_datetime,
+                    Event.end_time <= end_datetime,
+                )
+            else:
+                start_date = self.helper_start_of_day(start_time)
+                end_date = self.helper_start_of_day(end_time)
+                # Half-open ranges of timestamps, so the indexes on the times can be used
+                query = query.filter(
+                    and_(
+                        Event.start_time >= start_date,
+                        Event.end_time < end_date + timedelta(days=1),
                     )
                 )
+        elif start_time is not None and end_time is None:
+            if " " in start_time:
+                start_time = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+                query = query.filter(Event.start_time == start_time)
+            else:
+                start_date = self.helper_start_of_day(start_time)
+                query = query.filter(
+                    Event.start_time >= start_date,
+                    Event.start_time < start_date + timedelta(days=1),
+                )
 
-            # Add tag filter if tag_name is provided
-            if tag_name is not None and tag_name != "All":
-                tag = Tag.query.filter_by(name=tag_name).first()
-                # if a field doesn't exist, then the result will be empty
-                if tag is None:
-                    return []
-                query = query.join(event_tags).join(Tag).filter(Tag.id == tag.id)
-
-            if location is not None and len(location) > 0 and location != "All":
-                query = query.filter(Event.location.ilike("%{}%".format(location)))
+        key = None
+        descending = False
+        # Add search filters if keyword is provided
+        if keyword is not None and len(keyword) > 0:
+            search_data = SearchDataLayer()
+            keyword_filter = search_data.keyword_filter(keyword)
+            relevance = None
+            if sort_by == "relevance":
+                relevance = search_data.keyword_relevance(keyword)
+            if relevance is not None:
+                # Best matches first, ranked from the search index
+                query = query.outerjoin(relevance, relevance.c.event_id == Event.id)
+                keyword_filter = relevance.c.event_id.isnot(None)
+                key = func.coalesce(relevance.c.relevance, -1.0)
+                descending = True
+
+            # Typo-tolerant matches are only used when nothing matches exactly, so they
+            # never come before exact matches in the requested order
+            has_results = (
+                query.filter(keyword_filter).with_entities(Event.id).first() is not None
+            )
+            if not has_results and search_data.helper_use_fuzzy(keyword, 0):
+                # Match the events whose title or club is similar to the keyword instead
+                similar = search_data.fuzzy_similarity(keyword)
+                keyword_filter = Event.id.in_(select(similar.c.event_id))
+            query = query.filter(keyword_filter)
+
+        # Add sorting logic if sortby is provided
+        if sort_by == "alphabetical":
+            key = EVENT_ALPHABETICAL_KEY
+        elif sort_by == "date":
+            key = Event.start_time
+        elif sort_by == "trending":
+            key = EVENT_TRENDING_KEY
+            descending = True
+        return query, key, descending
 
-            if club is not None and len(club) > 0 and club != "All":
-                query = query.filter(Event.club.ilike("%{}%".format(club)))
+    def search_filter_sort(
+        self,
+        tag_name=None,
+        location=None,
+        club=None,
+        start_time=None,
+        end_time=None,
+        keyword=None,
+        sort_by=None,
+        match=MATCH_EXACT,
+    ):
+        """
+        Returns a list of Event objects based on the optional tag name, search keyword, and sort criteria.
+        Tags are preloaded in one batched query.
+        """
+        with app.app_context():
+            filtered = self.helper_filter_query(
+                tag_name, location, club, start_time, end_time, keyword, sort_by, match
+            )
+            if filtered is None:
+                return []
+            query, key, descending = filtered
 
-            if start_time is not None and end_time is not None:
-                if " " in str(start_time) and " " in str(end_time):
-                    start_datetime = (
-                        datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-                        if isinstance(start_time, str)
-                        else start_time
-                    )
-                    end_datetime = (
-                        datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
-                        if isinstance(end_time, str)
-                        else end_time
-                    )
-                    query = query.filter(
-                        Event.start_time >= start_datetime,
-                        Event.end_time <= end_datetime,
-                    )
-                else:
-                    start_date = datetime.strptime(start_time, "%Y-%m-%d")
-                    end_date = datetime.strptime(end_time, "%Y-%m-%d")
-                    start_date = (
-                        datetime.strptime(start_time, "%Y-%m-%d").date()
-                        if isinstance(start_time, str)
-                        else start_time.date()
-                    )
-                    end_date = (
-                        datetime.strptime(end_time, "%Y-%m-%d").date()
-                        if isinstance(end_time, str)
-                        else end_time.date()
-                    )
-                    query = query.filter(
-                        and_(
-                            func.date(Event.start_time) >= start_date,
-                            func.date(Event.end_time) <= end_date,
-                        )
-                    )
-            elif start_time is not None and end_time is None:
-                if " " in start_time:
-                    start_time = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-                    query = query.filter(Event.start_time == start_time)
-                else:
-                    start_date = datetime.strptime(start_time, "%Y-%m-%d")
-                    query = query.filter(
-                        func.date(Event.start_time) == func.date(start_date)
-                    )
+            # Execute the query and return the results
+            page, _ = self.helper_keyset_page(query, None, None, key, descending)
+            return [event for event, _ in page]
 
-            # Add sorting logic if sortby is provided
-            if sort_by == "alphabetical":
-                query = query.order_by(func.lower(Event.title))
-            elif sort_by == "date":
-                query = query.order_by(Event.start_time)
-            elif sort_by == "trending":
-                query = query.order_by(Event.like_count.desc())
-            else:
-                query = query.order_by(Event.id)
+    def search_filter_sort_page(
+        self,
+        limit,
+        cursor=None,
+        tag_name=None,
+        location=None,
+        club=None,
+        start_time=None,
+        end_time=None,
+        keyword=None,
+        sort_by=None,
+        match=MATCH_EXACT,
+    ):
+        """
+        Returns a page of search_filter_sort: a tuple of up to limit events and the cursor
+        of the next page, or None if it is the last one.
+        Pages are found from the position the cursor points at, so deep pages cost the same
+        as the first one.
+        """
+        sort_name = sort_by if sort_by in self.SORT_NAMES else "id"
+        after = self.helper_decode_page_cursor(cursor, sort_name)
 
-            # Execute the query and return the results
-            results = query.all()
-            return results
+        with app.app_context():
+            filtered = self.helper_filter_query(
+                tag_name, location, club, start_time, end_time, keyword, sort_by, match
+            )
+            if filtered is None:
+                return [], None
+            query, key, descending = filtered
+            if after is not None and len(after) != (1 if key is None else 2):
+                logging.info(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+                raise ValueError(f"Cursor {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+            page, more = self.helper_keyset_page(query, limit, after, key, descending)
+
+        next_cursor = None
+        if more:
+            next_cursor = self.helper_encode_cursor(
+                {"sort": sort_name, "after": page[-1][1]}
+            )
+        return [event for event, _ in page], next_cursor
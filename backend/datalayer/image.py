@@ -0,0 +1,350 @@
+from ..app import app
+from .abstract import DataLayer
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+from PIL import ExifTags, Image, ImageFilter, ImageOps
+import io
+import base64
+
+try:
+    # Registers the AVIF plugin on Pillow versions without built-in AVIF support
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+"""
+Images are stored on disk under app.config["IMAGE_STORE_PATH"], keyed by the
+SHA-256 hash of their content:
+
+    <IMAGE_STORE_PATH>/<hash[:2]>/<hash>                     the original upload
+    <IMAGE_STORE_PATH>/<hash[:2]>/<hash>.<size>              a resized variant, see IMAGE_SIZES
+    <IMAGE_STORE_PATH>/<hash[:2]>/<hash>.<size>.<encoding>   a transcoded variant, see IMAGE_ENCODINGS
+    <IMAGE_STORE_PATH>/uploads/<name>                        a raw upload waiting for the image worker
+
+The Event table only keeps the hash, size and MIME type of its image, so the
+same flyer uploaded for several events is only stored once.
+"""
+
+
+class ImageDataLayer(DataLayer):
+    """
+    The ImageDataLayer should be accessed by the rest of the code when trying to access the image files in the image store.
+    """
+
+    ORIGINAL = "original"
+    # Maximum width in pixels of every resized variant of an image
+    IMAGE_SIZES = {"card": 480, "detail": 1200}
+    # Modern encodings every size of an image is transcoded to, when Pillow can write them
+    IMAGE_ENCODINGS = {"avif": "image/avif", "webp": "image/webp"}
+    # Leading bytes of the image formats accepted as uploads, and at which offset they are
+    IMAGE_SIGNATURES = [
+        (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+        (0, b"\xff\xd8\xff", "image/jpeg"),
+        (0, b"GIF87a", "image/gif"),
+        (0, b"GIF89a", "image/gif"),
+        (8, b"WEBP", "image/webp"),
+        (4, b"ftypavif", "image/avif"),
+        (0, b"BM", "image/bmp"),
+        (0, b"II*\x00", "image/tiff"),
+        (0, b"MM\x00*", "image/tiff"),
+    ]
+    # Width in pixels of the placeholder inlined in event payloads
+    PLACEHOLDER_WIDTH = 16
+    # Uploads are streamed to disk in chunks of this many bytes
+    CHUNK_SIZE = 64 * 1024
+
+    def get_image_encodings(self) -> dict:
+        """
+        Returns the encodings of IMAGE_ENCODINGS that the installed Pillow can write,
+        mapped to their MIME type.
+        """
+        Image.init()
+        return {
+            encoding: mimetype
+            for encoding, mimetype in self.IMAGE_ENCODINGS.items()
+            if encoding.upper() in Image.SAVE
+        }
+
+    def helper_image_mimetype(self, image: bytes) -> str:
+        """
+        Given an image, it returns its MIME type.
+        Raises a TypeError if the image cannot be opened.
+        """
+        try:
+            with Image.open(io.BytesIO(image)) as opened_image:
+                image_format = opened_image.format
+        except Exception:
+            logging.info(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+            raise TypeError(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+        return Image.MIME.get(image_format, "application/octet-stream")
+
+    def helper_sniff_mimetype(self, header: bytes) -> str:
+        """
+        Given the first bytes of an image, it returns its MIME type without decoding the image.
+        Raises a TypeError if they do not start any of the accepted image formats.
+        """
+        for offset, signature, mimetype in self.IMAGE_SIGNATURES:
+            if header[offset : offset + len(signature)] == signature:
+                return mimetype
+        logging.info(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+        raise TypeError(f"Image {self.IS_NOT_GIVEN_IN_CORRECT_FORMAT}")
+
+    def helper_valid_size(self, size: str) -> bool:
+        """
+        Given an image size, it returns whether it is one of the stored sizes.
+        """
+        if size != self.ORIGINAL and size not in self.IMAGE_SIZES:
+            logging.info(f"Image size {size} {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Image size {size} {self.DOES_NOT_EXIST}")
+        return True
+
+    def helper_valid_encoding(self, encoding: str) -> bool:
+        """
+        Given an image encoding, it returns whether images are transcoded to it.
+        """
+        if encoding not in self.get_image_encodings():
+            logging.info(f"Image encoding {encoding} {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Image encoding {encoding} {self.DOES_NOT_EXIST}")
+        return True
+
+    def helper_link_file(self, source_path: Path, path: Path):
+        """
+        Makes path a hard link to source_path, or a copy of it if hard links are not supported.
+        """
+        try:
+            os.link(source_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(source_path, path)
+
+    def helper_write_file(self, path: Path, data: bytes):
+        """
+        Writes the data to a temporary file first so readers never see a partial file.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+    def get_image_path(
+        self, image_hash: str, size: str = ORIGINAL, encoding: str = None
+    ) -> Path:
+        """
+        Returns the path of the stored image with the given hash, size and encoding.
+        The encoding is None for the format the image was uploaded in.
+        """
+        image_path = Path(app.config["IMAGE_STORE_PATH"]) / image_hash[:2] / image_hash
+        if encoding is not None:
+            return image_path.with_name(f"{image_hash}.{size}.{encoding}")
+        if size == self.ORIGINAL:
+            return image_path
+        return image_path.with_name(f"{image_hash}.{size}")
+
+    def store_image(self, image: bytes):
+        """
+        Stores the given image and its resized and transcoded variants in the image store,
+        unless an identical image is already stored.
+        Returns a tuple of the image's hash, size in bytes and MIME type.
+        """
+        mimetype = self.helper_image_mimetype(image)
+        image_hash = hashlib.sha256(image).hexdigest()
+        image_path = self.get_image_path(image_hash)
+
+        if not image_path.exists():
+            self.helper_write_file(image_path, image)
+        for size in [self.ORIGINAL, *self.IMAGE_SIZES]:
+            if size != self.ORIGINAL:
+                self.get_image_variant_path(image_hash, size)
+            for encoding in self.get_image_encodings():
+                self.get_image_variant_path(image_hash, size, encoding)
+
+        return image_hash, len(image), mimetype
+
+    def create_placeholder(self, image_hash: str) -> str:
+        """
+        Returns a tiny blurred version of the stored image with the given hash, as a data URI
+        small enough to be inlined in event payloads.
+        """
+        source_path = self.get_image_variant_path(image_hash, "card")
+        with Image.open(source_path) as opened_image:
+            opened_image = ImageOps.exif_transpose(opened_image)
+            width, height = opened_image.size
+            placeholder_width = min(width, self.PLACEHOLDER_WIDTH)
+            placeholder = opened_image.convert("RGBA").resize(
+                (placeholder_width, max(1, round(height * placeholder_width / width))),
+                Image.BILINEAR,
+            )
+        placeholder = placeholder.filter(ImageFilter.GaussianBlur(1))
+
+        encodings = self.get_image_encodings()
+        encoding = "webp" if "webp" in encodings else "png"
+        mimetype = encodings.get(encoding, "image/png")
+        output = io.BytesIO()
+        placeholder.save(output, format=encoding.upper(), quality=40)
+        encoded = base64.b64encode(output.getvalue()).decode("ascii")
+        return f"data:{mimetype};base64,{encoded}"
+
+    def get_image_variant_path(
+        self, image_hash: str, size: str, encoding: str = None
+    ) -> Path:
+        """
+        Returns the path of the given size and encoding of the stored image with the given hash.
+        Variants are generated once, the first time they are needed, and kept in the image store.
+        """
+        self.helper_valid_size(size)
+        if encoding is not None:
+            self.helper_valid_encoding(encoding)
+        variant_path = self.get_image_path(image_hash, size, encoding)
+        if variant_path.exists():
+            return variant_path
+
+        image_path = self.get_image_path(image_hash)
+        if not image_path.exists():
+            logging.info(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+
+        if encoding is not None:
+            # Transcode the resized variant in the uploaded format
+            source_path = self.get_image_variant_path(image_hash, size)
+            if size != self.ORIGINAL and os.path.samefile(source_path, image_path):
+                # The resized variant is the original image, so is its transcoded variant
+                original_variant_path = self.get_image_variant_path(
+                    image_hash, self.ORIGINAL, encoding
+                )
+                self.helper_link_file(original_variant_path, variant_path)
+                return variant_path
+            with Image.open(source_path) as opened_image:
+                opened_image = ImageOps.exif_transpose(opened_image)
+                if opened_image.mode not in ("RGB", "RGBA"):
+                    opened_image = opened_image.convert("RGBA")
+                output = io.BytesIO()
+                opened_image.save(output, format=encoding.upper(), quality=80)
+            self.helper_write_file(variant_path, output.getvalue())
+            return variant_path
+
+        max_width = self.IMAGE_SIZES[size]
+        with Image.open(image_path) as opened_image:
+            # Photos are often stored sideways, with an EXIF tag saying how to turn them
+            upright = opened_image.getexif().get(ExifTags.Base.Orientation, 1) == 1
+            if upright and opened_image.width <= max_width:
+                # Never upscale, the variant is the original image
+                self.helper_link_file(image_path, variant_path)
+                return variant_path
+
+            image_format = opened_image.format
+            resized_image = ImageOps.exif_transpose(opened_image)
+        width, height = resized_image.size
+        if width > max_width:
+            resized_image = resized_image.resize(
+                (max_width, max(1, round(height * max_width / width))),
+                Image.LANCZOS,
+            )
+        output = io.BytesIO()
+        resized_image.save(output, format=image_format, optimize=True)
+        self.helper_write_file(variant_path, output.getvalue())
+        return variant_path
+
+    def get_stored_image_variant_path(
+        self, image_hash: str, size: str, encoding: str = None
+    ):
+        """
+        Returns the path of the given size and encoding of the stored image with the given hash,
+        or None if that variant has not been generated yet.
+        Unlike get_image_variant_path it never generates the variant, so requests never wait on it.
+        """
+        self.helper_valid_size(size)
+        if encoding is not None:
+            self.helper_valid_encoding(encoding)
+        variant_path = self.get_image_path(image_hash, size, encoding)
+        if variant_path.exists():
+            return variant_path
+        return None
+
+    def get_upload_path(self, upload_name: str) -> Path:
+        """
+        Returns the path of the raw upload with the given name.
+        """
+        return Path(app.config["IMAGE_STORE_PATH"]) / "uploads" / upload_name
+
+    def store_upload(self, image_stream) -> str:
+        """
+        Streams a raw upload from the given binary file object to disk, where it waits for
+        the image worker, without ever holding the whole upload in memory.
+        Only the header of the upload is checked here, the image worker decodes it.
+        Raises a ValueError if the upload is larger than app.config["MAX_IMAGE_UPLOAD_BYTES"].
+        Returns the name of the upload.
+        """
+        max_size = app.config["MAX_IMAGE_UPLOAD_BYTES"]
+        chunk = image_stream.read(self.CHUNK_SIZE)
+        self.helper_sniff_mimetype(chunk)
+
+        upload_name = uuid.uuid4().hex
+        upload_path = self.get_upload_path(upload_name)
+        upload_path.parent.mkdir(parents=True, exist_ok=True)
+        size = 0
+        try:
+            with open(upload_path, "wb") as upload_file:
+                while chunk:
+                    size += len(chunk)
+                    if size > max_size:
+                        logging.info(f"Image {self.SHOULD_BE_AT_MOST} {max_size} bytes")
+                        raise ValueError(
+                            f"Image {self.SHOULD_BE_AT_MOST} {max_size} bytes"
+                        )
+                    upload_file.write(chunk)
+                    chunk = image_stream.read(self.CHUNK_SIZE)
+        except Exception:
+            upload_path.unlink(missing_ok=True)
+            raise
+        return upload_name
+
+    def get_variants_upload_name(self, image_hash: str) -> str:
+        """
+        Returns the name of the raw upload queuing the stored image with the given hash
+        for the generation of its missing variants, see store_upload_from_image.
+        """
+        return f"{image_hash}.variants"
+
+    def store_upload_from_image(self, image_hash: str) -> str:
+        """
+        Queues the stored image with the given hash as a raw upload, so the image worker
+        can generate its missing variants. The upload is a hard link to the stored image.
+        Returns the name of the upload.
+        """
+        image_path = self.get_image_path(image_hash)
+        if not image_path.exists():
+            logging.info(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+        upload_name = self.get_variants_upload_name(image_hash)
+        upload_path = self.get_upload_path(upload_name)
+        upload_path.parent.mkdir(parents=True, exist_ok=True)
+        self.helper_link_file(image_path, upload_path)
+        return upload_name
+
+    def delete_upload(self, upload_name: str):
+        """
+        Removes the raw upload with the given name, if it still exists.
+        """
+        self.get_upload_path(upload_name).unlink(missing_ok=True)
+
+    def get_image(
+        self, image_hash: str, size: str = ORIGINAL, encoding: str = None
+    ) -> bytes:
+        """
+        Returns the bytes of the given size and encoding of the stored image with the given hash.
+        """
+        if size != self.ORIGINAL or encoding is not None:
+            return self.get_image_variant_path(image_hash, size, encoding).read_bytes()
+        image_path = self.get_image_path(image_hash)
+        if not image_path.exists():
+            logging.info(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Image {image_hash} {self.DOES_NOT_EXIST}")
+        return image_path.read_bytes()
@@ -0,0 +1,199 @@
+from ..app import app, db
+from ..models import Event, ImageJob
+from .abstract import DataLayer
+from .image import ImageDataLayer
+from sqlalchemy import and_, or_
+
+from datetime import datetime, timedelta
+import logging
+
+"""
+class ImageJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(
+        db.Integer, db.ForeignKey("event.id", ondelete="CASCADE"), nullable=False
+    )
+    upload_name = db.Column(db.Text, nullable=False)
+    # One of pending, processing, done or failed
+    status = db.Column(db.Text, nullable=False, default="pending", index=True)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.TIMESTAMP, nullable=False)
+    updated_at = db.Column(db.TIMESTAMP, nullable=False)
+"""
+
+
+class ImageJobDataLayer(DataLayer):
+    """
+    The ImageJobDataLayer should be accessed by the rest of the code when trying to access the ImageJob table in the database.
+    The ImageJob table is the queue of uploaded images that the image worker processes out of band.
+    """
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+    def create_job(self, event_id, image_stream):
+        """
+        Streams the raw upload from the given binary file object to disk and queues it
+        for the image worker.
+        Returns the id of the job.
+        """
+        with app.app_context():
+            if Event.query.filter_by(id=event_id).first() is None:
+                logging.info(f"Event with id {event_id} {self.DOES_NOT_EXIST}")
+                raise ValueError(f"Event with id {event_id} {self.DOES_NOT_EXIST}")
+
+            image_data = ImageDataLayer()
+            now = datetime.now()
+            job = ImageJob(
+                event_id=event_id,
+                upload_name=image_data.store_upload(image_stream),
+                status=self.PENDING,
+                created_at=now,
+                updated_at=now,
+            )
+            db.session.add(job)
+            db.session.commit()
+            return job.id
+
+    def create_variants_job(self, event_id, image_hash):
+        """
+        Queues the event's stored image with the given hash for the image worker, which
+        generates the variants it is missing.
+        Does nothing if a job of the event is already waiting or being processed, since that
+        job generates every variant anyway, or if generating the image's variants failed
+        before, so reading an image never queues it again and again.
+        Returns the id of the job, or None if no job was queued.
+        """
+        image_data = ImageDataLayer()
+        upload_name = image_data.get_variants_upload_name(image_hash)
+        with app.app_context():
+            queued = (
+                db.session.query(ImageJob.id)
+                .filter(
+                    or_(
+                        and_(
+                            ImageJob.event_id == event_id,
+                            ImageJob.status.in_([self.PENDING, self.PROCESSING]),
+                        ),
+                        and_(
+                            ImageJob.upload_name == upload_name,
+                            ImageJob.status == self.FAILED,
+                        ),
+                    )
+                )
+                .first()
+            )
+            if queued is not None:
+                return None
+
+            now = datetime.now()
+            job = ImageJob(
+                event_id=event_id,
+                upload_name=image_data.store_upload_from_image(image_hash),
+                status=self.PENDING,
+                created_at=now,
+                updated_at=now,
+            )
+            db.session.add(job)
+            db.session.commit()
+            return job.id
+
+    def get_job(self, job_id):
+        """
+        Returns the job with the given id.
+        """
+        with app.app_context():
+            job = ImageJob.query.filter_by(id=job_id).first()
+            if job is None:
+                logging.info(f"Image job with id {job_id} {self.DOES_NOT_EXIST}")
+                raise ValueError(f"Image job with id {job_id} {self.DOES_NOT_EXIST}")
+            return job
+
+    def claim_pending_jobs(self, limit):
+        """
+        Marks up to limit pending jobs as processing and returns them, oldest first.
+        A job is only ever claimed by one worker, even when several workers poll the queue.
+        """
+        with app.app_context():
+            pending_ids = [
+                row.id
+                for row in db.session.query(ImageJob.id)
+                .filter(ImageJob.status == self.PENDING)
+                .order_by(ImageJob.id)
+                .limit(limit)
+            ]
+            claimed_ids = []
+            for job_id in pending_ids:
+                claimed = ImageJob.query.filter_by(
+                    id=job_id, status=self.PENDING
+                ).update({"status": self.PROCESSING, "updated_at": datetime.now()})
+                if claimed:
+                    claimed_ids.append(job_id)
+            db.session.commit()
+
+            if not claimed_ids:
+                return []
+            return (
+                ImageJob.query.filter(ImageJob.id.in_(claimed_ids))
+                .order_by(ImageJob.id)
+                .all()
+            )
+
+    def requeue_stale_jobs(self, timeout: timedelta):
+        """
+        Puts the jobs that have been processing for longer than timeout back in the queue,
+        for example because the worker processing them crashed.
+        Returns the number of requeued jobs.
+        """
+        with app.app_context():
+            requeued = ImageJob.query.filter(
+                ImageJob.status == self.PROCESSING,
+                ImageJob.updated_at < datetime.now() - timeout,
+            ).update({"status": self.PENDING, "updated_at": datetime.now()})
+            db.session.commit()
+            return requeued
+
+    def finish_job(
+        self, job_id, image_hash, image_size, image_mimetype, image_placeholder=None
+    ):
+        """
+        Points the job's event at the processed image and marks the job as done.
+        Does nothing if the job was deleted meanwhile, e.g. with its event.
+        """
+        with app.app_context():
+            job = ImageJob.query.filter_by(id=job_id).first()
+            if job is None:
+                logging.info(f"Image job with id {job_id} {self.DOES_NOT_EXIST}")
+                return
+            Event.query.filter_by(id=job.event_id).update(
+                {
+                    "image": None,
+                    "image_hash": image_hash,
+                    "image_size": image_size,
+                    "image_mimetype": image_mimetype,
+                    "image_placeholder": image_placeholder,
+                }
+            )
+            job.status = self.DONE
+            job.error = None
+            job.updated_at = datetime.now()
+            db.session.commit()
+            ImageDataLayer().delete_upload(job.upload_name)
+
+    def fail_job(self, job_id, error: str):
+        """
+        Marks the job as failed, leaving the event's image unchanged.
+        Does nothing if the job was deleted meanwhile, e.g. with its event.
+        """
+        with app.app_context():
+            job = ImageJob.query.filter_by(id=job_id).first()
+            if job is None:
+                logging.info(f"Image job with id {job_id} {self.DOES_NOT_EXIST}")
+                return
+            job.status = self.FAILED
+            job.error = error
+            job.updated_at = datetime.now()
+            db.session.commit()
+            ImageDataLayer().delete_upload(job.upload_name)
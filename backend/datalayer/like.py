@@ -1,7 +1,26 @@
 from ..app import app, db
 from ..models import User, Event, Like
 from .abstract import DataLayer
+from sqlalchemy import (
+    Integer,
+    bindparam,
+    column,
+    delete,
+    exists,
+    func,
+    literal,
+    select,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import selectinload
+import atexit
 import logging
+import threading
+import time
 
 """
 class Like(db.Model):
@@ -10,63 +29,490 @@ class Like(db.Model):
     event_id = db.Column(db.Integer, db.ForeignKey("event.id"))
 """
 
+"""
+When app.config["LIKE_BUFFER_FLUSH_MS"] is set, likes and unlikes are not written right
+away. Every web worker process buffers them without reading the database, and a
+background thread flushes them every LIKE_BUFFER_FLUSH_MS milliseconds: the Like rows
+of the batch are written in one commit, and every event's like_count is updated once
+with the sum of the likes and unlikes that were actually written, so popular events
+are not written once per like.
+
+Likes of a missing user or event, likes that already exist and unlikes of missing
+likes change nothing when they are flushed, and are only logged.
+
+Payloads add the buffered likes of the process to like_count, including the batch
+being flushed until it is committed. Until a flush, other processes do not see them,
+and the likes still buffered when a process is killed are lost.
+"""
+
+
+class LikeBuffer:
+    """
+    The likes (True) and unlikes (False) of user-event pairs waiting to be flushed,
+    and the ones being flushed, with the change they make to the like count of every event.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held for the whole of a flush, so batches are written one at a time
+        self.flush_lock = threading.Lock()
+        self.flusher = None
+        self.clear()
+
+    def clear(self):
+        # (user_id, event_id) -> whether it is a like or an unlike
+        self.pending = {}
+        # Event id -> the change its pending likes and unlikes make to its like count
+        self.deltas = {}
+        # The batch being flushed and its changes, until it is committed
+        self.flushing = {}
+        self.flushing_deltas = {}
+
+    def get(self, user_id, event_id):
+        """
+        Returns whether the latest buffered change of the pair is a like or an unlike,
+        or None if it has none.
+        """
+        pair = (user_id, event_id)
+        if pair in self.pending:
+            return self.pending[pair]
+        return self.flushing.get(pair)
+
+    def set(self, user_id, event_id, liked):
+        self.pending[(user_id, event_id)] = liked
+        self.helper_add_delta(event_id, 1 if liked else -1)
+
+    def discard(self, user_id, event_id):
+        liked = self.pending.pop((user_id, event_id))
+        self.helper_add_delta(event_id, -1 if liked else 1)
+
+    def helper_add_delta(self, event_id, change):
+        delta = self.deltas.get(event_id, 0) + change
+        if delta:
+            self.deltas[event_id] = delta
+        else:
+            self.deltas.pop(event_id, None)
+
+    def delta(self, event_id) -> int:
+        return self.deltas.get(event_id, 0) + self.flushing_deltas.get(event_id, 0)
+
+    def take(self, user_id=None) -> dict:
+        """
+        Returns the pending likes and unlikes, only the user's if one is given, and moves
+        them to the batch being flushed.
+        """
+        if user_id is None:
+            self.flushing, self.flushing_deltas = self.pending, self.deltas
+            self.pending, self.deltas = {}, {}
+            return self.flushing
+
+        self.flushing = {
+            (liked_user_id, event_id): liked
+            for (liked_user_id, event_id), liked in self.pending.items()
+            if liked_user_id == user_id
+        }
+        # A user likes an event at most once, so every event of the batch changes by one
+        self.flushing_deltas = {}
+        for (_, event_id), liked in self.flushing.items():
+            self.discard(user_id, event_id)
+            self.flushing_deltas[event_id] = 1 if liked else -1
+        return self.flushing
+
+    def finish(self, unwritten):
+        """
+        Ends the flush of the batch, and buffers again the likes and unlikes that were
+        not written. A pending change of the same pair is the opposite one, so both cancel out.
+        """
+        self.flushing, self.flushing_deltas = {}, {}
+        for (user_id, event_id), liked in unwritten.items():
+            if (user_id, event_id) in self.pending:
+                self.discard(user_id, event_id)
+            else:
+                self.set(user_id, event_id, liked)
+
+
+like_buffer = LikeBuffer()
+
 
 class LikeDataLayer(DataLayer):
     """
     The UserDataLayer should be accessed by the rest of the code when trying to access the User table in the database.
     """
 
+    def helper_insert(self):
+        """
+        Returns the insert construct of the database's dialect, which supports ON CONFLICT.
+        """
+        if db.engine.dialect.name == "postgresql":
+            return postgresql.insert
+        return sqlite.insert
+
+    def helper_missing_like(self, user_id, event_id, liking):
+        """
+        Given a like that could not be added or removed, it raises why.
+        Only runs once a like failed, so likes never read before they write.
+        """
+        if Event.query.filter_by(id=event_id).first() is None:
+            logging.info(f"Event {self.DOES_NOT_EXIST}")
+            raise ValueError(f"Event {self.DOES_NOT_EXIST}")
+        if not liking:
+            logging.info(f"User-event pair {self.DOES_NOT_EXIST}")
+            return
+        if User.query.filter_by(id=user_id).first() is None:
+            logging.info(f"User {self.DOES_NOT_EXIST}")
+            raise ValueError(f"User {self.DOES_NOT_EXIST}")
+        logging.info(f"User-event pair {self.ALREADY_EXISTS}")
+        raise ValueError(f"User-event pair {self.ALREADY_EXISTS}")
+
+    def helper_count_like(self, statement, event_id, change):
+        """
+        Executes the statement adding or removing a like, and adds change to the like count
+        of the event if it did. Both happen in one round trip on PostgreSQL.
+        Returns whether the like was added or removed. The caller commits.
+        """
+        count = update(Event).values(
+            like_count=func.coalesce(Event.like_count, 0) + change
+        )
+        if db.engine.dialect.name == "postgresql":
+            changed = statement.returning(Like.event_id).cte("changed_like")
+            result = db.session.execute(
+                count.where(Event.id.in_(select(changed.c.event_id)))
+            )
+            return result.rowcount > 0
+        if db.session.execute(statement).rowcount == 0:
+            return False
+        db.session.execute(count.where(Event.id == event_id))
+        return True
+
+    def helper_buffered(self) -> bool:
+        """
+        Returns whether likes are buffered, see LIKE_BUFFER_FLUSH_MS.
+        """
+        return app.config["LIKE_BUFFER_FLUSH_MS"] > 0
+
+    def helper_start_flusher(self):
+        """
+        Starts the thread flushing the buffered likes, unless it is running.
+        Must be called with the buffer's lock held.
+        """
+        if like_buffer.flusher is not None:
+            return
+
+        def flush_periodically():
+            while True:
+                time.sleep(app.config["LIKE_BUFFER_FLUSH_MS"] / 1000)
+                buffered = self.helper_buffered()
+                if not buffered:
+                    # Buffering was turned off, the thread stops after a last flush
+                    with like_buffer.lock:
+                        like_buffer.flusher = None
+                try:
+                    self.flush_likes()
+                except Exception:
+                    logging.exception("Failed to flush the buffered likes")
+                if not buffered:
+                    return
+
+        like_buffer.flusher = threading.Thread(target=flush_periodically, daemon=True)
+        like_buffer.flusher.start()
+
+    def helper_buffer_like(self, user_id, event_id, liking):
+        """
+        Adds a like or an unlike to the buffer without reading the database, see flush_likes.
+        Only a like that is already buffered fails.
+        """
+        with like_buffer.lock:
+            buffered = like_buffer.get(user_id, event_id)
+            if buffered is None or buffered != liking:
+                if buffered is not None and (user_id, event_id) in like_buffer.pending:
+                    # The like or unlike cancels the pending one
+                    like_buffer.discard(user_id, event_id)
+                else:
+                    like_buffer.set(user_id, event_id, liking)
+                    self.helper_start_flusher()
+                return
+        if not liking:
+            logging.info(f"User-event pair {self.DOES_NOT_EXIST}")
+            return
+        logging.info(f"User-event pair {self.ALREADY_EXISTS}")
+        raise ValueError(f"User-event pair {self.ALREADY_EXISTS}")
+
+    def helper_like_statement(self, user_id, event_id):
+        """
+        Returns the statement inserting the like, only for an existing user and event,
+        and doing nothing if it exists.
+        """
+        insert = self.helper_insert()
+        return (
+            insert(Like)
+            .from_select(
+                ["user_id", "event_id"],
+                select(literal(user_id, Integer), Event.id).where(
+                    Event.id == event_id, exists().where(User.id == user_id)
+                ),
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "event_id"])
+        )
+
+    def helper_unlike_statement(self, user_id, event_id):
+        return delete(Like).where(Like.user_id == user_id, Like.event_id == event_id)
+
+    def helper_write_likes(self, batch) -> set:
+        """
+        Writes a batch of likes and unlikes, and adds the ones that changed a Like row to
+        the like counts of their events. Returns the pairs that changed a Like row.
+        The caller commits.
+        """
+        likes = [pair for pair, liked in batch.items() if liked]
+        unlikes = [pair for pair, liked in batch.items() if not liked]
+        written = set()
+        if db.engine.dialect.name == "postgresql":
+            # One statement for all the likes and one for all the unlikes, which
+            # return the rows they changed
+            if likes:
+                rows = values(
+                    column("user_id", Integer),
+                    column("event_id", Integer),
+                    name="buffered_like",
+                ).data(likes)
+                liked = (
+                    postgresql.insert(Like)
+                    .from_select(
+                        ["user_id", "event_id"],
+                        select(rows.c.user_id, rows.c.event_id).where(
+                            exists().where(Event.id == rows.c.event_id),
+                            exists().where(User.id == rows.c.user_id),
+                        ),
+                    )
+                    .on_conflict_do_nothing(index_elements=["user_id", "event_id"])
+                    .returning(Like.user_id, Like.event_id)
+                )
+                written.update(tuple(row) for row in db.session.execute(liked))
+            if unlikes:
+                unliked = (
+                    delete(Like)
+                    .where(tuple_(Like.user_id, Like.event_id).in_(unlikes))
+                    .returning(Like.user_id, Like.event_id)
+                )
+                written.update(tuple(row) for row in db.session.execute(unliked))
+        else:
+            for user_id, event_id in likes:
+                liked = self.helper_like_statement(user_id, event_id)
+                if db.session.execute(liked).rowcount > 0:
+                    written.add((user_id, event_id))
+            for user_id, event_id in unlikes:
+                unliked = self.helper_unlike_statement(user_id, event_id)
+                if db.session.execute(unliked).rowcount > 0:
+                    written.add((user_id, event_id))
+
+        deltas = {}
+        for user_id, event_id in written:
+            change = 1 if batch[(user_id, event_id)] else -1
+            deltas[event_id] = deltas.get(event_id, 0) + change
+        event_table = Event.__table__
+        counts = [
+            {"counted_id": event_id, "delta": delta}
+            # Events are always updated in the same order, so flushes never deadlock
+            for event_id, delta in sorted(deltas.items())
+            if delta
+        ]
+        if counts:
+            db.session.execute(
+                update(event_table)
+                .where(event_table.c.id == bindparam("counted_id"))
+                .values(
+                    like_count=func.coalesce(event_table.c.like_count, 0)
+                    + bindparam("delta")
+                ),
+                counts,
+            )
+        return written
+
+    def flush_likes(self, user_id=None) -> int:
+        """
+        Writes the buffered likes and unlikes in one commit, only the user's if one is given,
+        and adds the change they make to the like count of every event with one atomic
+        update per event.
+        If a pair makes the batch fail, every pair is written on its own and the
+        failing ones are dropped. If the database fails, the batch is buffered again.
+        Returns the number of likes and unlikes that changed a Like row.
+        """
+        with like_buffer.flush_lock:
+            with like_buffer.lock:
+                batch = like_buffer.take(user_id)
+            if not batch:
+                return 0
+
+            written = set()
+            done = set()
+            with app.app_context():
+                try:
+                    try:
+                        written = self.helper_write_likes(batch)
+                        db.session.commit()
+                        done = set(batch)
+                    except IntegrityError:
+                        db.session.rollback()
+                        for (user_id, event_id), liked in batch.items():
+                            try:
+                                written |= self.helper_write_likes(
+                                    {(user_id, event_id): liked}
+                                )
+                                db.session.commit()
+                            except IntegrityError:
+                                db.session.rollback()
+                                logging.warning(
+                                    f"Dropped the buffered like of event {event_id} "
+                                    f"by user {user_id}"
+                                )
+                            done.add((user_id, event_id))
+                except Exception:
+                    db.session.rollback()
+                    with like_buffer.lock:
+                        like_buffer.finish(
+                            {
+                                pair: liked
+                                for pair, liked in batch.items()
+                                if pair not in done
+                            }
+                        )
+                    raise
+
+            with like_buffer.lock:
+                like_buffer.finish({})
+        for (user_id, event_id), liked in batch.items():
+            if (user_id, event_id) not in written:
+                action = "like" if liked else "unlike"
+                logging.info(
+                    f"The buffered {action} of event {event_id} by user {user_id} "
+                    "changed nothing"
+                )
+        return len(written)
+
+    def get_pending_like_count(self, event_id) -> int:
+        """
+        Returns the change the buffered likes and unlikes make to the like count of the event.
+        """
+        with like_buffer.lock:
+            return like_buffer.delta(event_id)
+
+    def reset(self):
+        """
+        Drops the buffered likes and unlikes without writing them.
+        """
+        with like_buffer.lock:
+            like_buffer.clear()
+
     def like_by_id(self, user_id, event_id):
+        """
+        Adds the user's like of the event, and counts it with an atomic increment.
+        The like is only inserted for an existing user and event, and the unique
+        (user_id, event_id) index keeps concurrent likes of the same pair from both counting.
+        """
+        if self.helper_buffered():
+            self.helper_buffer_like(user_id, event_id, liking=True)
+            return
         with app.app_context():
-            event_exists = Event.query.filter_by(id=event_id).first()
-            if event_exists is None:
-                logging.info(f"Event {self.DOES_NOT_EXIST}")
-                raise ValueError(f"Event {self.DOES_NOT_EXIST}")
-            user_exists = User.query.filter_by(id=user_id).first()
-            if user_exists is None:
-                logging.info(f"User {self.DOES_NOT_EXIST}")
-                raise ValueError(f"User {self.DOES_NOT_EXIST}")
-            like_exists = Like.query.filter_by(
-                user_id=user_id, event_id=event_id
-            ).first()
-            if like_exists is not None:
-                logging.info(f"User-event pair {self.ALREADY_EXISTS}")
-                raise ValueError(f"User-event pair {self.ALREADY_EXISTS}")
-            liked = Like(user_id=user_id, event_id=event_id)
-
-            db.session.add(liked)
-            event_exists.like_count += 1
+            liked = self.helper_like_statement(user_id, event_id)
+            added = self.helper_count_like(liked, event_id, 1)
             db.session.commit()
+            if not added:
+                self.helper_missing_like(user_id, event_id, liking=True)
 
     def unlike_by_id(self, user_id, event_id):
+        """
+        Removes the user's like of the event, and uncounts it with an atomic decrement.
+        """
+        if self.helper_buffered():
+            self.helper_buffer_like(user_id, event_id, liking=False)
+            return
         with app.app_context():
-            event_exists = Event.query.filter_by(id=event_id).first()
-            if event_exists is None:
-                logging.info(f"Event {self.DOES_NOT_EXIST}")
-                raise ValueError(f"Event {self.DOES_NOT_EXIST}")
-            like_exists = Like.query.filter_by(
-                user_id=user_id, event_id=event_id
-            ).first()
-            if like_exists is None:
-                logging.info(f"User-event pair {self.DOES_NOT_EXIST}")
-            else:
-                db.session.delete(like_exists)
-                event_exists.like_count -= 1
-                db.session.commit()
+            unliked = self.helper_unlike_statement(user_id, event_id)
+            removed = self.helper_count_like(unliked, event_id, -1)
+            db.session.commit()
+            if not removed:
+                self.helper_missing_like(user_id, event_id, liking=False)
+
+    def get_liked_event_ids(self, user_id):
+        """
+        Returns the ids of the events that the user has liked, in ascending order,
+        including the buffered likes and unlikes.
+        Only reads the (user_id, event_id) index of the Like table.
+        """
+        with app.app_context():
+            rows = (
+                db.session.query(Like.event_id)
+                .filter(Like.user_id == user_id)
+                .order_by(Like.event_id)
+                .all()
+            )
+        event_ids = {row.event_id for row in rows}
+        with like_buffer.lock:
+            # The batch being flushed is applied first, then the pending changes
+            for buffered in (like_buffer.flushing, like_buffer.pending):
+                for (liked_user_id, event_id), liked in buffered.items():
+                    if liked_user_id != user_id:
+                        continue
+                    if liked:
+                        event_ids.add(event_id)
+                    else:
+                        event_ids.discard(event_id)
+        return sorted(event_ids)
 
     def get_liked_events(self, user_id):
         """
-        Returns all the events that the user has liked
+        Returns all the events that the user has liked, most recently liked first,
+        with their tags preloaded.
+        """
+        liked_events, _ = self.get_liked_events_page(user_id, None)
+        return liked_events
+
+    def get_liked_events_page(self, user_id, limit, cursor=None):
+        """
+        Returns a page of get_liked_events: a tuple of up to limit (or all) events and the
+        cursor of the next page, or None if it is the last one.
+        The events are joined to the user's likes in one query, which walks the
+        (user_id, id) index of the Like table from the cursor's like.
+        The user's buffered likes and unlikes are flushed first, but not the other users'.
         """
+        from .event import EventDataLayer
+
+        event_data = EventDataLayer()
+        after = event_data.helper_decode_page_cursor(cursor, "id")
+        with like_buffer.lock:
+            has_pending = any(
+                liked_user_id == user_id
+                for buffered in (like_buffer.flushing, like_buffer.pending)
+                for liked_user_id, _ in buffered
+            )
+        if has_pending:
+            self.flush_likes(user_id)
         with app.app_context():
-            user_exists = User.query.filter_by(id=user_id).first()
-            if user_exists is None:
+            query = (
+                Event.query.options(selectinload(Event.tags))
+                .join(Like, Like.event_id == Event.id)
+                .filter(Like.user_id == user_id)
+                .add_columns(Like.id.label("like_id"))
+                .order_by(Like.id.desc())
+            )
+            if after is not None:
+                query = query.filter(Like.id < after[0])
+            if limit is None:
+                rows = query.all()
+            else:
+                rows = query.limit(limit + 1).all()
+            if not rows and User.query.filter_by(id=user_id).first() is None:
                 logging.info(f"User {self.DOES_NOT_EXIST}")
                 raise ValueError(f"User {self.DOES_NOT_EXIST}")
-            likes = Like.query.filter_by(user_id=user_id).all()
 
-            liked_events = Event.query.filter(
-                Event.id.in_([like.event_id for like in likes])
-            ).all()
+        page = rows[:limit]
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            next_cursor = event_data.helper_encode_cursor(
+                {"sort": "id", "after": [page[-1].like_id]}
+            )
+        return [row[0] for row in page], next_cursor
+
 
-            return liked_events
+# The likes still buffered when the process exits are flushed too
+atexit.register(LikeDataLayer().flush_likes)
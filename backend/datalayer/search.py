@@ -0,0 +1,248 @@
+from ..app import app, db
+from ..models import (
+    Event,
+    EventTrigram,
+    EVENT_SEARCH_TABLE,
+    EVENT_SEARCH_DOCUMENT,
+    EVENT_TRIGRAM_COLUMNS,
+    create_search_index,
+)
+from .abstract import DataLayer
+
+import math
+import re
+from sqlalchemy import column, false, func, or_, text
+
+"""
+Full-text search over the title, club, description and extended description of events.
+
+On SQLite the index is the event_fts FTS5 table, on PostgreSQL a GIN index over a
+tsvector of the same fields. Both are created by db.create_all() (see models.py) and
+are kept in sync with the Event table by the database itself, so every way of
+writing an event keeps them up to date.
+
+When a keyword matches few events, search falls back to typo-tolerant matching of
+the title and club on their trigrams: pg_trgm on PostgreSQL, the EventTrigram
+table on SQLite, which EventDataLayer updates whenever an event is written.
+"""
+
+
+class SearchDataLayer(DataLayer):
+    """
+    The SearchDataLayer should be accessed by the rest of the code when trying to search events by keyword.
+    """
+
+    # Typo-tolerant matches are added when a keyword matches fewer events than this
+    FUZZY_MIN_RESULTS = 3
+    # Keywords shorter than this have too few trigrams to be matched by similarity
+    FUZZY_MIN_LENGTH = 3
+    # Share of the keyword's trigrams an event's title and club need to have
+    FUZZY_SIMILARITY_THRESHOLD = 0.5
+    # BM25 weight of a match in each of the indexed fields, in EVENT_SEARCH_COLUMNS order
+    RELEVANCE_WEIGHTS = [4.0, 2.0, 1.0, 0.5]
+
+    def helper_tokens(self, keyword: str) -> list:
+        """
+        Given a keyword, it returns its lowercase words.
+        """
+        if keyword is None:
+            return []
+        return re.findall(r"\w+", keyword.lower())
+
+    def keyword_filter(self, keyword: str):
+        """
+        Given a keyword, it returns a filter on the Event table matching the events with
+        a word starting with the keyword, or with the words of the keyword in a row.
+        """
+        tokens = self.helper_tokens(keyword)
+        if not tokens:
+            return false()
+
+        if db.engine.dialect.name == "postgresql":
+            return text(
+                f"{EVENT_SEARCH_DOCUMENT} @@ to_tsquery('simple', :ts_query)"
+            ).bindparams(ts_query=self.helper_ts_query(tokens))
+
+        fts_query = self.helper_fts_query(tokens)
+        matches = (
+            text(
+                f"SELECT rowid FROM {EVENT_SEARCH_TABLE} "
+                f"WHERE {EVENT_SEARCH_TABLE} MATCH :fts_query"
+            )
+            .bindparams(fts_query=fts_query)
+            .columns(column("rowid"))
+        )
+        return Event.id.in_(matches)
+
+    def helper_fts_query(self, tokens: list) -> str:
+        """
+        Given the words of a keyword, it returns a phrase query whose last word is a prefix,
+        quoted so the words are never operators.
+        """
+        return '"{}"*'.format(" ".join(tokens))
+
+    def helper_ts_query(self, tokens: list) -> str:
+        """
+        Given the words of a keyword, it returns the tsquery of the same phrase.
+        """
+        return " <-> ".join(tokens) + ":*"
+
+    def keyword_relevance(self, keyword: str):
+        """
+        Given a keyword, it returns a subquery of the ids of the events matching it, with
+        their relevance, higher is better, or None if the keyword has no words.
+        On SQLite the relevance is BM25, computed by FTS5 from the postings and the term
+        statistics it keeps in the index. On PostgreSQL it is ts_rank.
+        """
+        tokens = self.helper_tokens(keyword)
+        if not tokens:
+            return None
+        if db.engine.dialect.name == "postgresql":
+            return (
+                text(
+                    f"SELECT id AS event_id, ts_rank({EVENT_SEARCH_DOCUMENT}, "
+                    "to_tsquery('simple', :ts_query)) AS relevance FROM event "
+                    f"WHERE {EVENT_SEARCH_DOCUMENT} @@ to_tsquery('simple', :ts_query)"
+                )
+                .bindparams(ts_query=self.helper_ts_query(tokens))
+                .columns(column("event_id"), column("relevance"))
+                .subquery()
+            )
+
+        weights = ", ".join(str(weight) for weight in self.RELEVANCE_WEIGHTS)
+        # bm25() is lower for better matches
+        return (
+            text(
+                f"SELECT rowid AS event_id, -bm25({EVENT_SEARCH_TABLE}, {weights}) "
+                f"AS relevance FROM {EVENT_SEARCH_TABLE} "
+                f"WHERE {EVENT_SEARCH_TABLE} MATCH :fts_query"
+            )
+            .bindparams(fts_query=self.helper_fts_query(tokens))
+            .columns(column("event_id"), column("relevance"))
+            .subquery()
+        )
+
+    def helper_trigrams(self, value: str) -> set:
+        """
+        Given a text, it returns the trigrams of its lowercase words, padded like pg_trgm's.
+        """
+        trigrams = set()
+        for word in self.helper_tokens(value):
+            padded = f"  {word} "
+            trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+        return trigrams
+
+    def helper_use_fuzzy(self, keyword: str, result_count: int) -> bool:
+        """
+        Given a keyword and how many events match it exactly, it returns whether to
+        also look for typo-tolerant matches.
+        """
+        letters = "".join(self.helper_tokens(keyword))
+        return (
+            result_count < self.FUZZY_MIN_RESULTS
+            and len(letters) >= self.FUZZY_MIN_LENGTH
+        )
+
+    def fuzzy_similarity(self, keyword: str):
+        """
+        Given a keyword, it returns a subquery of the ids of the events whose title or club
+        is similar to the keyword, with their similarity, without scanning the Event table.
+        """
+        if db.engine.dialect.name == "postgresql":
+            # word_similarity() is computed for the rows the pg_trgm indexes return
+            db.session.execute(
+                text(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"
+                ),
+                {"threshold": str(self.FUZZY_SIMILARITY_THRESHOLD)},
+            )
+            similarities = [
+                func.word_similarity(keyword, getattr(Event, name))
+                for name in EVENT_TRIGRAM_COLUMNS
+            ]
+            return (
+                db.session.query(
+                    Event.id.label("event_id"),
+                    func.greatest(*similarities).label("similarity"),
+                )
+                .filter(
+                    or_(
+                        *[
+                            getattr(Event, name).op("%>")(keyword)
+                            for name in EVENT_TRIGRAM_COLUMNS
+                        ]
+                    )
+                )
+                .subquery()
+            )
+
+        trigrams = self.helper_trigrams(keyword)
+        shared = func.count(EventTrigram.trigram)
+        return (
+            db.session.query(
+                EventTrigram.event_id.label("event_id"),
+                (shared * 1.0 / max(len(trigrams), 1)).label("similarity"),
+            )
+            .filter(EventTrigram.trigram.in_(trigrams))
+            .group_by(EventTrigram.event_id)
+            .having(
+                shared >= math.ceil(len(trigrams) * self.FUZZY_SIMILARITY_THRESHOLD)
+            )
+            .subquery()
+        )
+
+    def index_trigrams(self, event_id, title, club):
+        """
+        Replaces the trigrams of the event's title and club in the EventTrigram table.
+        Must be called in an app context, the caller commits.
+        """
+        if db.engine.dialect.name != "sqlite":
+            return
+        EventTrigram.query.filter_by(event_id=event_id).delete()
+        trigrams = self.helper_trigrams(title) | self.helper_trigrams(club)
+        db.session.add_all(
+            EventTrigram(trigram=trigram, event_id=event_id) for trigram in trigrams
+        )
+
+    def remove_trigrams(self, event_id):
+        """
+        Removes the trigrams of the event from the EventTrigram table.
+        Must be called in an app context, the caller commits.
+        """
+        EventTrigram.query.filter_by(event_id=event_id).delete()
+
+    def rebuild_index(self, batch_size=1000):
+        """
+        Creates the search index if it is missing, and re-indexes every event.
+        """
+        with app.app_context():
+            if db.engine.dialect.name == "sqlite":
+                EventTrigram.query.delete()
+                last_id = 0
+                while True:
+                    events = (
+                        db.session.query(Event.id, Event.title, Event.club)
+                        .filter(Event.id > last_id)
+                        .order_by(Event.id)
+                        .limit(batch_size)
+                        .all()
+                    )
+                    if not events:
+                        break
+                    for event in events:
+                        self.index_trigrams(event.id, event.title, event.club)
+                    last_id = events[-1].id
+                    db.session.commit()
+                db.session.commit()
+
+            with db.engine.begin() as connection:
+                create_search_index(db.metadata, connection)
+                if connection.dialect.name == "sqlite":
+                    connection.execute(
+                        text(
+                            f"INSERT INTO {EVENT_SEARCH_TABLE}({EVENT_SEARCH_TABLE}) "
+                            "VALUES ('rebuild')"
+                        )
+                    )
+                elif connection.dialect.name == "postgresql":
+                    connection.execute(text("REINDEX INDEX ix_event_search"))
@@ -0,0 +1,420 @@
+from ..app import app, db
+from ..models import Event
+from .abstract import DataLayer
+from sqlalchemy import func, select
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+
+"""
+Autosuggest answers every keystroke of the search bar from an in-memory index of the
+words of every event's title and club, instead of querying the database.
+
+The index is built from the Event table in the background when a web worker starts
+(see gunicorn.conf.py), or else the first time it is needed, and is updated by
+EventDataLayer whenever an event is created, edited or deleted. Every web worker process
+has its own copy, so a background thread also rebuilds it every
+app.config["SUGGESTION_INDEX_MAX_AGE"] seconds, to pick up the changes other processes
+made, unless the Event table looks unchanged. A new index is built without holding the
+index's lock and swapped in once it is ready, so suggestions keep being answered
+meanwhile, and requests never wait for a rebuild.
+
+How popular and recent every suggestion is, is computed when its events change, and
+the best suggestions of the prefixes typed recently are kept, so a keystroke only
+scores the suggestions of its prefix the first time it is typed after a change.
+"""
+
+
+class SuggestionIndex:
+    """
+    A sorted array of the words of every suggestion, searched by prefix with bisect.
+    """
+
+    def __init__(self):
+        # The change marker of the Event table the index was built from, see helper_change_marker
+        self.marker = None
+        # The refreshes skipped since the index was built, because the marker was unchanged
+        self.skipped_refreshes = 0
+        self.clear()
+
+    # Most suggestions kept per prefix, the largest limit of /api/autosuggest
+    BEST_PER_PREFIX = 50
+    # Most prefixes whose best suggestions are kept, the least recently used are dropped
+    MAX_CACHED_PREFIXES = 4096
+
+    def clear(self):
+        # Sorted, unique words of every suggestion
+        self.words = []
+        # Word -> suggestions containing it
+        self.word_suggestions = {}
+        # Suggestion -> ids of the events it is the title or club of
+        self.suggestion_events = {}
+        # Event id -> its suggestions
+        self.event_suggestions = {}
+        # Event id -> its like count and end time, to rank its suggestions
+        self.event_ranks = {}
+        # Suggestion -> how popular and recent its events are
+        self.suggestion_ranks = {}
+        # Suggestions whose events changed since they were ranked
+        self.changed_suggestions = set()
+        # Prefix -> its best suggestions, best first, with their scores
+        self.best_suggestions = OrderedDict()
+
+    def helper_words(self, suggestion: str) -> set:
+        return {word.lower() for word in re.findall(r"\b\w+\b", suggestion)}
+
+    def add(self, event_id, suggestions, like_count=0, end_time=None, sort=True):
+        """
+        Adds the suggestions of the event. Unless sort is set, new words are left out of
+        the sorted array, and sort_words must be called once every event is added.
+        """
+        suggestions = [suggestion for suggestion in suggestions if suggestion]
+        self.event_suggestions[event_id] = suggestions
+        self.event_ranks[event_id] = (like_count or 0, end_time)
+        self.changed_suggestions.update(suggestions)
+        for suggestion in suggestions:
+            events = self.suggestion_events.setdefault(suggestion, set())
+            if not events:
+                for word in self.helper_words(suggestion):
+                    if word not in self.word_suggestions:
+                        self.word_suggestions[word] = set()
+                        if sort:
+                            insort(self.words, word)
+                    self.word_suggestions[word].add(suggestion)
+            events.add(event_id)
+
+    def sort_words(self):
+        """
+        Sorts the words of every suggestion at once, much faster than adding them one by one.
+        """
+        self.words = sorted(self.word_suggestions)
+
+    def remove(self, event_id):
+        self.event_ranks.pop(event_id, None)
+        for suggestion in self.event_suggestions.pop(event_id, []):
+            self.changed_suggestions.add(suggestion)
+            events = self.suggestion_events.get(suggestion, set())
+            events.discard(event_id)
+            if events:
+                continue
+            del self.suggestion_events[suggestion]
+            for word in self.helper_words(suggestion):
+                suggestions = self.word_suggestions[word]
+                suggestions.discard(suggestion)
+                if not suggestions:
+                    del self.word_suggestions[word]
+                    del self.words[bisect_left(self.words, word)]
+
+    def forget_prefixes(self, suggestion: str):
+        """
+        Drops the best suggestions kept for the prefixes of the suggestion's words.
+        """
+        for word in self.helper_words(suggestion):
+            for length in range(len(word) + 1):
+                self.best_suggestions.pop(word[:length], None)
+
+    def search(self, prefix: str) -> dict:
+        """
+        Returns the suggestions with a word starting with the prefix, mapped to the
+        shortest such word.
+        """
+        suggestions = {}
+        index = bisect_left(self.words, prefix)
+        while index < len(self.words) and self.words[index].startswith(prefix):
+            word = self.words[index]
+            for suggestion in self.word_suggestions[word]:
+                if len(word) < len(suggestions.get(suggestion, word + " ")):
+                    suggestions[suggestion] = word
+            index += 1
+        return suggestions
+
+
+# The current index, None until it is first built
+suggestion_index = None
+# Guards the current index and its content
+index_lock = threading.Lock()
+# Held while a new index is built, so only one is built at a time
+rebuild_lock = threading.Lock()
+# The changes made to the current index while a new one is built, replayed on the new one
+rebuild_changes = None
+# The thread rebuilding the index every SUGGESTION_INDEX_MAX_AGE seconds, once it is started
+refresher = None
+
+
+class SuggestionDataLayer(DataLayer):
+    """
+    The SuggestionDataLayer should be accessed by the rest of the code when trying to suggest search keywords.
+    """
+
+    # How much the popularity and the recency of its events add to how well a suggestion matches
+    POPULARITY_WEIGHT = 0.5
+    RECENCY_WEIGHT = 1.0
+    # Days after which the recency of an expired event has halved
+    RECENCY_HALF_LIFE = 30
+    # Refreshes skipped at most in a row, since events renamed by other processes do not
+    # change the marker of the Event table
+    MAX_SKIPPED_REFRESHES = 10
+
+    def helper_match_score(self, prefix: str, suggestion: str, word: str) -> float:
+        """
+        Given a prefix and a suggestion with a word starting with it, it returns how well they match.
+        Whole suggestions beat their first word, whole words beat prefixes of words,
+        and short completions beat long ones.
+        """
+        score = 1.0
+        if suggestion.lower() == prefix:
+            score = 4.0
+        elif suggestion.lower().startswith(prefix):
+            score = 2.0
+        if word == prefix:
+            score += 1.0
+        return score - (len(word) - len(prefix)) / (len(word) + 1)
+
+    def helper_rank_score(
+        self, index: SuggestionIndex, suggestion: str, now: datetime
+    ) -> float:
+        """
+        Given a suggestion, it returns how popular and recent its most popular and recent events are.
+        """
+        like_count = 0
+        recency = 0.0
+        for event_id in index.suggestion_events[suggestion]:
+            event_like_count, end_time = index.event_ranks[event_id]
+            like_count = max(like_count, event_like_count)
+            if end_time is None or end_time >= now:
+                recency = 1.0
+            else:
+                days_expired = (now - end_time).total_seconds() / (24 * 60 * 60)
+                recency = max(recency, 0.5 ** (days_expired / self.RECENCY_HALF_LIFE))
+        return (
+            self.POPULARITY_WEIGHT * math.log1p(like_count)
+            + self.RECENCY_WEIGHT * recency
+        )
+
+    def helper_rerank(self, index: SuggestionIndex):
+        """
+        Ranks the suggestions whose events changed, and drops the best suggestions kept
+        for their prefixes. Must be called with the index's lock held, or before it is swapped in.
+        """
+        now = datetime.now()
+        for suggestion in index.changed_suggestions:
+            if suggestion in index.suggestion_events:
+                index.suggestion_ranks[suggestion] = self.helper_rank_score(
+                    index, suggestion, now
+                )
+            else:
+                index.suggestion_ranks.pop(suggestion, None)
+            if index.best_suggestions:
+                index.forget_prefixes(suggestion)
+        index.changed_suggestions.clear()
+
+    def helper_best_suggestions(
+        self, index: SuggestionIndex, prefix: str, limit=SuggestionIndex.BEST_PER_PREFIX
+    ) -> list:
+        """
+        Returns at least the limit best suggestions of the prefix, best first, with their scores.
+        Up to BEST_PER_PREFIX of them are kept until a suggestion matching the prefix changes.
+        Must be called with the index's lock held.
+        """
+        cached = limit <= index.BEST_PER_PREFIX
+        best = index.best_suggestions.get(prefix) if cached else None
+        if best is not None:
+            index.best_suggestions.move_to_end(prefix)
+            return best
+        scored = (
+            (
+                self.helper_match_score(prefix, suggestion, word)
+                + index.suggestion_ranks[suggestion],
+                suggestion,
+            )
+            for suggestion, word in index.search(prefix).items()
+        )
+        # Only the best suggestions are kept in the heap, however many match
+        best = heapq.nsmallest(
+            max(limit, index.BEST_PER_PREFIX),
+            scored,
+            key=lambda item: (-item[0], item[1]),
+        )
+        if not cached:
+            return best
+        index.best_suggestions[prefix] = best
+        if len(index.best_suggestions) > index.MAX_CACHED_PREFIXES:
+            index.best_suggestions.popitem(last=False)
+        return best
+
+    def helper_index(self) -> SuggestionIndex:
+        """
+        Returns the suggestion index, building it from the Event table if there is none yet.
+        Returns None while the first index is built by another thread, so requests never
+        wait for it, see gunicorn.conf.py.
+        """
+        if suggestion_index is None:
+            self.rebuild(blocking=False)
+        return suggestion_index
+
+    def helper_change_marker(self) -> tuple:
+        """
+        Returns a summary of the Event table that is cheap to compute, and changes whenever
+        an event is created or deleted or its likes change.
+        """
+        with app.app_context():
+            return tuple(
+                db.session.execute(
+                    select(
+                        func.count(Event.id),
+                        func.max(Event.id),
+                        func.sum(Event.like_count),
+                    )
+                ).one()
+            )
+
+    def helper_start_refresher(self):
+        """
+        Starts the thread refreshing the index every SUGGESTION_INDEX_MAX_AGE seconds,
+        unless it is running. Must be called with the index's lock held.
+        """
+        global refresher
+
+        if refresher is not None:
+            return
+
+        def refresh_periodically():
+            while True:
+                time.sleep(app.config["SUGGESTION_INDEX_MAX_AGE"])
+                try:
+                    self.refresh()
+                except Exception:
+                    logging.exception("Failed to refresh the suggestion index")
+
+        refresher = threading.Thread(target=refresh_periodically, daemon=True)
+        refresher.start()
+
+    def refresh(self) -> bool:
+        """
+        Rebuilds the index, unless the marker of the Event table is unchanged since it was
+        built and fewer than MAX_SKIPPED_REFRESHES refreshes were skipped in a row.
+        Returns whether the index was rebuilt.
+        """
+        index = suggestion_index
+        if (
+            index is not None
+            and index.skipped_refreshes < self.MAX_SKIPPED_REFRESHES
+            and index.marker == self.helper_change_marker()
+        ):
+            index.skipped_refreshes += 1
+            return False
+        return self.rebuild(blocking=False)
+
+    def rebuild_in_background(self):
+        """
+        Builds the index in a new thread, see rebuild.
+        """
+        threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self, blocking=True) -> bool:
+        """
+        Builds a new index from the Event table and swaps it in, unless another one is being
+        built and blocking is not set. The current index keeps answering until then.
+        Returns whether the index was rebuilt.
+        """
+        global suggestion_index, rebuild_changes
+
+        if not rebuild_lock.acquire(blocking=blocking):
+            return False
+        try:
+            with index_lock:
+                rebuild_changes = []
+            index = SuggestionIndex()
+            # Taken first, so the events changed while the index is built are picked up
+            # by the next refresh
+            index.marker = self.helper_change_marker()
+            with app.app_context():
+                rows = Event.query.with_entities(
+                    Event.id, Event.title, Event.club, Event.like_count, Event.end_time
+                )
+                for row in rows:
+                    index.add(
+                        row.id,
+                        [row.title, row.club],
+                        row.like_count,
+                        row.end_time,
+                        sort=False,
+                    )
+            index.sort_words()
+            self.helper_rerank(index)
+            # The shortest prefixes match the most suggestions, they are scored before
+            # the index answers
+            for prefix in {""} | {word[0] for word in index.words}:
+                self.helper_best_suggestions(index, prefix)
+            with index_lock:
+                for change in rebuild_changes:
+                    change(index)
+                self.helper_rerank(index)
+                suggestion_index = index
+                self.helper_start_refresher()
+            return True
+        finally:
+            with index_lock:
+                rebuild_changes = None
+            rebuild_lock.release()
+
+    def helper_change(self, change):
+        """
+        Applies the change to the current index, and to the one being built if any.
+        Changes are dropped while there is no index, since it is built with them.
+        """
+        with index_lock:
+            if suggestion_index is not None:
+                change(suggestion_index)
+            if rebuild_changes is not None:
+                rebuild_changes.append(change)
+
+    def get_suggestions(self, prefix: str, limit: int = 10) -> list:
+        """
+        Returns up to limit titles and clubs of the events with a word starting with the given prefix,
+        best first. They are ranked by how well they match the prefix, and by how popular and
+        recent their events are.
+        """
+        prefix = (prefix or "").lower()
+        self.helper_index()
+        with index_lock:
+            index = suggestion_index
+            if index is None:
+                # The index was reset since
+                return []
+            self.helper_rerank(index)
+            best = self.helper_best_suggestions(index, prefix, limit)
+        return [suggestion for _, suggestion in best[:limit]]
+
+    def index_event(self, event_id, title, club, like_count=0, end_time=None):
+        """
+        Adds the event's title and club to the index, replacing the ones it had.
+        """
+
+        def change(index):
+            index.remove(event_id)
+            index.add(event_id, [title, club], like_count, end_time)
+
+        self.helper_change(change)
+
+    def remove_event(self, event_id):
+        """
+        Removes the event's title and club from the index.
+        """
+        self.helper_change(lambda index: index.remove(event_id))
+
+    def reset(self):
+        """
+        Drops the index, so it is built again from the Event table when it is next needed.
+        """
+        global suggestion_index
+
+        with index_lock:
+            suggestion_index = None
@@ -0,0 +1,267 @@
+"""
+Migrations for an existing database.
+
+Usage (from the repository root):
+    python -m backend.migrate schema
+    python -m backend.migrate images [--batch-size 100]
+    python -m backend.migrate placeholders [--batch-size 100]
+    python -m backend.migrate search-index
+    python -m backend.migrate filter-keys [--batch-size 1000]
+    python -m backend.migrate indexes
+
+schema: creates missing tables and adds columns and indexes that were added to
+        models.py after the database was created.
+images: moves the legacy Event.image bytes out of the database and into the
+        image store. Every batch is committed on its own, so the command can be
+        interrupted and re-run, and it only ever holds one batch of images in memory.
+placeholders: creates the missing placeholders of images that were stored before
+        placeholders were added.
+search-index: re-indexes every event in the full-text and trigram search indexes.
+        Run it once after upgrading to fill the trigram index of existing events.
+filter-keys: fills the case-folded location and club keys of events that were created
+        before the keys were added.
+indexes: creates the indexes of models.py missing from the database, like schema does,
+        and reports the duplicate likes it removed first to create the unique index
+        of the Like table. See backend/benchmark.py for their effect on query latency.
+"""
+
+import argparse
+import logging
+
+from sqlalchemy import and_, func, inspect, or_, select, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.orm import undefer
+
+from .app import app, db
+from .models import Event, Like, filter_key
+
+
+def upgrade_schema():
+    """
+    Creates the missing tables and adds the missing columns and indexes of the existing tables.
+    Returns the number of duplicate likes that were removed to create the indexes.
+    """
+    with app.app_context():
+        db.create_all()
+
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                logging.info(f"Adding column {table.name}.{column.name}")
+                db.session.execute(
+                    text(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    )
+                )
+        db.session.commit()
+    return create_indexes()
+
+
+def dedupe_likes():
+    """
+    Removes the repeated likes of a user for the same event, keeping the first one, and
+    recounts the likes of their events.
+    Returns the number of likes that were removed.
+    """
+    with app.app_context():
+        first_likes = select(func.min(Like.id)).group_by(Like.user_id, Like.event_id)
+        duplicates = (
+            db.session.query(Like.id, Like.event_id)
+            .filter(Like.id.not_in(first_likes))
+            .all()
+        )
+        if not duplicates:
+            return 0
+
+        Like.query.filter(Like.id.in_([like.id for like in duplicates])).delete(
+            synchronize_session=False
+        )
+        for event_id in {like.event_id for like in duplicates}:
+            like_count = (
+                select(func.count(Like.id))
+                .where(Like.event_id == event_id)
+                .scalar_subquery()
+            )
+            Event.query.filter_by(id=event_id).update(
+                {Event.like_count: like_count}, synchronize_session=False
+            )
+        db.session.commit()
+        logging.info(f"Removed {len(duplicates)} duplicate likes")
+        return len(duplicates)
+
+
+def create_indexes():
+    """
+    Creates the indexes of models.py that are missing from the existing tables.
+    Duplicate likes are removed first, since a user likes an event at most once.
+    Returns the number of duplicate likes that were removed.
+    """
+    removed = dedupe_likes()
+    with app.app_context():
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                # Expression indexes cannot be reflected on every database, so they are
+                # not looked up before they are created
+                db.session.execute(CreateIndex(index, if_not_exists=True))
+        db.session.commit()
+    return removed
+
+
+def migrate_images(batch_size=100):
+    """
+    Moves the legacy image bytes of every event into the image store, one batch at a time.
+    Returns the number of events that were migrated.
+    """
+    from .datalayer.event import EventDataLayer
+
+    event_data = EventDataLayer()
+    migrated = 0
+    last_id = 0
+    with app.app_context():
+        while True:
+            events = (
+                Event.query.options(undefer(Event.image))
+                .filter(
+                    Event.id > last_id,
+                    Event.image_hash.is_(None),
+                    Event.image.isnot(None),
+                )
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            for event in events:
+                try:
+                    event_data.helper_set_image(event, event.image)
+                    migrated += 1
+                except TypeError:
+                    logging.warning(f"Skipping unreadable image of event {event.id}")
+            last_id = events[-1].id
+            db.session.commit()
+            # Release the batch's image bytes before loading the next one
+            db.session.expunge_all()
+            logging.info(f"Migrated {migrated} images")
+    return migrated
+
+
+def migrate_placeholders(batch_size=100):
+    """
+    Creates the placeholder of every stored event image that does not have one yet.
+    Returns the number of events that got a placeholder.
+    """
+    from .datalayer.image import ImageDataLayer
+
+    image_data = ImageDataLayer()
+    migrated = 0
+    last_id = 0
+    with app.app_context():
+        while True:
+            events = (
+                Event.query.filter(
+                    Event.id > last_id,
+                    Event.image_hash.isnot(None),
+                    Event.image_placeholder.is_(None),
+                )
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            for event in events:
+                try:
+                    event.image_placeholder = image_data.create_placeholder(
+                        event.image_hash
+                    )
+                    migrated += 1
+                except (OSError, ValueError):
+                    logging.warning(f"Skipping missing image of event {event.id}")
+            last_id = events[-1].id
+            db.session.commit()
+            logging.info(f"Created {migrated} placeholders")
+    return migrated
+
+
+def migrate_filter_keys(batch_size=1000):
+    """
+    Sets the location and club keys of every event that is missing them.
+    Returns the number of events that were updated.
+    """
+    migrated = 0
+    last_id = 0
+    with app.app_context():
+        while True:
+            events = (
+                Event.query.filter(
+                    Event.id > last_id,
+                    or_(
+                        Event.location_key.is_(None),
+                        and_(Event.club.isnot(None), Event.club_key.is_(None)),
+                    ),
+                )
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            for event in events:
+                event.location_key = filter_key(event.location)
+                event.club_key = filter_key(event.club)
+                migrated += 1
+            last_id = events[-1].id
+            db.session.commit()
+            logging.info(f"Updated the filter keys of {migrated} events")
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.migrate")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("schema", help="add missing tables and columns")
+    images_parser = subparsers.add_parser(
+        "images", help="move image bytes from the database to the image store"
+    )
+    images_parser.add_argument("--batch-size", type=int, default=100)
+    placeholders_parser = subparsers.add_parser(
+        "placeholders", help="create the missing image placeholders"
+    )
+    placeholders_parser.add_argument("--batch-size", type=int, default=100)
+    subparsers.add_parser("search-index", help="rebuild the full-text search index")
+    filter_keys_parser = subparsers.add_parser(
+        "filter-keys", help="fill the missing location and club keys"
+    )
+    filter_keys_parser.add_argument("--batch-size", type=int, default=1000)
+    subparsers.add_parser("indexes", help="add the missing indexes")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    removed = upgrade_schema()
+    if args.command == "images":
+        migrated = migrate_images(batch_size=args.batch_size)
+        print(f"Moved {migrated} images to {app.config['IMAGE_STORE_PATH']}")
+    elif args.command == "placeholders":
+        migrated = migrate_placeholders(batch_size=args.batch_size)
+        print(f"Created {migrated} image placeholders")
+    elif args.command == "search-index":
+        from .datalayer.search import SearchDataLayer
+
+        SearchDataLayer().rebuild_index()
+        print("Rebuilt the search index")
+    elif args.command == "filter-keys":
+        migrated = migrate_filter_keys(batch_size=args.batch_size)
+        print(f"Updated the filter keys of {migrated} events")
+    elif args.command == "indexes":
+        print(f"Removed {removed} duplicate likes and created the missing indexes")
+
+
+if __name__ == "__main__":
+    main()
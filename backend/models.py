@@ -1,4 +1,6 @@
 from .app import db
+from sqlalchemy import event as sa_event, func, literal_column, text
+from sqlalchemy.orm import validates
 
 class User(db.Model):
     """
@@ -36,8 +38,19 @@ event_tags = db.Table(
     "event_tags",
     db.Column("event_id", db.Integer, db.ForeignKey("event.id"), primary_key=True),
     db.Column("tag_id", db.Integer, db.ForeignKey("tag.id"), primary_key=True),
+    # The primary key only serves lookups by event, the tag filter looks up by tag
+    db.Index("ix_event_tags_tag_id_event_id", "tag_id", "event_id"),
 )
 
+def filter_key(value):
+    """
+    Returns the case-folded key a location or club is filtered by, so that filters are
+    equality lookups in the index of the key column.
+    """
+    if value is None:
+        return None
+    return " ".join(value.split()).casefold()
+
 class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.Text, nullable=False)
@@ -46,15 +59,44 @@ class Event(db.Model):
     location = db.Column(db.Text, nullable=False)
     start_time = db.Column(db.TIMESTAMP, nullable=False)
     end_time = db.Column(db.TIMESTAMP, nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
     is_published = db.Column(db.Boolean, nullable=False, default=False)
     like_count = db.Column(db.Integer, default=0)
-    image = db.Column(db.LargeBinary, nullable=True)
+    # Legacy image bytes, moved to the image store by `python -m backend.migrate images`.
+    # Deferred so that event queries never pull the image bytes unless asked to
+    image = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    # The image itself is stored on disk, keyed by the SHA-256 hash of its content
+    image_hash = db.Column(db.Text, nullable=True)
+    image_size = db.Column(db.Integer, nullable=True)
+    image_mimetype = db.Column(db.Text, nullable=True)
+    # A tiny blurred data URI of the image, shown until the image itself is loaded
+    image_placeholder = db.Column(db.Text, nullable=True)
     club = db.Column(db.Text)
+    # Case-folded location and club, set whenever they are, see filter_key()
+    location_key = db.Column(db.Text, index=True)
+    club_key = db.Column(db.Text, index=True)
     
      # Define a many-to-many relationship with tags through the event_tags table
     tags = db.relationship("Tag", secondary=event_tags)
 
+    # Date filters are ranges over both times, and unexpired events a range over end_time
+    __table_args__ = (
+        db.Index("ix_event_end_time_start_time", "end_time", "start_time"),
+        db.Index("ix_event_start_time_end_time", "start_time", "end_time"),
+    )
+
+    @validates("location", "club")
+    def validate_filter_key(self, key, value):
+        setattr(self, f"{key}_key", filter_key(value))
+        return value
+
+# The sort keys of the alphabetical and trending sorts, ties broken by id (see EventDataLayer.helper_keyset_page).
+# The constant is inlined, since an expression with a bound parameter never matches the index
+EVENT_ALPHABETICAL_KEY = func.lower(Event.title)
+EVENT_TRENDING_KEY = func.coalesce(Event.like_count, literal_column("0"))
+db.Index("ix_event_title_lower", EVENT_ALPHABETICAL_KEY, Event.id)
+db.Index("ix_event_trending", EVENT_TRENDING_KEY.desc(), Event.id)
+
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Text, unique=True, nullable=False)
@@ -62,4 +104,134 @@ class Tag(db.Model):
 class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    event_id = db.Column(db.Integer, db.ForeignKey("event.id"))
+    event_id = db.Column(db.Integer, db.ForeignKey("event.id"), index=True)
+
+    # A user likes an event at most once, and their likes are looked up by user,
+    # and listed by user from the most recent
+    __table_args__ = (
+        db.Index("ix_like_user_id_event_id", "user_id", "event_id", unique=True),
+        db.Index("ix_like_user_id_id", "user_id", "id"),
+    )
+
+class ImageJob(db.Model):
+    """
+    An uploaded image waiting to be validated, resized and stored by the image worker
+    (see backend/worker.py). The raw upload is kept in the image store's uploads
+    directory until the job is done.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(
+        db.Integer, db.ForeignKey("event.id", ondelete="CASCADE"), nullable=False
+    )
+    upload_name = db.Column(db.Text, nullable=False)
+    # One of pending, processing, done or failed
+    status = db.Column(db.Text, nullable=False, default="pending", index=True)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.TIMESTAMP, nullable=False)
+    updated_at = db.Column(db.TIMESTAMP, nullable=False)
+
+class EventTrigram(db.Model):
+    """
+    The trigram index of the title and club of every event, for typo-tolerant search
+    on SQLite (see datalayer/search.py). PostgreSQL uses pg_trgm instead.
+    """
+
+    trigram = db.Column(db.Text, primary_key=True)
+    event_id = db.Column(
+        db.Integer,
+        db.ForeignKey("event.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+
+# Full-text search index over the searchable fields of the Event table (see datalayer/search.py).
+# On SQLite it is an FTS5 table kept in sync with the Event table by triggers, on PostgreSQL
+# a GIN index over the same tsvector expression the search query uses, next to pg_trgm
+# indexes for typo-tolerant search (the EventTrigram table on SQLite).
+EVENT_SEARCH_TABLE = "event_fts"
+EVENT_SEARCH_COLUMNS = ["title", "club", "description", "extended_description"]
+EVENT_SEARCH_DOCUMENT = "to_tsvector('simple', {})".format(
+    " || ' ' || ".join(f"coalesce({column}, '')" for column in EVENT_SEARCH_COLUMNS)
+)
+# The fields that typo-tolerant search matches
+EVENT_TRIGRAM_COLUMNS = ["title", "club"]
+
+
+def create_search_index(target, connection, **kw):
+    """
+    Creates the full-text search index of the Event table, unless it already exists.
+    Runs after every db.create_all().
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_event_search ON event "
+                f"USING GIN ({EVENT_SEARCH_DOCUMENT})"
+            )
+        )
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in EVENT_TRIGRAM_COLUMNS:
+            connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_event_{column}_trigram ON event "
+                    f"USING GIN ({column} gin_trgm_ops)"
+                )
+            )
+        return
+    if connection.dialect.name != "sqlite":
+        return
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+        {"name": EVENT_SEARCH_TABLE},
+    ).first()
+    if exists:
+        return
+
+    columns = ", ".join(EVENT_SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in EVENT_SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in EVENT_SEARCH_COLUMNS)
+    delete_old = (
+        f"INSERT INTO {EVENT_SEARCH_TABLE}({EVENT_SEARCH_TABLE}, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values});"
+    )
+    insert_new = (
+        f"INSERT INTO {EVENT_SEARCH_TABLE}(rowid, {columns}) "
+        f"VALUES (new.id, {new_values});"
+    )
+    # The index only keeps the tokens, the text itself stays in the Event table
+    connection.execute(
+        text(
+            f"CREATE VIRTUAL TABLE {EVENT_SEARCH_TABLE} USING fts5({columns}, "
+            "content='event', content_rowid='id', prefix='2 3')"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE TRIGGER event_fts_insert AFTER INSERT ON event "
+            f"BEGIN {insert_new} END"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE TRIGGER event_fts_delete AFTER DELETE ON event "
+            f"BEGIN {delete_old} END"
+        )
+    )
+    connection.execute(
+        text(
+            f"CREATE TRIGGER event_fts_update AFTER UPDATE OF {columns} ON event "
+            f"BEGIN {delete_old} {insert_new} END"
+        )
+    )
+    # Index the events that existed before the index
+    connection.execute(
+        text(
+            f"INSERT INTO {EVENT_SEARCH_TABLE}({EVENT_SEARCH_TABLE}) VALUES ('rebuild')"
+        )
+    )
+
+
+sa_event.listen(db.metadata, "after_create", create_search_index)
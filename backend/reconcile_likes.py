@@ -0,0 +1,104 @@
+"""
+Recounts the denormalized Event.like_count from the Like table.
+
+Usage (from the repository root):
+    python -m backend.reconcile_likes [--dry-run] [--batch-size 1000] [--interval SECONDS]
+
+The events whose like_count differs from their number of likes are found with one
+grouped aggregate over the Like table, which only reads. Only those events are
+updated, batch_size at a time, each batch in its own short transaction, so the
+Event table is never locked for long. Every updated count is computed again when it
+is written, so likes added since the aggregate ran are not lost.
+
+--dry-run only reports the events that would be updated. --interval runs the
+reconciliation every SECONDS seconds until interrupted.
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy import func, select
+
+from .app import app, db
+from .models import Event, Like
+
+
+def find_like_count_drift():
+    """
+    Returns the events whose like count differs from their number of likes, as
+    (event_id, like_count, counted_likes) tuples ordered by event id.
+    """
+    counts = (
+        select(Like.event_id, func.count(Like.id).label("counted_likes"))
+        .group_by(Like.event_id)
+        .subquery()
+    )
+    counted_likes = func.coalesce(counts.c.counted_likes, 0)
+    with app.app_context():
+        rows = db.session.execute(
+            select(Event.id, Event.like_count, counted_likes)
+            .outerjoin(counts, counts.c.event_id == Event.id)
+            .where(func.coalesce(Event.like_count, 0) != counted_likes)
+            .order_by(Event.id)
+        ).all()
+    return [tuple(row) for row in rows]
+
+
+def reconcile_like_counts(batch_size=1000, dry_run=False):
+    """
+    Sets the like count of every event that drifted to its number of likes, one batch at a time.
+    Returns the drift that was found, see find_like_count_drift.
+    """
+    drift = find_like_count_drift()
+    if dry_run:
+        return drift
+
+    like_count = (
+        select(func.count(Like.id)).where(Like.event_id == Event.id).scalar_subquery()
+    )
+    with app.app_context():
+        for first in range(0, len(drift), batch_size):
+            event_ids = [
+                event_id for event_id, _, _ in drift[first : first + batch_size]
+            ]
+            Event.query.filter(Event.id.in_(event_ids)).update(
+                {Event.like_count: like_count}, synchronize_session=False
+            )
+            db.session.commit()
+            logging.info(f"Recounted the likes of {first + len(event_ids)} events")
+    return drift
+
+
+def report(drift, dry_run):
+    for event_id, like_count, counted_likes in drift:
+        print(f"Event {event_id}: like_count {like_count}, {counted_likes} likes")
+    action = "Would recount" if dry_run else "Recounted"
+    print(f"{action} the likes of {len(drift)} events")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.reconcile_likes")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report the drift without fixing it"
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help="reconcile every INTERVAL seconds until interrupted",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        drift = reconcile_like_counts(batch_size=args.batch_size, dry_run=args.dry_run)
+        report(drift, args.dry_run)
+        if args.interval is None:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 from ..app import app
-from .test_datalayer import test_client
+from .test_datalayer import test_client, count_queries
 from ..datalayer.event import EventDataLayer
 from ..datalayer.user import UserDataLayer
 from ..datalayer.tag import TagDataLayer
+from ..datalayer.image import ImageDataLayer
+import hashlib
 import logging
+import os
+import re
 from datetime import datetime
 
 
@@ -92,6 +96,277 @@ def test_api_landing_page(test_client):
     tear_down(test_client)
 
 
+def test_api_landing_page_tags_batched(test_client):
+    setup(test_client)
+    event = EventDataLayer()
+    for i in range(3):
+        event.create_event(
+            title=f"Upcoming Event {i}",
+            description="Kickoff event 1 for club 1",
+            extended_description="Extended decription for event 1 for club 1 that is much longer than just the description",
+            location="Toronto",
+            start_time="2099-10-03 3:30:00",
+            end_time="2099-10-03 4:00:00",
+            author_id=1,
+            club="Club 1",
+            is_published=True,
+            image=None,
+            tags=["Tag 1"],
+        )
+
+    with count_queries() as statements:
+        response = test_client.get("/api/")
+    assert response.status_code == 200
+    assert len(response.json) == 3
+    assert all(event["tags"] == ["Tag 1"] for event in response.json)
+    # one query for the events and one batched query for all of their tags
+    assert len(statements) == 2
+
+    tear_down(test_client)
+
+
+def test_api_list_endpoints_defer_image(test_client):
+    setup(test_client)
+    image_file_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "images", "logo.png"
+    )
+    with open(image_file_path, "rb") as image_file:
+        image_data = image_file.read()
+
+    event = EventDataLayer()
+    event_id = event.create_event(
+        title="Upcoming Event",
+        description="Kickoff event 1 for club 1",
+        extended_description="Extended decription for event 1 for club 1 that is much longer than just the description",
+        location="Toronto",
+        start_time="2099-10-03 3:30:00",
+        end_time="2099-10-03 4:00:00",
+        author_id=1,
+        club="Club 1",
+        is_published=True,
+        image=image_data,
+        tags=["Tag 1"],
+    )
+
+    for route in ["/api/", "/api/filter?query=up", f"/api/{event_id}"]:
+        with count_queries() as statements:
+            response = test_client.get(route)
+        assert response.status_code == 200
+        assert not any(
+            re.search(r"\bevent\.image\b", statement) for statement in statements
+        )
+
+    with count_queries() as statements:
+        response = test_client.get(f"/api/{event_id}/image")
+    assert response.status_code == 200
+    assert response.data == image_data
+    assert len(statements) == 1
+
+    tear_down(test_client)
+
+
+def test_api_event_image_caching(test_client):
+    setup(test_client)
+    image_file_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "images", "logo.png"
+    )
+    with open(image_file_path, "rb") as image_file:
+        image_data = image_file.read()
+    event = EventDataLayer()
+    event.update_image(event_id=1, image=image_data)
+    json_event = test_client.get("/api/1").json
+    image_url = json_event["image_url"]
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    assert image_url == f"/api/1/image?v={image_hash}"
+    # the placeholder is inlined, so the page can paint before the image loads
+    assert json_event["image_placeholder"].startswith("data:image/")
+
+    # versioned urls are cached forever
+    response = test_client.get(image_url)
+    assert response.status_code == 200
+    assert response.data == image_data
+    assert response.headers["ETag"] == f'"{image_hash}"'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert not response.cache_control.no_cache
+
+    # unversioned urls have to be revalidated
+    response = test_client.get("/api/1/image")
+    assert response.status_code == 200
+    assert response.cache_control.no_cache
+
+    # resized variants are served with their own ETag
+    response = test_client.get(f"{image_url}&size=card")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert len(response.data) < len(image_data)
+    assert response.headers["ETag"] == f'"{image_hash}-card"'
+    response = test_client.get("/api/1/image?size=huge")
+    assert response.status_code == 400
+
+    # modern encodings are only served to clients that name them
+    response = test_client.get(
+        f"{image_url}&size=card", headers={"Accept": "image/webp,*/*;q=0.8"}
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    assert response.headers["ETag"] == f'"{image_hash}-card-webp"'
+    assert "Accept" in response.vary
+    response = test_client.get(image_url, headers={"Accept": "*/*"})
+    assert response.mimetype == "image/png"
+    assert "Accept" in response.vary
+
+    # revalidation is answered without reading the image
+    ImageDataLayer().get_image_path(image_hash).unlink()
+    with count_queries() as statements:
+        response = test_client.get(
+            "/api/1/image", headers={"If-None-Match": f'"{image_hash}"'}
+        )
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == f'"{image_hash}"'
+    assert len(statements) == 1
+
+    tear_down(test_client)
+
+
+def test_api_event_image_variant_missing(test_client):
+    from ..datalayer.image_job import ImageJobDataLayer
+    from ..models import ImageJob
+    from ..worker import process_pending_jobs
+
+    setup(test_client)
+    image_file_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "images", "logo.png"
+    )
+    with open(image_file_path, "rb") as image_file:
+        image_data = image_file.read()
+    event = EventDataLayer()
+    event.update_image(event_id=1, image=image_data)
+    image_url = test_client.get("/api/1").json["image_url"]
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    image = ImageDataLayer()
+    card_path = image.get_image_path(image_hash, "card")
+    webp_path = image.get_image_path(image_hash, "card", "webp")
+    card_path.unlink()
+    webp_path.unlink()
+
+    # the original is served while the worker generates the variants
+    for _ in range(2):
+        response = test_client.get(
+            f"{image_url}&size=card", headers={"Accept": "image/webp,*/*;q=0.8"}
+        )
+        assert response.status_code == 200
+        assert response.data == image_data
+        assert response.headers["ETag"] == f'"{image_hash}"'
+        assert response.cache_control.no_cache
+        assert not card_path.exists()
+    with app.app_context():
+        assert ImageJob.query.count() == 1
+
+    assert process_pending_jobs() == 1
+    with app.app_context():
+        assert ImageJob.query.one().status == ImageJobDataLayer.DONE
+    response = test_client.get(
+        f"{image_url}&size=card", headers={"Accept": "image/webp,*/*;q=0.8"}
+    )
+    assert response.mimetype == "image/webp"
+    assert response.headers["ETag"] == f'"{image_hash}-card-webp"'
+    assert response.cache_control.immutable
+    assert image.get_image_path(image_hash).exists()
+
+    tear_down(test_client)
+
+
+def test_api_event_image_variants_not_queued(test_client):
+    from ..app import db
+    from ..datalayer.image_job import ImageJobDataLayer
+    from ..models import ImageJob
+
+    setup(test_client)
+    image_file_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "images", "logo.png"
+    )
+    with open(image_file_path, "rb") as image_file:
+        image_data = image_file.read()
+    event = EventDataLayer()
+    event.update_image(event_id=1, image=image_data)
+    image_hash = hashlib.sha256(image_data).hexdigest()
+    image = ImageDataLayer()
+    card_path = image.get_image_path(image_hash, "card")
+    card_path.unlink()
+
+    # the variants of the image failed to be generated, so reading it does not queue them again
+    assert test_client.get("/api/1/image?size=card").status_code == 200
+    job_data = ImageJobDataLayer()
+    with app.app_context():
+        job_id = ImageJob.query.one().id
+    job_data.fail_job(job_id, "Image is not given in correct format")
+    for _ in range(2):
+        assert test_client.get("/api/1/image?size=card").status_code == 200
+    with app.app_context():
+        assert ImageJob.query.count() == 1
+    assert not image.get_upload_path(
+        image.get_variants_upload_name(image_hash)
+    ).exists()
+
+    # the original is gone, but its stored variants are still served
+    with app.app_context():
+        ImageJob.query.delete()
+        db.session.commit()
+    image.get_image_path(image_hash).unlink()
+    response = test_client.get(
+        "/api/1/image?size=card", headers={"Accept": "image/webp,*/*;q=0.8"}
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    with app.app_context():
+        assert ImageJob.query.count() == 0
+    assert test_client.get("/api/1/image?size=card").status_code == 404
+
+    tear_down(test_client)
+
+
+def test_api_event_image_range(test_client):
+    setup(test_client)
+    image_file_path = os.path.join(
+        os.path.dirname(__file__), "..", "..", "images", "logo.png"
+    )
+    with open(image_file_path, "rb") as image_file:
+        image_data = image_file.read()
+    event = EventDataLayer()
+    event.update_image(event_id=1, image=image_data)
+    image_url = test_client.get("/api/1").json["image_url"]
+    etag = test_client.get(image_url).headers["ETag"]
+
+    response = test_client.get(image_url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(image_data)}"
+    assert response.data == image_data[100:200]
+
+    # resuming a download of the same image
+    response = test_client.get(
+        image_url, headers={"Range": "bytes=1000-", "If-Range": etag}
+    )
+    assert response.status_code == 206
+    assert response.data == image_data[1000:]
+
+    # the image changed since the download started, so it restarts
+    response = test_client.get(
+        image_url, headers={"Range": "bytes=1000-", "If-Range": '"outdated"'}
+    )
+    assert response.status_code == 200
+    assert response.data == image_data
+
+    response = test_client.get(
+        image_url, headers={"Range": f"bytes={len(image_data)}-"}
+    )
+    assert response.status_code == 416
+
+    tear_down(test_client)
+
+
 def test_api_event_details(test_client):
     setup(test_client)
     try:
@@ -1,15 +1,20 @@
 import os
 import pytest
 import logging
+from contextlib import contextmanager
+from sqlalchemy import event
 
 from ..app import app, db
 from ..models import User, Event, Tag, Like
+from ..datalayer.like import LikeDataLayer
+from ..datalayer.suggestion import SuggestionDataLayer
 
 
 @pytest.fixture(scope="function")
-def test_client():
+def test_client(tmp_path):
     app.config["TESTING"] = True
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///tests/db/test_datalayer.db"
+    app.config["IMAGE_STORE_PATH"] = str(tmp_path / "image-store")
 
     # Get the directory of the current script
     current_dir = os.getcwd()
@@ -31,6 +36,8 @@ def test_client():
         db.session.execute(Tag.__table__.delete())
         db.session.execute(Like.__table__.delete())
         db.session.commit()
+    SuggestionDataLayer().reset()
+    LikeDataLayer().reset()
 
     yield app.test_client()
 
@@ -43,3 +50,22 @@ def test_client():
         except Exception as e:
             # Handle any exceptions that may occur during teardown
             logging.error(f"Teardown error: {str(e)}")
+
+
+@contextmanager
+def count_queries():
+    """
+    Collects the SQL statements executed by the database engine inside the block.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
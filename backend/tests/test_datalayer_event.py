@@ -6,11 +6,14 @@ import os
 from pathlib import Path
 
 from .test_datalayer import test_client
+from sqlalchemy import event as sa_event
 
 from ..app import app, db
 from ..datalayer.user import UserDataLayer
 from ..datalayer.event import EventDataLayer
 from ..datalayer.tag import TagDataLayer
+from ..datalayer.image import ImageDataLayer
+from ..migrate import migrate_filter_keys
 from ..models import User, Event, Tag
 
 
@@ -430,7 +433,9 @@ def test_event_update(test_client):
         assert len(new_event.tags) == 1
         assert new_event.tags[0].name == "Tag 1"
 
-        image_data = new_event.image
+        assert new_event.image is None
+        assert new_event.image_hash is not None
+        image_data = ImageDataLayer().get_image(new_event.image_hash)
         image = Image.open(io.BytesIO(image_data))
 
         subdirectory_name = "output_images"
@@ -1000,9 +1005,10 @@ def test_update_image(test_client):
     with app.app_context():
         event = Event.query.filter_by(title="Event 1").first()
         assert event is not None
-        assert event.image is not None
+        assert event.image_hash is not None
+        assert event.image_mimetype == "image/png"
 
-        image_data = event.image
+        image_data = ImageDataLayer().get_image(event.image_hash)
         image = Image.open(io.BytesIO(image_data))
 
         subdirectory_name = "output_images"
@@ -1068,9 +1074,10 @@ def test_update_image(test_client):
     with app.app_context():
         event = Event.query.filter_by(title="Event 1").first()
         assert event is not None
-        assert event.image is not None
+        assert event.image_hash is not None
+        assert event.image_mimetype == "image/png"
 
-        image_data = event.image
+        image_data = ImageDataLayer().get_image(event.image_hash)
         image = Image.open(io.BytesIO(image_data))
 
         subdirectory_name = "output_images"
@@ -1547,3 +1554,301 @@ def test_get_unexpired_events(test_client):
         assert len(unexpired_events) == 2
         assert unexpired_events[0].title == "Event 2"
         assert unexpired_events[1].title == "Event 3"
+
+
+def create_feed_events(user_id, count):
+    event = EventDataLayer()
+    for number in range(count):
+        event.create_event(
+            title=f"Event {count - number}",
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location="Toronto",
+            start_time=f"2099-10-0{1 + number % 3} 3:30:00",
+            end_time="2099-10-04 4:00:00",
+            author_id=user_id,
+            club="Tenzino fan club",
+            is_published=True,
+            image=None,
+        )
+
+
+def read_feed_pages(read_page):
+    pages = []
+    cursor = None
+    while True:
+        with app.app_context():
+            events, cursor = read_page(cursor)
+            pages.append([event.title for event in events])
+        if cursor is None:
+            return pages
+
+
+def test_get_unexpired_events_page(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    create_feed_events(user_id, 5)
+    event = EventDataLayer()
+
+    pages = read_feed_pages(lambda cursor: event.get_unexpired_events_page(2, cursor))
+    assert pages == [["Event 5", "Event 4"], ["Event 3", "Event 2"], ["Event 1"]]
+
+    for cursor in [
+        "not a cursor",
+        event.helper_encode_cursor({"sort": "id", "after": [None]}),
+    ]:
+        try:
+            event.get_unexpired_events_page(2, cursor=cursor)
+        except ValueError as error:
+            assert str(error) == "Cursor is not given in correct format"
+        else:
+            assert False
+
+
+def test_search_filter_sort_page(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    create_feed_events(user_id, 5)
+    event = EventDataLayer()
+
+    # every sort mode pages through the same events as the whole list, in the same order
+    for sort_by in [None, "alphabetical", "date", "trending", "relevance"]:
+        with app.app_context():
+            titles = [
+                result.title for result in event.search_filter_sort(sort_by=sort_by)
+            ]
+        pages = read_feed_pages(
+            lambda cursor: event.search_filter_sort_page(
+                2, cursor=cursor, sort_by=sort_by
+            )
+        )
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert sum(pages, []) == titles
+
+    pages = read_feed_pages(
+        lambda cursor: event.search_filter_sort_page(2, cursor, sort_by="date")
+    )
+    # events starting at the same time are ordered by id
+    assert pages == [["Event 5", "Event 2"], ["Event 4", "Event 1"], ["Event 3"]]
+
+    # a cursor only continues the sort mode it was returned for
+    _, cursor = event.search_filter_sort_page(2, sort_by="date")
+    try:
+        event.search_filter_sort_page(2, cursor=cursor, sort_by="alphabetical")
+    except ValueError as error:
+        assert str(error) == "Cursor is not given in correct format"
+    else:
+        assert False
+
+    # cursors with values of the wrong type are rejected before they reach the query
+    bad_positions = [
+        ("id", [{"a": 1}]),
+        ("id", [None]),
+        ("id", [True]),
+        ("alphabetical", [1, 2]),
+        ("alphabetical", ["event", "2"]),
+        ("trending", ["1", 2]),
+        ("relevance", ["1", 2]),
+    ]
+    for sort_name, after in bad_positions:
+        sort_by = None if sort_name == "id" else sort_name
+        cursor = event.helper_encode_cursor({"sort": sort_name, "after": after})
+        try:
+            event.search_filter_sort_page(2, cursor=cursor, sort_by=sort_by)
+        except ValueError as error:
+            assert str(error) == "Cursor is not given in correct format"
+        else:
+            assert False
+    # a relevance cursor without a keyword does not continue a search with one
+    _, cursor = event.search_filter_sort_page(2, sort_by="relevance")
+    try:
+        event.search_filter_sort_page(
+            2, cursor=cursor, keyword="event", sort_by="relevance"
+        )
+    except ValueError as error:
+        assert str(error) == "Cursor is not given in correct format"
+    else:
+        assert False
+
+
+def test_api_feed_page(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    create_feed_events(user_id, 3)
+
+    # without a limit, the whole list is returned
+    response = test_client.get("/api/")
+    assert len(response.json) == 3
+
+    response = test_client.get("/api/?limit=2")
+    assert [result["title"] for result in response.json["results"]] == [
+        "Event 3",
+        "Event 2",
+    ]
+    cursor = response.json["next_cursor"]
+    response = test_client.get(f"/api/?limit=2&cursor={cursor}")
+    assert [result["title"] for result in response.json["results"]] == ["Event 1"]
+    assert response.json["next_cursor"] is None
+
+    response = test_client.get("/api/filter?sortby=alphabetical&limit=2")
+    assert [result["title"] for result in response.json["results"]] == [
+        "Event 1",
+        "Event 2",
+    ]
+    cursor = response.json["next_cursor"]
+    response = test_client.get(
+        f"/api/filter?sortby=alphabetical&limit=2&cursor={cursor}"
+    )
+    assert [result["title"] for result in response.json["results"]] == ["Event 3"]
+
+    response = test_client.get("/api/filter?limit=2&cursor=abc")
+    assert response.status_code == 400
+
+
+def explain_filter_query(**filters):
+    """
+    Returns the query plan of the statement search_filter_sort selects the events with.
+    """
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        if not executed:
+            executed.append((statement, parameters))
+
+    event = EventDataLayer()
+    with app.app_context():
+        engine = db.engine
+    sa_event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        event.search_filter_sort(**filters)
+    finally:
+        sa_event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    statement, parameters = executed[0]
+    with app.app_context():
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            # On a table this small a sequential scan is always cheaper
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters)
+            return "\n".join(row[0] for row in rows)
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        return "\n".join(row[-1] for row in rows)
+
+
+def test_search_filter_sort_date_uses_index(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    create_feed_events(user_id, 3)
+    event = EventDataLayer()
+
+    # the ends of the ranges are included, to the end of the day
+    with app.app_context():
+        events = event.search_filter_sort(
+            start_time="2099-10-02", end_time="2099-10-04"
+        )
+        assert [result.title for result in events] == ["Event 2", "Event 1"]
+        events = event.search_filter_sort(
+            start_time="2099-10-01", end_time="2099-10-03"
+        )
+        assert events == []
+        events = event.search_filter_sort(start_time="2099-10-03")
+        assert [result.title for result in events] == ["Event 1"]
+
+    for filters in [
+        {"start_time": "2099-10-02", "end_time": "2099-10-04"},
+        {"start_time": "2099-10-03"},
+    ]:
+        plan = explain_filter_query(**filters)
+        assert "ix_event_" in plan
+        assert "date(" not in plan.lower()
+
+
+def test_search_filter_sort_location_club(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    event = EventDataLayer()
+    for title, location, club in [
+        ("Event 1", "UC College", "Chess club"),
+        ("Event 2", "uc college", "Chess club of Toronto"),
+        ("Event 3", "Hart House", "Go club"),
+    ]:
+        event.create_event(
+            title=title,
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location=location,
+            start_time="2099-10-03 3:30:00",
+            end_time="2099-10-03 4:00:00",
+            author_id=user_id,
+            club=club,
+            is_published=True,
+            image=None,
+        )
+
+    def titles(**filters):
+        with app.app_context():
+            return [result.title for result in event.search_filter_sort(**filters)]
+
+    # dropdown values match whole locations and clubs, whatever their case
+    assert titles(location="UC college") == ["Event 1", "Event 2"]
+    assert titles(club="chess CLUB") == ["Event 1"]
+    assert titles(location="college") == []
+    # free text matches anywhere in them
+    assert titles(location="college", match="substring") == ["Event 1", "Event 2"]
+    assert titles(club="chess", match="substring") == ["Event 1", "Event 2"]
+
+    assert "ix_event_location_key" in explain_filter_query(location="UC college")
+    assert "ix_event_club_key" in explain_filter_query(club="Go club")
+
+    response = test_client.get("/api/filter?club=go%20club")
+    assert [result["title"] for result in response.json] == ["Event 3"]
+    response = test_client.get("/api/filter?club=club&match=substring")
+    assert len(response.json) == 3
+
+    # events created before the keys existed get them from the migration
+    with app.app_context():
+        db.session.execute(db.update(Event).values(location_key=None, club_key=None))
+        db.session.commit()
+    assert titles(location="UC college") == []
+    assert migrate_filter_keys(batch_size=2) == 3
+    assert titles(location="UC college") == ["Event 1", "Event 2"]
+
+
+def test_search_filter_sort_orders_use_index(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser10",
+        email="testuser10@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    create_feed_events(user_id, 3)
+
+    assert "ix_event_title_lower" in explain_filter_query(sort_by="alphabetical")
+    assert "ix_event_trending" in explain_filter_query(sort_by="trending")
@@ -0,0 +1,263 @@
+from datetime import datetime
+import base64
+import io
+import os
+from PIL import Image
+
+from .test_datalayer import test_client
+
+from ..app import app, db
+from ..datalayer.image import ImageDataLayer
+from ..datalayer.event import EventDataLayer
+from ..datalayer.user import UserDataLayer
+from ..migrate import migrate_images, migrate_placeholders
+from ..models import Event
+
+
+def read_logo():
+    current_directory = os.path.dirname(__file__)
+    image_file_path = os.path.join(current_directory, "../../images", "logo.png")
+    with open(image_file_path, "rb") as image_file:
+        return image_file.read()
+
+
+def create_legacy_event(title, image):
+    """
+    Inserts an event whose image bytes are still stored in the database.
+    """
+    with app.app_context():
+        event = Event(
+            title=title,
+            location="Toronto",
+            start_time=datetime(2023, 10, 3, 3, 30),
+            end_time=datetime(2023, 10, 3, 4, 0),
+            is_published=True,
+            like_count=0,
+            image=image,
+        )
+        db.session.add(event)
+        db.session.commit()
+        return event.id
+
+
+def test_store_image(test_client):
+    image_data = read_logo()
+    image = ImageDataLayer()
+
+    image_hash, image_size, image_mimetype = image.store_image(image_data)
+
+    assert len(image_hash) == 64
+    assert image_size == len(image_data)
+    assert image_mimetype == "image/png"
+    assert image.get_image_path(image_hash).exists()
+    assert image.get_image(image_hash) == image_data
+
+
+def test_store_image_deduplicates(test_client):
+    image_data = read_logo()
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+
+    event = EventDataLayer()
+    event_ids = [
+        event.create_event(
+            title=f"Event {i}",
+            description="Kickoff for club 1",
+            extended_description="Extended decription for event 1",
+            location="Toronto",
+            start_time="2023-10-03 3:30:00",
+            end_time="2023-10-03 4:00:00",
+            author_id=user_id,
+            club="club 1",
+            is_published=True,
+            image=image_data,
+        )
+        for i in range(2)
+    ]
+
+    with app.app_context():
+        hashes = {db.session.get(Event, event_id).image_hash for event_id in event_ids}
+    assert len(hashes) == 1
+    image_directory = ImageDataLayer().get_image_path(hashes.pop()).parent
+    # one file per size and encoding of the image
+    sizes = 1 + len(ImageDataLayer.IMAGE_SIZES)
+    encodings = 1 + len(ImageDataLayer().get_image_encodings())
+    assert len(list(image_directory.iterdir())) == sizes * encodings
+
+
+def test_store_image_variants(test_client):
+    image_data = read_logo()
+    image = ImageDataLayer()
+
+    image_hash, _, _ = image.store_image(image_data)
+
+    # variants are generated when the image is stored
+    card_path = image.get_image_path(image_hash, "card")
+    detail_path = image.get_image_path(image_hash, "detail")
+    assert card_path.exists()
+    assert detail_path.exists()
+    with Image.open(card_path) as card_image:
+        assert card_image.format == "PNG"
+        assert card_image.width == ImageDataLayer.IMAGE_SIZES["card"]
+    # the logo is narrower than the detail size, so it is not upscaled
+    assert image.get_image(image_hash, "detail") == image_data
+
+    # missing variants are generated once, then reused
+    card_path.unlink()
+    assert image.get_image_variant_path(image_hash, "card") == card_path
+    modified_time = card_path.stat().st_mtime_ns
+    image.get_image_variant_path(image_hash, "card")
+    assert card_path.stat().st_mtime_ns == modified_time
+
+    try:
+        image.get_image_variant_path(image_hash, "huge")
+    except ValueError as value_error:
+        assert str(value_error) == "Image size huge does not exist"
+    else:
+        assert False
+
+
+def test_store_image_encodings(test_client):
+    image_data = read_logo()
+    image = ImageDataLayer()
+
+    image_hash, _, _ = image.store_image(image_data)
+
+    assert "webp" in image.get_image_encodings()
+    for size in [image.ORIGINAL, *ImageDataLayer.IMAGE_SIZES]:
+        webp_path = image.get_image_path(image_hash, size, "webp")
+        assert webp_path.exists()
+        with Image.open(webp_path) as webp_image:
+            assert webp_image.format == "WEBP"
+    assert len(image.get_image(image_hash, encoding="webp")) < len(image_data)
+
+    try:
+        image.get_image_variant_path(image_hash, "card", "bmp")
+    except ValueError as value_error:
+        assert str(value_error) == "Image encoding bmp does not exist"
+    else:
+        assert False
+
+
+def test_store_image_exif_orientation(test_client):
+    # a photo stored sideways, with an EXIF tag saying to turn it a quarter clockwise
+    photo = Image.new("RGB", (2000, 1000), "red")
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    output = io.BytesIO()
+    photo.save(output, format="JPEG", exif=exif)
+    image = ImageDataLayer()
+
+    image_hash, _, _ = image.store_image(output.getvalue())
+
+    card_width = ImageDataLayer.IMAGE_SIZES["card"]
+    for encoding in [None, "webp"]:
+        card_path = image.get_image_path(image_hash, "card", encoding)
+        with Image.open(card_path) as card_image:
+            assert card_image.size == (card_width, 2 * card_width)
+    with Image.open(image.get_image_path(image_hash, "original", "webp")) as webp_image:
+        assert webp_image.size == (1000, 2000)
+    # narrower than the detail size, but still turned upright
+    with Image.open(image.get_image_path(image_hash, "detail")) as detail_image:
+        assert detail_image.size == (1000, 2000)
+        assert detail_image.getexif().get(0x0112, 1) == 1
+
+    placeholder = image.create_placeholder(image_hash)
+    encoded = placeholder.split(",", 1)[1]
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as placeholder_image:
+        assert placeholder_image.size == (16, 32)
+
+
+def test_create_placeholder(test_client):
+    image_data = read_logo()
+    image = ImageDataLayer()
+    image_hash, _, _ = image.store_image(image_data)
+
+    placeholder = image.create_placeholder(image_hash)
+
+    header, encoded = placeholder.split(",", 1)
+    assert header == "data:image/webp;base64"
+    # small enough to inline in every event of a list payload
+    assert len(placeholder) < 1000
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as placeholder_image:
+        assert placeholder_image.width == ImageDataLayer.PLACEHOLDER_WIDTH
+
+
+def test_migrate_placeholders(test_client):
+    image_hash, image_size, image_mimetype = ImageDataLayer().store_image(read_logo())
+    with app.app_context():
+        event = Event(
+            title="Event 1",
+            location="Toronto",
+            start_time=datetime(2023, 10, 3, 3, 30),
+            end_time=datetime(2023, 10, 3, 4, 0),
+            is_published=True,
+            like_count=0,
+            image_hash=image_hash,
+            image_size=image_size,
+            image_mimetype=image_mimetype,
+        )
+        db.session.add(event)
+        db.session.commit()
+        event_id = event.id
+
+    assert migrate_placeholders(batch_size=1) == 1
+    assert migrate_placeholders(batch_size=1) == 0
+    with app.app_context():
+        placeholder = db.session.get(Event, event_id).image_placeholder
+    assert placeholder == ImageDataLayer().create_placeholder(image_hash)
+
+
+def test_store_invalid_image(test_client):
+    image = ImageDataLayer()
+    try:
+        image.store_image(b"not an image")
+    except TypeError as type_error:
+        assert str(type_error) == "Image is not given in correct format"
+    else:
+        assert False
+
+
+def test_migrate_images(test_client):
+    image_data = read_logo()
+    first_id = create_legacy_event("Event 1", image_data)
+    second_id = create_legacy_event("Event 2", image_data)
+    unreadable_id = create_legacy_event("Event 3", b"not an image")
+
+    assert migrate_images(batch_size=1) == 2
+    # running it again has nothing left to move
+    assert migrate_images(batch_size=1) == 0
+
+    with app.app_context():
+        for event_id in [first_id, second_id]:
+            event = db.session.get(Event, event_id)
+            assert event.image is None
+            assert event.image_mimetype == "image/png"
+            assert ImageDataLayer().get_image(event.image_hash) == image_data
+        assert db.session.get(Event, unreadable_id).image_hash is None
+
+    response = test_client.get(f"/api/{first_id}/image")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.data == image_data
+
+
+def test_legacy_image_range(test_client):
+    image_data = read_logo()
+    event_id = create_legacy_event("Event 1", image_data)
+
+    response = test_client.get(f"/api/{event_id}/image")
+    assert response.status_code == 200
+    assert response.data == image_data
+    assert response.cache_control.no_cache
+
+    response = test_client.get(
+        f"/api/{event_id}/image", headers={"Range": "bytes=0-99"}
+    )
+    assert response.status_code == 206
+    assert response.data == image_data[:100]
@@ -0,0 +1,255 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import io
+import os
+
+from .test_datalayer import test_client
+
+from ..app import app, db
+from ..datalayer.event import EventDataLayer
+from ..datalayer.image import ImageDataLayer
+from ..datalayer.image_job import ImageJobDataLayer
+from ..datalayer.user import UserDataLayer
+from ..models import Event, ImageJob
+from ..worker import process_pending_jobs
+
+
+def read_logo():
+    current_directory = os.path.dirname(__file__)
+    image_file_path = os.path.join(current_directory, "../../images", "logo.png")
+    with open(image_file_path, "rb") as image_file:
+        return image_file.read()
+
+
+def create_event():
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    event = EventDataLayer()
+    return event.create_event(
+        title="Event 1",
+        description="Kickoff for club 1",
+        extended_description="Extended decription for event 1",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        author_id=user_id,
+        club="club 1",
+        is_published=True,
+        image=None,
+    )
+
+
+def test_process_image_job(test_client):
+    event_id = create_event()
+    image_data = read_logo()
+    job_data = ImageJobDataLayer()
+
+    job_id = job_data.create_job(event_id=event_id, image_stream=io.BytesIO(image_data))
+    job = job_data.get_job(job_id)
+    assert job.status == job_data.PENDING
+    upload_path = ImageDataLayer().get_upload_path(job.upload_name)
+    assert upload_path.exists()
+
+    assert process_pending_jobs() == 1
+    # nothing is left in the queue
+    assert process_pending_jobs() == 0
+
+    assert job_data.get_job(job_id).status == job_data.DONE
+    assert not upload_path.exists()
+    with app.app_context():
+        event = db.session.get(Event, event_id)
+        assert event.image_mimetype == "image/png"
+        assert ImageDataLayer().get_image(event.image_hash) == image_data
+        assert ImageDataLayer().get_image_path(event.image_hash, "card").exists()
+        assert event.image_placeholder.startswith("data:image/")
+
+
+def test_process_image_job_in_process_pool(test_client):
+    event_id = create_event()
+    job_data = ImageJobDataLayer()
+    job_id = job_data.create_job(
+        event_id=event_id, image_stream=io.BytesIO(read_logo())
+    )
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        assert process_pending_jobs(executor) == 1
+
+    assert job_data.get_job(job_id).status == job_data.DONE
+
+
+def test_process_invalid_image_job(test_client):
+    event_id = create_event()
+    job_data = ImageJobDataLayer()
+
+    # the header looks like a PNG, so only the worker finds out it is not an image
+    job_id = job_data.create_job(
+        event_id=event_id, image_stream=io.BytesIO(b"\x89PNG\r\n\x1a\nnot an image")
+    )
+    assert process_pending_jobs() == 1
+
+    job = job_data.get_job(job_id)
+    assert job.status == job_data.FAILED
+    assert job.error == "Image is not given in correct format"
+    with app.app_context():
+        assert db.session.get(Event, event_id).image_hash is None
+
+
+def test_image_job_invalid_upload(test_client, monkeypatch):
+    event_id = create_event()
+    job_data = ImageJobDataLayer()
+    upload_directory = ImageDataLayer().get_upload_path("name").parent
+
+    try:
+        job_data.create_job(event_id=event_id, image_stream=io.BytesIO(b"not an image"))
+    except TypeError as type_error:
+        assert str(type_error) == "Image is not given in correct format"
+    else:
+        assert False
+
+    monkeypatch.setitem(app.config, "MAX_IMAGE_UPLOAD_BYTES", 1000)
+    try:
+        job_data.create_job(event_id=event_id, image_stream=io.BytesIO(read_logo()))
+    except ValueError as value_error:
+        assert str(value_error) == "Image should be at most 1000 bytes"
+    else:
+        assert False
+
+    # neither upload is queued or left on disk
+    with app.app_context():
+        assert ImageJob.query.count() == 0
+    assert not upload_directory.exists() or not any(upload_directory.iterdir())
+
+
+def test_image_job_event_not_exist(test_client):
+    job_data = ImageJobDataLayer()
+    try:
+        job_data.create_job(event_id=1, image_stream=io.BytesIO(read_logo()))
+    except ValueError as value_error:
+        assert str(value_error) == "Event with id 1 does not exist"
+    else:
+        assert False
+
+
+def test_requeue_stale_image_jobs(test_client):
+    event_id = create_event()
+    job_data = ImageJobDataLayer()
+    job_id = job_data.create_job(
+        event_id=event_id, image_stream=io.BytesIO(read_logo())
+    )
+
+    assert len(job_data.claim_pending_jobs(10)) == 1
+    # a claimed job is not handed out twice
+    assert job_data.claim_pending_jobs(10) == []
+    assert job_data.requeue_stale_jobs(timedelta(minutes=10)) == 0
+
+    with app.app_context():
+        job = db.session.get(ImageJob, job_id)
+        job.updated_at = datetime.now() - timedelta(minutes=11)
+        db.session.commit()
+    assert job_data.requeue_stale_jobs(timedelta(minutes=10)) == 1
+    assert job_data.get_job(job_id).status == job_data.PENDING
+
+
+def test_image_job_deleted_while_processed(test_client):
+    event_id = create_event()
+    job_data = ImageJobDataLayer()
+    job_ids = [
+        job_data.create_job(event_id=event_id, image_stream=io.BytesIO(read_logo()))
+        for _ in range(2)
+    ]
+    job_data.claim_pending_jobs(10)
+
+    # the event is deleted while the worker processes its jobs
+    with app.app_context():
+        ImageJob.query.delete()
+        db.session.commit()
+    job_data.finish_job(job_ids[0], "0" * 64, 100, "image/png")
+    job_data.fail_job(job_ids[1], "Image is not given in correct format")
+    with app.app_context():
+        assert ImageJob.query.count() == 0
+
+
+def test_api_update_post_image(test_client):
+    event_id = create_event()
+    image_data = read_logo()
+
+    response = test_client.post(
+        f"/api/update-post-image/{event_id}",
+        data={"image": (io.BytesIO(image_data), "logo.png")},
+    )
+    assert response.status_code == 202
+    assert response.json["status"] == "pending"
+    job_id = response.json["job_id"]
+
+    response = test_client.get(f"/api/image-jobs/{job_id}")
+    assert response.json["status"] == "pending"
+
+    process_pending_jobs()
+
+    response = test_client.get(f"/api/image-jobs/{job_id}")
+    assert response.json["status"] == "done"
+    image_url = test_client.get(f"/api/{event_id}").json["image_url"]
+    assert test_client.get(image_url).data == image_data
+
+    response = test_client.get(f"/api/image-jobs/{job_id + 1}")
+    assert response.status_code == 404
+
+
+def test_api_update_post_image_too_large(test_client, monkeypatch):
+    event_id = create_event()
+    monkeypatch.setitem(app.config, "MAX_IMAGE_UPLOAD_BYTES", 1000)
+
+    response = test_client.post(
+        f"/api/update-post-image/{event_id}",
+        data={"image": (io.BytesIO(read_logo()[:2000]), "logo.png")},
+    )
+    assert response.status_code == 400
+    assert response.json["error message"] == "Image should be at most 1000 bytes"
+
+    # the request body is rejected before it is read
+    response = test_client.post(
+        f"/api/update-post-image/{event_id}",
+        data={"image": (io.BytesIO(b"0" * 100 * 1024), "logo.png")},
+    )
+    assert response.status_code == 413
+
+    # so is a body without a Content-Length, before it is spooled to disk
+    boundary = "upload-boundary"
+    body = (
+        (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="image"; filename="logo.png"\r\n'
+            "Content-Type: image/png\r\n\r\n"
+        ).encode()
+        + b"0" * 100 * 1024
+        + f"\r\n--{boundary}--\r\n".encode()
+    )
+    response = test_client.post(
+        f"/api/update-post-image/{event_id}",
+        input_stream=io.BytesIO(body),
+        content_type=f"multipart/form-data; boundary={boundary}",
+        headers={"Transfer-Encoding": "chunked"},
+        # Set by servers such as gunicorn for chunked bodies
+        environ_overrides={"wsgi.input_terminated": True},
+    )
+    assert response.status_code == 413
+    with app.app_context():
+        assert ImageJob.query.count() == 0
+
+    # other routes are not limited to the size of an image
+    response = test_client.post(
+        "/api/token",
+        json={"user_identifier": "nobody", "password": "0" * 100 * 1024},
+    )
+    assert response.status_code == 404
+
+    response = test_client.post(
+        f"/api/update-post-image/{event_id}",
+        data={"image": (io.BytesIO(b"not an image"), "logo.png")},
+    )
+    assert response.status_code == 400
@@ -1,14 +1,20 @@
 import sys
 import logging
 
-from .test_datalayer import test_client
+from .test_datalayer import test_client, count_queries
 
-from ..app import app
-from ..datalayer.like import LikeDataLayer
+from ..app import app, db
+from ..datalayer import like as like_module
+from ..datalayer.like import LikeDataLayer, like_buffer
 from ..datalayer.tag import TagDataLayer
 from ..datalayer.event import EventDataLayer
 from ..datalayer.user import UserDataLayer
+from ..migrate import create_indexes
+from ..reconcile_likes import main as reconcile_likes_main, reconcile_like_counts
 from ..models import User, Event, Like
+from flask_jwt_extended import create_access_token
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 
 def test_user_liked_event(test_client):
@@ -364,6 +370,503 @@ def test_user_liked_events(test_client):
         logging.debug(f"Error: {error}")
         assert error == None
 
+    # most recently liked first
     assert len(liked_events) == 2
-    assert liked_events[0].title == "Event 1"
-    assert liked_events[1].title == "Event 2"
+    assert liked_events[0].title == "Event 2"
+    assert liked_events[1].title == "Event 1"
+
+
+def test_migrate_indexes_dedupes_likes(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    event = EventDataLayer()
+    event_id = event.create_event(
+        title="Event 1",
+        description="Kickoff event 1 for club 1",
+        extended_description="Extended decription for event 1 for club 1",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        author_id=user_id,
+        club="Club 1",
+        is_published=True,
+        image=None,
+    )
+    like = LikeDataLayer()
+    like.like_by_id(user_id=user_id, event_id=event_id)
+
+    # a database created before likes were unique
+    with app.app_context():
+        db.session.execute(text("DROP INDEX ix_like_user_id_event_id"))
+        db.session.add_all([Like(user_id=user_id, event_id=event_id) for _ in range(2)])
+        db.session.get(Event, event_id).like_count = 3
+        db.session.commit()
+
+    assert create_indexes() == 2
+    with app.app_context():
+        assert Like.query.count() == 1
+        assert db.session.get(Event, event_id).like_count == 1
+        indexes = inspect(db.engine).get_indexes("like")
+        unique_indexes = [index["name"] for index in indexes if index["unique"]]
+        assert "ix_like_user_id_event_id" in unique_indexes
+    assert create_indexes() == 0
+
+
+def test_api_liked_event_ids(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    event = EventDataLayer()
+    event_ids = [
+        event.create_event(
+            title=f"Event {number}",
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location="Toronto",
+            start_time="2099-10-03 3:30:00",
+            end_time="2099-10-03 4:00:00",
+            author_id=user_id,
+            club="Club 1",
+            is_published=True,
+            image=None,
+        )
+        for number in range(3)
+    ]
+    like = LikeDataLayer()
+    like.like_by_id(user_id=user_id, event_id=event_ids[2])
+    like.like_by_id(user_id=user_id, event_id=event_ids[0])
+    assert like.get_liked_event_ids(user_id) == [event_ids[0], event_ids[2]]
+
+    with app.app_context():
+        headers = {"Authorization": "Bearer " + create_access_token(identity=user_id)}
+
+    response = test_client.get("/api/likes/ids", headers=headers)
+    assert response.status_code == 200
+    assert response.json == [event_ids[0], event_ids[2]]
+    etag = response.headers["ETag"]
+
+    # unchanged likes are revalidated without a body
+    response = test_client.get(
+        "/api/likes/ids", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    like.unlike_by_id(user_id=user_id, event_id=event_ids[0])
+    response = test_client.get(
+        "/api/likes/ids", headers={**headers, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json == [event_ids[2]]
+
+    # list payloads say which events are liked when the request has a JWT
+    response = test_client.get("/api/", headers=headers)
+    assert [result["liked"] for result in response.json] == [False, False, True]
+    response = test_client.get("/api/filter?limit=2", headers=headers)
+    assert [result["liked"] for result in response.json["results"]] == [False, False]
+    response = test_client.get("/api/")
+    assert all("liked" not in result for result in response.json)
+    response = test_client.get("/api/", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 200
+    assert all("liked" not in result for result in response.json)
+
+    assert test_client.get("/api/likes/ids").status_code == 401
+
+
+def test_like_counts_atomically(test_client):
+    user = UserDataLayer()
+    user_ids = [
+        user.create_user(
+            username=f"testuser{number}",
+            email=f"testuser{number}@example.com",
+            password_hash="testpassword",
+            password_salt="testpassword",
+        )
+        for number in range(3)
+    ]
+    event = EventDataLayer()
+    event_id = event.create_event(
+        title="Event 1",
+        description="Kickoff event 1 for club 1",
+        extended_description="Extended decription for event 1 for club 1",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        author_id=user_ids[0],
+        club="Club 1",
+        is_published=True,
+        image=None,
+    )
+    like = LikeDataLayer()
+
+    # the like is inserted and counted without reading the event first
+    with count_queries() as statements:
+        like.like_by_id(user_id=user_ids[0], event_id=event_id)
+    assert [statement.split()[0] for statement in statements] == ["INSERT", "UPDATE"]
+    assert "coalesce(event.like_count, ?) + ?" in statements[1]
+
+    like.like_by_id(user_id=user_ids[1], event_id=event_id)
+    like.like_by_id(user_id=user_ids[2], event_id=event_id)
+    try:
+        like.like_by_id(user_id=user_ids[2], event_id=event_id)
+    except ValueError as value_error:
+        assert str(value_error) == "User-event pair already exists"
+    else:
+        assert False
+    with app.app_context():
+        assert db.session.get(Event, event_id).like_count == 3
+
+    like.unlike_by_id(user_id=user_ids[1], event_id=event_id)
+    # unliking twice only uncounts once
+    like.unlike_by_id(user_id=user_ids[1], event_id=event_id)
+    with app.app_context():
+        assert db.session.get(Event, event_id).like_count == 2
+        assert Like.query.filter_by(event_id=event_id).count() == 2
+
+    try:
+        like.unlike_by_id(user_id=user_ids[1], event_id=event_id + 1)
+    except ValueError as value_error:
+        assert str(value_error) == "Event does not exist"
+    else:
+        assert False
+
+
+def test_like_buffer(test_client, monkeypatch):
+    monkeypatch.setitem(app.config, "LIKE_BUFFER_FLUSH_MS", 60000)
+    # the exit handler is registered once, not whenever a flusher thread starts
+    exit_handlers = []
+    monkeypatch.setattr(like_module.atexit, "register", exit_handlers.append)
+    monkeypatch.setattr(like_buffer, "flusher", None)
+    user = UserDataLayer()
+    user_ids = [
+        user.create_user(
+            username=f"testuser{number}",
+            email=f"testuser{number}@example.com",
+            password_hash="testpassword",
+            password_salt="testpassword",
+        )
+        for number in range(3)
+    ]
+    event = EventDataLayer()
+    event_ids = [
+        event.create_event(
+            title=f"Event {number}",
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location="Toronto",
+            start_time="2099-10-03 3:30:00",
+            end_time="2099-10-03 4:00:00",
+            author_id=user_ids[0],
+            club="Club 1",
+            is_published=True,
+            image=None,
+        )
+        for number in range(2)
+    ]
+    like = LikeDataLayer()
+
+    # buffered likes never query the database
+    with count_queries() as statements:
+        for user_id in user_ids:
+            like.like_by_id(user_id=user_id, event_id=event_ids[0])
+    assert statements == []
+    like.like_by_id(user_id=user_ids[0], event_id=event_ids[1])
+    # a like and an unlike of the same pair cancel out
+    like.like_by_id(user_id=user_ids[1], event_id=event_ids[1])
+    like.unlike_by_id(user_id=user_ids[1], event_id=event_ids[1])
+    try:
+        like.like_by_id(user_id=user_ids[0], event_id=event_ids[0])
+    except ValueError as value_error:
+        assert str(value_error) == "User-event pair already exists"
+    else:
+        assert False
+    # the like of a missing event is only dropped when it is flushed
+    like.like_by_id(user_id=user_ids[0], event_id=event_ids[1] + 1)
+
+    with app.app_context():
+        assert Like.query.count() == 0
+        assert db.session.get(Event, event_ids[0]).like_count == 0
+        headers = {
+            "Authorization": "Bearer " + create_access_token(identity=user_ids[0])
+        }
+    # payloads count the buffered likes
+    response = test_client.get("/api/", headers=headers)
+    assert [result["like_count"] for result in response.json] == [3, 1]
+    assert [result["liked"] for result in response.json] == [True, True]
+    assert like.get_liked_event_ids(user_ids[1]) == [event_ids[0]]
+
+    # every event's like count is written once per flush
+    with count_queries() as statements:
+        assert like.flush_likes() == 4
+    assert [statement.split()[0] for statement in statements] == ["INSERT"] * 5 + [
+        "UPDATE"
+    ]
+    with app.app_context():
+        assert Like.query.count() == 4
+        assert db.session.get(Event, event_ids[0]).like_count == 3
+        assert db.session.get(Event, event_ids[1]).like_count == 1
+    response = test_client.get("/api/")
+    assert [result["like_count"] for result in response.json] == [3, 1]
+    assert like.flush_likes() == 0
+
+    like.unlike_by_id(user_id=user_ids[2], event_id=event_ids[0])
+    like.like_by_id(user_id=user_ids[1], event_id=event_ids[1])
+    assert like.get_liked_event_ids(user_ids[2]) == []
+    # listing the liked events flushes the user's buffered likes first, only theirs
+    assert like.get_liked_events(user_ids[2]) == []
+    with app.app_context():
+        assert db.session.get(Event, event_ids[0]).like_count == 2
+        assert db.session.get(Event, event_ids[1]).like_count == 1
+    assert like.get_pending_like_count(event_ids[0]) == 0
+    assert like.get_pending_like_count(event_ids[1]) == 1
+    assert like.flush_likes() == 1
+    assert like_buffer.flusher is not None
+    assert exit_handlers == []
+
+
+def test_reconcile_like_counts(test_client, capsys):
+    user = UserDataLayer()
+    user_ids = [
+        user.create_user(
+            username=f"testuser{number}",
+            email=f"testuser{number}@example.com",
+            password_hash="testpassword",
+            password_salt="testpassword",
+        )
+        for number in range(2)
+    ]
+    event = EventDataLayer()
+    event_ids = [
+        event.create_event(
+            title=f"Event {number}",
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location="Toronto",
+            start_time="2023-10-03 3:30:00",
+            end_time="2023-10-03 4:00:00",
+            author_id=user_ids[0],
+            club="Club 1",
+            is_published=True,
+            image=None,
+        )
+        for number in range(4)
+    ]
+    like = LikeDataLayer()
+    for user_id in user_ids:
+        like.like_by_id(user_id=user_id, event_id=event_ids[0])
+    like.like_by_id(user_id=user_ids[0], event_id=event_ids[1])
+    with app.app_context():
+        # the counts drift, as after a crash
+        db.session.get(Event, event_ids[0]).like_count = 5
+        db.session.get(Event, event_ids[1]).like_count = None
+        db.session.get(Event, event_ids[2]).like_count = 1
+        db.session.get(Event, event_ids[3]).like_count = None
+        db.session.commit()
+
+    reconcile_likes_main(["--dry-run"])
+    assert capsys.readouterr().out.splitlines() == [
+        f"Event {event_ids[0]}: like_count 5, 2 likes",
+        f"Event {event_ids[1]}: like_count None, 1 likes",
+        f"Event {event_ids[2]}: like_count 1, 0 likes",
+        "Would recount the likes of 3 events",
+    ]
+    with app.app_context():
+        assert db.session.get(Event, event_ids[0]).like_count == 5
+
+    # only the events that drifted are updated, one batch at a time
+    with count_queries() as statements:
+        drift = reconcile_like_counts(batch_size=2)
+    assert [event_id for event_id, _, _ in drift] == event_ids[:3]
+    assert [statement.split()[0] for statement in statements] == [
+        "SELECT",
+        "UPDATE",
+        "UPDATE",
+    ]
+    with app.app_context():
+        assert [
+            db.session.get(Event, event_id).like_count for event_id in event_ids
+        ] == [
+            2,
+            1,
+            0,
+            None,
+        ]
+    assert reconcile_like_counts() == []
+
+
+def test_liked_events_page(test_client):
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    tag = TagDataLayer()
+    tag.add_tag("Tag 1")
+    event = EventDataLayer()
+    event_ids = [
+        event.create_event(
+            title=f"Event {number}",
+            description="Kickoff event for the club",
+            extended_description="Extended decription for the event",
+            location="Toronto",
+            start_time="2023-10-03 3:30:00",
+            end_time="2023-10-03 4:00:00",
+            author_id=user_id,
+            club="Club 1",
+            is_published=True,
+            image=None,
+            tags=["Tag 1"],
+        )
+        for number in range(5)
+    ]
+    like = LikeDataLayer()
+    for event_id in [event_ids[3], event_ids[0], event_ids[4], event_ids[1]]:
+        like.like_by_id(user_id=user_id, event_id=event_id)
+
+    # the events and their likes are read in one query, then their tags in another
+    with count_queries() as statements:
+        liked_events, cursor = like.get_liked_events_page(user_id, 3)
+        assert [liked_event.tags[0].name for liked_event in liked_events] == [
+            "Tag 1"
+        ] * 3
+    assert len(statements) == 2
+    assert " JOIN " in statements[0] and "LIMIT" in statements[0]
+    assert "IN (" not in statements[0]
+    assert [liked_event.title for liked_event in liked_events] == [
+        "Event 1",
+        "Event 4",
+        "Event 0",
+    ]
+    liked_events, cursor = like.get_liked_events_page(user_id, 3, cursor=cursor)
+    assert [liked_event.title for liked_event in liked_events] == ["Event 3"]
+    assert cursor is None
+
+    try:
+        like.get_liked_events_page(user_id + 1, 3)
+    except ValueError as value_error:
+        assert str(value_error) == "User does not exist"
+    else:
+        assert False
+
+    with app.app_context():
+        headers = {"Authorization": "Bearer " + create_access_token(identity=user_id)}
+    response = test_client.get("/api/favourites", headers=headers)
+    assert [result["title"] for result in response.json] == [
+        "Event 1",
+        "Event 4",
+        "Event 0",
+        "Event 3",
+    ]
+    response = test_client.get("/api/favourites?limit=2", headers=headers)
+    assert [result["title"] for result in response.json["results"]] == [
+        "Event 1",
+        "Event 4",
+    ]
+    cursor = response.json["next_cursor"]
+    response = test_client.get(
+        f"/api/favourites?limit=2&cursor={cursor}", headers=headers
+    )
+    assert [result["title"] for result in response.json["results"]] == [
+        "Event 0",
+        "Event 3",
+    ]
+    assert response.json["next_cursor"] is None
+    response = test_client.get("/api/favourites?cursor=abc", headers=headers)
+    assert response.status_code == 400
+
+
+def test_like_buffer_counts_written_likes(test_client, monkeypatch):
+    monkeypatch.setitem(app.config, "LIKE_BUFFER_FLUSH_MS", 60000)
+    user = UserDataLayer()
+    user_ids = [
+        user.create_user(
+            username=f"testuser{number}",
+            email=f"testuser{number}@example.com",
+            password_hash="testpassword",
+            password_salt="testpassword",
+        )
+        for number in range(3)
+    ]
+    event = EventDataLayer()
+    event_id = event.create_event(
+        title="Event 1",
+        description="Kickoff event for the club",
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2099-10-03 3:30:00",
+        end_time="2099-10-03 4:00:00",
+        author_id=user_ids[0],
+        club="Club 1",
+        is_published=True,
+        image=None,
+    )
+    like = LikeDataLayer()
+
+    like.like_by_id(user_id=user_ids[0], event_id=event_id)
+    like.unlike_by_id(user_id=user_ids[1], event_id=event_id)
+    # another worker writes the same like before the flush
+    with app.app_context():
+        db.session.add(Like(user_id=user_ids[0], event_id=event_id))
+        db.session.get(Event, event_id).like_count = 1
+        db.session.commit()
+    assert like.flush_likes() == 0
+    with app.app_context():
+        assert Like.query.count() == 1
+        assert db.session.get(Event, event_id).like_count == 1
+
+    # the batch being flushed stays buffered until it is committed
+    like.like_by_id(user_id=user_ids[1], event_id=event_id)
+    with like_buffer.lock:
+        like_buffer.take()
+    try:
+        like.like_by_id(user_id=user_ids[1], event_id=event_id)
+    except ValueError as value_error:
+        assert str(value_error) == "User-event pair already exists"
+    else:
+        assert False
+    like.unlike_by_id(user_id=user_ids[1], event_id=event_id)
+    assert like.get_liked_event_ids(user_ids[1]) == []
+    # the write fails, so the like and the unlike cancel out
+    with like_buffer.lock:
+        like_buffer.finish(like_buffer.flushing)
+    assert like.get_pending_like_count(event_id) == 0
+    assert like.flush_likes() == 0
+
+    # a failing database keeps the batch buffered
+    like.like_by_id(user_id=user_ids[1], event_id=event_id)
+    like.like_by_id(user_id=user_ids[2], event_id=event_id)
+    write_likes = like.helper_write_likes
+
+    def fail_write_likes(batch):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(like, "helper_write_likes", fail_write_likes)
+    try:
+        like.flush_likes()
+    except OperationalError:
+        pass
+    else:
+        assert False
+    assert like.get_pending_like_count(event_id) == 2
+
+    # a failing pair only drops itself
+    def fail_user_likes(batch):
+        if (user_ids[2], event_id) in batch:
+            raise IntegrityError("INSERT", {}, Exception("foreign key"))
+        return write_likes(batch)
+
+    monkeypatch.setattr(like, "helper_write_likes", fail_user_likes)
+    assert like.flush_likes() == 1
+    assert like.get_pending_like_count(event_id) == 0
+    with app.app_context():
+        assert Like.query.count() == 2
+        assert db.session.get(Event, event_id).like_count == 2
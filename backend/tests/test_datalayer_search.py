@@ -0,0 +1,326 @@
+from itertools import count
+
+from .test_datalayer import test_client, count_queries
+
+from ..app import app
+from ..datalayer.event import EventDataLayer
+from ..datalayer.search import SearchDataLayer
+from ..datalayer.user import UserDataLayer
+from ..models import Event
+
+user_numbers = count()
+
+
+def create_event(
+    title, club, description="Kickoff for the club", end_time="2023-10-03 4:00:00"
+):
+    user_number = next(user_numbers)
+    user = UserDataLayer()
+    user_id = user.create_user(
+        username=f"testuser{user_number}",
+        email=f"testuser{user_number}@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+    event = EventDataLayer()
+    return event.create_event(
+        title=title,
+        description=description,
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time=end_time,
+        author_id=user_id,
+        club=club,
+        is_published=True,
+        image=None,
+    )
+
+
+def search_titles(keyword):
+    event = EventDataLayer()
+    with app.app_context():
+        return [result.title for result in event.get_search_results_by_keyword(keyword)]
+
+
+def exact_titles(keyword):
+    search = SearchDataLayer()
+    with app.app_context():
+        query = Event.query.filter(search.keyword_filter(keyword)).order_by(Event.id)
+        return [result.title for result in query]
+
+
+def test_search_index_fields(test_client):
+    create_event("Origami workshop", "Origami club")
+    create_event("Board games night", "Games society", description="Bring snacks")
+
+    assert exact_titles("orig") == ["Origami workshop"]
+    # prefixes only match the start of words
+    assert exact_titles("rigami") == []
+    # descriptions are indexed too
+    assert exact_titles("snack") == ["Board games night"]
+    # the words of the keyword have to be in a row
+    assert exact_titles("games ni") == ["Board games night"]
+    assert exact_titles("night games") == []
+    # punctuation is never taken as a search operator
+    assert exact_titles('"board" OR') == []
+    assert exact_titles("!!") == []
+
+
+def test_search_index_sync(test_client):
+    event_id = create_event("Origami workshop", "Origami club")
+    event = EventDataLayer()
+
+    event.update_event(
+        event_id=event_id,
+        title="Chess tournament",
+        description="Kickoff for the club",
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        club="Chess club",
+    )
+    assert search_titles("origami") == []
+    assert search_titles("chess") == ["Chess tournament"]
+
+    event.delete_event_by_id(event_id)
+    assert search_titles("chess") == []
+
+    # rebuilding the index keeps the same results
+    create_event("Origami workshop", "Origami club")
+    SearchDataLayer().rebuild_index()
+    assert search_titles("origami") == ["Origami workshop"]
+
+
+def test_search_uses_index(test_client):
+    create_event("Origami workshop", "Origami club")
+
+    with count_queries() as statements:
+        search_titles("orig")
+    # the exact search, then the typo-tolerant one since it found few events
+    assert len(statements) == 2
+    assert "MATCH" in statements[0]
+    assert "event_trigram" in statements[1]
+    assert not any(" LIKE " in statement.upper() for statement in statements)
+
+
+def test_fuzzy_search(test_client):
+    end_time = "2099-10-03 4:00:00"
+    create_event("Paper folding workshop", "Origami club", end_time=end_time)
+    create_event("Chess tournament", "Chess club", end_time=end_time)
+    create_event("Origins of chess", "History society", end_time=end_time)
+
+    # misspelled keywords match the most similar titles and clubs
+    assert search_titles("Origmai club") == ["Paper folding workshop"]
+    assert search_titles("tournamnet") == ["Chess tournament"]
+    assert search_titles("xylophone") == []
+    # short keywords are only matched exactly
+    assert search_titles("ch") == ["Chess tournament", "Origins of chess"]
+
+    event = EventDataLayer()
+    with app.app_context():
+        events = event.search_filter_sort(keyword="Chesss", sort_by="alphabetical")
+        assert [result.title for result in events] == [
+            "Chess tournament",
+            "Origins of chess",
+        ]
+
+
+def test_fuzzy_search_after_exact_matches(test_client):
+    end_time = "2099-10-03 4:00:00"
+    create_event("Zebra chess", "Chess club", end_time=end_time)
+    create_event("Chest painting", "Art society", end_time=end_time)
+
+    # typo-tolerant matches never come before exact ones, whatever the order
+    event = EventDataLayer()
+    with app.app_context():
+        for sort_by in [None, "alphabetical", "date", "relevance"]:
+            events = event.search_filter_sort(keyword="chess", sort_by=sort_by)
+            assert [result.title for result in events] == ["Zebra chess"]
+        events = event.search_filter_sort(keyword="chesz", sort_by="alphabetical")
+        assert [result.title for result in events] == ["Chest painting", "Zebra chess"]
+
+
+def test_fuzzy_search_sync(test_client):
+    event_id = create_event("Chess tournament", "Chess club")
+    event = EventDataLayer()
+
+    event.update_event(
+        event_id=event_id,
+        title="Origami workshop",
+        description="Kickoff for the club",
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        club="Origami club",
+    )
+    assert search_titles("tournamnet") == []
+    assert search_titles("origmai") == ["Origami workshop"]
+
+    SearchDataLayer().rebuild_index()
+    assert search_titles("origmai") == ["Origami workshop"]
+
+    event.delete_event_by_id(event_id)
+    assert search_titles("origmai") == []
+
+
+def test_relevance_sort(test_client):
+    end_time = "2099-10-03 4:00:00"
+    create_event(
+        "Board games night",
+        "Games society",
+        description="Chess and more",
+        end_time=end_time,
+    )
+    create_event("Chess tournament", "Chess club", end_time=end_time)
+    create_event("Chess clinic", "Games society", end_time=end_time)
+
+    event = EventDataLayer()
+    with app.app_context():
+        # matches in the title and club beat matches in the description
+        results = event.get_search_results_by_keyword("chess", sort_by="relevance")
+        assert [result.title for result in results] == [
+            "Chess tournament",
+            "Chess clinic",
+            "Board games night",
+        ]
+        results = event.search_filter_sort(keyword="chess", sort_by="relevance")
+        assert [result.title for result in results] == [
+            "Chess tournament",
+            "Chess clinic",
+            "Board games night",
+        ]
+        # typo-tolerant matches come after the ranked ones
+        results = event.search_filter_sort(keyword="tournamnet", sort_by="relevance")
+        assert [result.title for result in results] == ["Chess tournament"]
+        # without a keyword, there is nothing to rank by
+        results = event.search_filter_sort(sort_by="relevance")
+        assert [result.title for result in results] == [
+            "Board games night",
+            "Chess tournament",
+            "Chess clinic",
+        ]
+
+    response = test_client.get("/api/filter?query=chess&sortby=relevance")
+    assert [result["title"] for result in response.json] == [
+        "Chess tournament",
+        "Chess clinic",
+        "Board games night",
+    ]
+    response = test_client.get("/api/search?query=chess&sortby=relevance")
+    assert response.json["results"][0]["title"] == "Chess tournament"
+
+
+def read_pages(keyword, limit, sort_by=None):
+    event = EventDataLayer()
+    pages = []
+    cursor = None
+    while True:
+        with app.app_context():
+            results, cursor, _ = event.get_search_results_page(
+                keyword, limit=limit, cursor=cursor, sort_by=sort_by
+            )
+            pages.append([result.title for result in results])
+        if cursor is None:
+            return pages
+
+
+def test_search_results_page(test_client):
+    for number in range(5):
+        create_event(f"Chess night {number}", "Chess club")
+    create_event("Chess tournament", "Games society", description="Chess chess chess")
+    event = EventDataLayer()
+
+    assert read_pages("chess", limit=2) == [
+        ["Chess night 0", "Chess night 1"],
+        ["Chess night 2", "Chess night 3"],
+        ["Chess night 4", "Chess tournament"],
+    ]
+    pages = read_pages("chess", limit=4, sort_by="relevance")
+    assert [len(page) for page in pages] == [4, 2]
+    assert sorted(pages[0] + pages[1]) == sorted(search_titles("chess"))
+
+    # the page size is pushed down to the database
+    with count_queries() as statements:
+        with app.app_context():
+            results, cursor, total = event.get_search_results_page("chess", limit=2)
+    assert len(statements) == 1
+    assert "LIMIT" in statements[0]
+    assert total is None
+
+    with app.app_context():
+        _, _, total = event.get_search_results_page(
+            "chess", limit=2, cursor=cursor, include_total=True
+        )
+    assert total == 6
+
+    # cursors of the wrong shape or types are rejected before they reach the query
+    bad_positions = [
+        {"phase": "exact", "after": [{"a": 1}]},
+        {"phase": "exact", "after": [None]},
+        {"phase": "exact", "after": [1, 2]},
+        {"phase": "fuzzy", "after": ["0.5", 1]},
+        {"phase": "other"},
+        {"seen": "2"},
+    ]
+    bad_cursors = ["not a cursor"] + [
+        event.helper_encode_cursor(position) for position in bad_positions
+    ]
+    for bad_cursor in bad_cursors:
+        try:
+            event.get_search_results_page("chess", limit=2, cursor=bad_cursor)
+        except ValueError as value_error:
+            assert str(value_error) == "Cursor is not given in correct format"
+        else:
+            assert False
+
+
+def test_search_results_page_fuzzy(test_client):
+    create_event("Chess tournament", "Chess club")
+    create_event("Chess clinic", "Games society")
+    create_event("Chest painting", "Art society")
+    create_event("Poetry reading", "Book society")
+
+    # the exact matches are followed by the typo-tolerant ones, page after page
+    assert read_pages("chess", limit=1) == [
+        ["Chess tournament"],
+        ["Chess clinic"],
+        ["Chest painting"],
+    ]
+    assert read_pages("chess", limit=2) == [
+        ["Chess tournament", "Chess clinic"],
+        ["Chest painting"],
+    ]
+    event = EventDataLayer()
+    with app.app_context():
+        _, _, total = event.get_search_results_page(
+            "chess", limit=1, include_total=True
+        )
+    assert total == 3
+
+
+def test_api_search_page(test_client):
+    for number in range(3):
+        create_event(f"Chess night {number}", "Chess club")
+
+    response = test_client.get("/api/search?query=chess&limit=2&include_total=true")
+    assert response.status_code == 200
+    assert [result["title"] for result in response.json["results"]] == [
+        "Chess night 0",
+        "Chess night 1",
+    ]
+    assert response.json["total"] == 3
+    cursor = response.json["next_cursor"]
+
+    response = test_client.get(f"/api/search?query=chess&limit=2&cursor={cursor}")
+    assert [result["title"] for result in response.json["results"]] == ["Chess night 2"]
+    assert response.json["next_cursor"] is None
+    assert "total" not in response.json
+
+    response = test_client.get("/api/search?query=chess&cursor=abc")
+    assert response.status_code == 400
+    cursor = EventDataLayer().helper_encode_cursor({"after": [None]})
+    response = test_client.get(f"/api/search?query=chess&cursor={cursor}")
+    assert response.status_code == 400
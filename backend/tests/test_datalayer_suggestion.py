@@ -0,0 +1,236 @@
+from datetime import datetime, timedelta
+
+from .test_datalayer import test_client, count_queries
+
+from ..app import app, db
+from ..datalayer.event import EventDataLayer
+from ..datalayer import suggestion as suggestion_module
+from ..datalayer.suggestion import SuggestionDataLayer
+from ..datalayer.user import UserDataLayer
+from ..models import Event
+
+
+def create_user():
+    user = UserDataLayer()
+    return user.create_user(
+        username="testuser1",
+        email="testuser1@example.com",
+        password_hash="testpassword",
+        password_salt="testpassword",
+    )
+
+
+def create_event(author_id, title, club):
+    event = EventDataLayer()
+    return event.create_event(
+        title=title,
+        description="Kickoff for the club",
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        author_id=author_id,
+        club=club,
+        is_published=True,
+        image=None,
+    )
+
+
+def test_get_suggestions(test_client):
+    user_id = create_user()
+    create_event(user_id, "Origami workshop", "Origami club")
+    create_event(user_id, "Board games night", "Origami club")
+    suggestion = SuggestionDataLayer()
+
+    assert sorted(suggestion.get_suggestions("ori")) == [
+        "Origami club",
+        "Origami workshop",
+    ]
+    assert sorted(suggestion.get_suggestions("G")) == ["Board games night"]
+    # prefixes only match the start of words
+    assert suggestion.get_suggestions("rigami") == []
+
+    # once built, the index answers without querying the database
+    with count_queries() as statements:
+        assert suggestion.get_suggestions("night") == ["Board games night"]
+    assert statements == []
+
+
+def test_suggestions_follow_event_changes(test_client):
+    user_id = create_user()
+    first_id = create_event(user_id, "Origami workshop", "Origami club")
+    second_id = create_event(user_id, "Board games night", "Origami club")
+    suggestion = SuggestionDataLayer()
+    assert suggestion.get_suggestions("board") == ["Board games night"]
+
+    third_id = create_event(user_id, "Chess tournament", "Chess club")
+    assert sorted(suggestion.get_suggestions("ch")) == [
+        "Chess club",
+        "Chess tournament",
+    ]
+
+    event = EventDataLayer()
+    event.update_event(
+        event_id=third_id,
+        title="Go tournament",
+        description="Kickoff for the club",
+        extended_description="Extended decription for the event",
+        location="Toronto",
+        start_time="2023-10-03 3:30:00",
+        end_time="2023-10-03 4:00:00",
+        club="Go club",
+    )
+    assert suggestion.get_suggestions("ch") == []
+    assert sorted(suggestion.get_suggestions("go")) == ["Go club", "Go tournament"]
+
+    # a club stays suggested until its last event is deleted
+    event.delete_event_by_id(first_id)
+    assert suggestion.get_suggestions("ori") == ["Origami club"]
+    event.delete_event_by_id(second_id)
+    assert suggestion.get_suggestions("ori") == []
+
+
+def test_suggestion_index_expires(test_client, monkeypatch):
+    user_id = create_user()
+    event_id = create_event(user_id, "Origami workshop", "Origami club")
+    suggestion = SuggestionDataLayer()
+    assert len(suggestion.get_suggestions("ori")) == 2
+
+    # another process renames the event
+    with app.app_context():
+        db.session.get(Event, event_id).title = "Chess tournament"
+        db.session.commit()
+    # requests never rebuild the index
+    assert len(suggestion.get_suggestions("ori")) == 2
+
+    # the rename does not change the Event table's marker, so refreshes are skipped for a while
+    assert not suggestion.refresh()
+    assert len(suggestion.get_suggestions("ori")) == 2
+    monkeypatch.setattr(SuggestionDataLayer, "MAX_SKIPPED_REFRESHES", 1)
+    assert suggestion.refresh()
+    assert suggestion.get_suggestions("ori") == ["Origami club"]
+
+    # another process creates an event
+    with app.app_context():
+        db.session.add(
+            Event(
+                title="Origami contest",
+                location="Toronto",
+                start_time=datetime(2023, 10, 3, 3, 30),
+                end_time=datetime(2023, 10, 3, 4),
+                is_published=True,
+            )
+        )
+        db.session.commit()
+    assert suggestion.refresh()
+    assert sorted(suggestion.get_suggestions("ori")) == [
+        "Origami club",
+        "Origami contest",
+    ]
+
+
+def test_suggestion_index_rebuilt_aside(test_client, monkeypatch):
+    user_id = create_user()
+    create_event(user_id, "Origami workshop", "Origami club")
+    suggestion = SuggestionDataLayer()
+    suggestion.rebuild()
+
+    # while another thread rebuilds the index, the old one keeps answering
+    with suggestion_module.rebuild_lock:
+        assert not suggestion.rebuild(blocking=False)
+        with count_queries() as statements:
+            assert sorted(suggestion.get_suggestions("ori")) == [
+                "Origami club",
+                "Origami workshop",
+            ]
+        assert statements == []
+        # nor do requests wait for the first index of the process
+        suggestion.reset()
+        assert suggestion.get_suggestions("ori") == []
+
+    # the changes made while a new index is built are replayed on it
+    build = suggestion_module.SuggestionIndex.add
+
+    def add_during_rebuild(index, *args, **kwargs):
+        build(index, *args, **kwargs)
+        if suggestion_module.rebuild_changes == []:
+            suggestion.remove_event(args[0])
+
+    monkeypatch.setattr(suggestion_module.SuggestionIndex, "add", add_during_rebuild)
+    suggestion.rebuild()
+    monkeypatch.undo()
+    assert suggestion.get_suggestions("ori") == []
+
+
+def test_suggestions_ranked(test_client):
+    user_id = create_user()
+    popular_id = create_event(user_id, "Go tournament", "Go club")
+    upcoming_id = create_event(user_id, "Gardening", "Green thumbs")
+    expired_id = create_event(user_id, "Games night", "Board games society")
+    with app.app_context():
+        db.session.get(Event, popular_id).like_count = 10
+        db.session.get(Event, popular_id).end_time = datetime.now() + timedelta(days=1)
+        db.session.get(Event, upcoming_id).end_time = datetime.now() + timedelta(days=1)
+        db.session.get(Event, expired_id).end_time = datetime.now() - timedelta(days=90)
+        db.session.commit()
+    suggestion = SuggestionDataLayer()
+    suggestion.reset()
+
+    # whole words first, then popular and upcoming events
+    assert suggestion.get_suggestions("go") == ["Go club", "Go tournament"]
+    assert suggestion.get_suggestions("g", limit=3) == [
+        "Go club",
+        "Go tournament",
+        # shorter completions first
+        "Green thumbs",
+    ]
+    assert suggestion.get_suggestions("g")[-2:] == [
+        "Games night",
+        "Board games society",
+    ]
+    assert len(suggestion.get_suggestions("")) == 6
+
+
+def test_api_autosuggest(test_client):
+    user_id = create_user()
+    create_event(user_id, "Origami workshop", "Origami club")
+
+    response = test_client.get("/api/autosuggest?query=ORI")
+    assert response.status_code == 200
+    assert sorted(response.json) == ["Origami club", "Origami workshop"]
+
+    response = test_client.get("/api/autosuggest?query=ori&limit=1")
+    assert len(response.json) == 1
+    response = test_client.get("/api/autosuggest?query=ori&limit=0")
+    assert len(response.json) == 1
+
+
+def test_best_suggestions_kept(test_client, monkeypatch):
+    user_id = create_user()
+    create_event(user_id, "Origami workshop", "Origami club")
+    suggestion = SuggestionDataLayer()
+    suggestion.rebuild()
+
+    searched = []
+    search = suggestion_module.SuggestionIndex.search
+
+    def count_search(index, prefix):
+        searched.append(prefix)
+        return search(index, prefix)
+
+    monkeypatch.setattr(suggestion_module.SuggestionIndex, "search", count_search)
+    # the shortest prefixes are scored when the index is built
+    assert len(suggestion.get_suggestions("")) == 2
+    assert len(suggestion.get_suggestions("o")) == 2
+    assert searched == []
+    # longer prefixes are scored the first time they are typed
+    suggestion.get_suggestions("ori")
+    suggestion.get_suggestions("ori", limit=1)
+    assert searched == ["ori"]
+
+    # a new event only drops the best suggestions of its prefixes
+    create_event(user_id, "Orienteering", "Outdoor club")
+    assert suggestion.get_suggestions("ori", limit=3)[-1] == "Orienteering"
+    assert len(suggestion.get_suggestions("")) == 4
+    suggestion.get_suggestions("w")
+    assert searched == ["ori", "ori", ""]
@@ -0,0 +1,122 @@
+"""
+The image worker validates, resizes and stores uploaded images out of band, so
+uploads never block a web worker on image decoding.
+
+/api/update-post-image/<id> only queues the raw upload in the ImageJob table.
+The worker polls that table and processes the jobs in a pool of processes.
+/api/<id>/image queues the stored images whose variants are missing the same way.
+
+Usage (from the repository root):
+    python -m backend.worker [--workers 2] [--poll-interval 1.0] [--once]
+
+The worker can also run inside the gunicorn master, see gunicorn.conf.py.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from .app import app
+from .datalayer.image import ImageDataLayer
+from .datalayer.image_job import ImageJobDataLayer
+
+# Jobs processing for longer than this are assumed to belong to a crashed worker
+JOB_TIMEOUT = timedelta(minutes=10)
+
+
+def process_upload(upload_path, image_store_path):
+    """
+    Validates the raw upload and stores it and its resized variants in the image store.
+    Runs in a worker process, so it only gets plain, picklable arguments.
+    Returns a tuple of the image's hash, size in bytes, MIME type and placeholder.
+    """
+    app.config["IMAGE_STORE_PATH"] = image_store_path
+    with open(upload_path, "rb") as upload_file:
+        image = upload_file.read()
+    image_data = ImageDataLayer()
+    image_hash, image_size, image_mimetype = image_data.store_image(image)
+    image_placeholder = image_data.create_placeholder(image_hash)
+    return image_hash, image_size, image_mimetype, image_placeholder
+
+
+def process_pending_jobs(executor=None, batch_size=10):
+    """
+    Claims up to batch_size pending jobs and processes them, in the executor if one is given.
+    Returns the number of processed jobs.
+    """
+    job_data = ImageJobDataLayer()
+    image_data = ImageDataLayer()
+    image_store_path = app.config["IMAGE_STORE_PATH"]
+
+    jobs = job_data.claim_pending_jobs(batch_size)
+    submitted = []
+    for job in jobs:
+        upload_path = str(image_data.get_upload_path(job.upload_name))
+        future = None
+        if executor is not None:
+            future = executor.submit(process_upload, upload_path, image_store_path)
+        submitted.append((job.id, upload_path, future))
+
+    for job_id, upload_path, future in submitted:
+        try:
+            if future is None:
+                result = process_upload(upload_path, image_store_path)
+            else:
+                result = future.result()
+            job_data.finish_job(job_id, *result)
+        except Exception as e:
+            logging.info(f"Image job {job_id} failed: {e}")
+            job_data.fail_job(job_id, str(e))
+    return len(jobs)
+
+
+def run(workers=None, poll_interval=1.0, once=False):
+    """
+    Processes the queued image jobs until interrupted, or until the queue is empty if once is set.
+    """
+    job_data = ImageJobDataLayer()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            job_data.requeue_stale_jobs(JOB_TIMEOUT)
+            processed = process_pending_jobs(executor)
+            if processed == 0:
+                if once:
+                    return
+                time.sleep(poll_interval)
+
+
+def start_background_worker(workers=None, poll_interval=1.0):
+    """
+    Starts the image worker in a separate process and returns the process.
+    The caller is responsible for terminating it.
+    """
+    # Spawn rather than fork, so the worker does not share the parent's database connections.
+    # It is not a daemon process, since it starts its own pool of processes.
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=run,
+        kwargs={"workers": workers, "poll_interval": poll_interval},
+        name="image-worker",
+    )
+    process.start()
+    return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.worker")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--once", action="store_true", help="exit once the queue is empty"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    run(workers=args.workers, poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# gunicorn loads this file automatically when started from the repository root.
+import os
+
+# Set IMAGE_WORKER=separate when running `python -m backend.worker` on its own instead
+IMAGE_WORKER = os.getenv("IMAGE_WORKER", "master")
+
+image_worker = None
+
+
+def when_ready(server):
+    """
+    Runs the image worker next to the gunicorn master.
+    """
+    global image_worker
+    if IMAGE_WORKER == "master":
+        from backend.worker import start_background_worker
+
+        image_worker = start_background_worker()
+
+
+def post_worker_init(worker):
+    """
+    Starts building the autosuggest index of the worker in the background, so it is
+    ready by its first autosuggest requests without delaying the worker's heartbeats.
+    """
+    from backend.datalayer.suggestion import SuggestionDataLayer
+
+    SuggestionDataLayer().rebuild_in_background()
+
+
+def on_exit(server):
+    if image_worker is not None:
+        image_worker.terminate()
+        image_worker.join()
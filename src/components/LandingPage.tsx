@@ -28,6 +28,9 @@ const filterOptionValuesByAPI = [
   },
 ];
 
+// Number of events fetched per page of the feed
+const PAGE_SIZE = 30;
+
 interface User {
   userId: string;
   username: string;
@@ -40,7 +43,12 @@ interface LandingPageProps {
 }
 
 const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
-  const [searchResults, setSearchResults] = useState([]);
+  // With a token, the events say whether the user liked them
+  const authHeaders: HeadersInit = token
+    ? { Authorization: "Bearer " + token }
+    : {};
+  const [searchResults, setSearchResults] = useState<any[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
   const [showDeletePopUp, setShowDeletePopUp] = useState(false);
   const [postToBeDeleted, setPostToBeDeleted] = useState<number>();
@@ -88,10 +96,13 @@ const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
 
   const fetchEvents = async () => {
     try {
-      const response = await fetch(`${API_URL}/api/`); // Change this to the actual API endpoint
+      const response = await fetch(`${API_URL}/api/?limit=${PAGE_SIZE}`, {
+        headers: authHeaders,
+      }); // Change this to the actual API endpoint
       if (response.ok) {
         const data = await response.json();
-        setSearchResults(data);
+        setSearchResults(data.results);
+        setNextCursor(data.next_cursor);
       } else {
         throw new Error("Failed to fetch data");
       }
@@ -144,11 +155,17 @@ const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
     // Fetch data when filter parameters change
     const fetchData = async () => {
       try {
-        const queryParams = new URLSearchParams(filterParams);
-        const response = await fetch(`${API_URL}/api/filter?${queryParams}`);
+        const queryParams = new URLSearchParams({
+          ...filterParams,
+          limit: String(PAGE_SIZE),
+        });
+        const response = await fetch(`${API_URL}/api/filter?${queryParams}`, {
+          headers: authHeaders,
+        });
         if (response.ok) {
           const data = await response.json();
-          setSearchResults(data);
+          setSearchResults(data.results);
+          setNextCursor(data.next_cursor);
         } else {
           throw new Error("Failed to fetch data");
         }
@@ -163,6 +180,34 @@ const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
     fetchData();
   }, [filterParams]);
 
+  const loadMore = async () => {
+    if (!nextCursor) {
+      return;
+    }
+    try {
+      const queryParams = new URLSearchParams({
+        ...filterParams,
+        limit: String(PAGE_SIZE),
+        cursor: nextCursor,
+      });
+      const response = await fetch(`${API_URL}/api/filter?${queryParams}`, {
+        headers: authHeaders,
+      });
+      if (response.ok) {
+        const data = await response.json();
+        setSearchResults((prevResults) => [...prevResults, ...data.results]);
+        setNextCursor(data.next_cursor);
+      } else {
+        throw new Error("Failed to fetch data");
+      }
+    } catch (error) {
+      toast.error(`Oops, something went wrong. Please try again later!`, {
+        position: toast.POSITION.TOP_CENTER,
+      });
+      console.error("An error occurred while loading more events", error);
+    }
+  };
+
   const handleSearchData = (query: string) => {
     setFilterParams((prevParams) => ({
       ...prevParams,
@@ -244,6 +289,7 @@ const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
                   "Alphabetical",
                   "Trending",
                   "Date",
+                  "Relevance",
                 ]}
                 onSortChange={handleSortChange}
               />
@@ -265,6 +311,15 @@ const LandingPage: React.FC<LandingPageProps> = ({ token, user, setAuth }) => {
               ))
             )}
           </div>
+          {!loading && nextCursor && (
+            <div className="row">
+              <div className="col-12 text-center my-3">
+                <button className="btn btn-outline-primary" onClick={loadMore}>
+                  Load more
+                </button>
+              </div>
+            </div>
+          )}
         </div>
         {showDeletePopUp && posTitleToBeDeleted && (
           <DeletePopUp
@@ -6,6 +6,36 @@ import "../styles/PostCard.css";
 import API_URL from "../config";
 const defaultImage = require("../assets/image_placeholder.jpeg");
 
+// The liked event ids are fetched once for every card of the same token
+let likedEventIdsRequest: { token: string; ids: Promise<number[]> } | null =
+  null;
+
+const requestLikedEventIds = async (token: string): Promise<number[]> => {
+  const response = await fetch(`${API_URL}/api/likes/ids`, {
+    headers: {
+      Authorization: "Bearer " + token,
+    },
+  });
+  if (!response || !response.ok) {
+    throw new Error("Failed to fetch liked event ids");
+  }
+  return response.json();
+};
+
+const fetchLikedEventIds = (token: string): Promise<number[]> => {
+  if (!likedEventIdsRequest || likedEventIdsRequest.token !== token) {
+    const ids = requestLikedEventIds(token);
+    // A failed request is made again by the next card
+    ids.catch(() => {
+      if (likedEventIdsRequest && likedEventIdsRequest.ids === ids) {
+        likedEventIdsRequest = null;
+      }
+    });
+    likedEventIdsRequest = { token, ids };
+  }
+  return likedEventIdsRequest.ids;
+};
+
 interface User {
   userId: string;
   username: string;
@@ -22,6 +52,9 @@ interface PostCardProps {
   is_published: boolean;
   end_time: Date;
   like_count: number;
+  image_url?: string;
+  image_placeholder?: string;
+  liked?: boolean;
   token: string;
   user: User;
   setAuth: (token: string | null, user: User | null) => void;
@@ -36,7 +69,14 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
 
   const fetchImage = async () => {
     try {
-      const postImageResponse = await fetch(`${API_URL}/api/${postId}/image`);
+      // The image url is versioned by the image's content, so the browser can cache it
+      const imageUrl = PostCardProps.image_url || `/api/${postId}/image`;
+      const separator = imageUrl.includes("?") ? "&" : "?";
+      // Cards only need the small thumbnail of the image
+      const postImageResponse = await fetch(
+        `${API_URL}${imageUrl}${separator}size=card`,
+        { headers: { Accept: "image/avif,image/webp,*/*" } }
+      );
       if (!postImageResponse || !postImageResponse.ok) {
         throw new Error("Cannot fetch post image.");
       }
@@ -45,8 +85,8 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
       const imageBlob = await postImageResponse.blob();
 
       // Create a File object with the image data
-      const newImageFile = new File([imageBlob], `image_${postId}.png`, {
-        type: "image/png", // Adjust the type based on your image format
+      const newImageFile = new File([imageBlob], `image_${postId}`, {
+        type: imageBlob.type,
       });
 
       // Set the image file in state
@@ -58,11 +98,7 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
 
   useEffect(() => {
     fetchImage();
-  }, [postId]);
-
-  const checkIfLiked = (data: any, eventId: number) => {
-    setIsLiked(data && data.some((event: any) => event.id === eventId));
-  };
+  }, [postId, PostCardProps.image_url]);
 
   const isAuthor =
     PostCardProps.user &&
@@ -86,6 +122,8 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
         data.access_token &&
           PostCardProps.setAuth(data.access_token, PostCardProps.user);
         setIsLiked(!isLiked);
+        // Other cards fetch the liked event ids again
+        likedEventIdsRequest = null;
       } else {
         throw new Error(data["error message"]);
       }
@@ -94,47 +132,28 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
     }
   };
 
-  const fetchFavouritedEvents = async () => {
-    try {
-      const response = await fetch(`${API_URL}/api/favourites`, {
-        headers: {
-          Authorization: "Bearer " + PostCardProps.token,
-        },
-      });
-      if (response.ok) {
-        const data = await response.json();
-        data.access_token &&
-          PostCardProps.setAuth(data.access_token, PostCardProps.user);
-        return data;
-      } else {
-        throw new Error("Failed to fetch favourited events");
-      }
-    } catch (error) {
-      console.error(
-        "An error occurred while fetching favourited events",
-        error
-      );
-    }
-  };
-
   const handleDeleteButtonClick = () => {
     PostCardProps.showDeletePopUp(PostCardProps.id, PostCardProps.title);
   };
 
   React.useEffect(() => {
+    // Event lists fetched with a token say whether each event is liked
+    if (PostCardProps.liked !== undefined) {
+      setIsLiked(PostCardProps.liked);
+      return;
+    }
     if (
       PostCardProps.token &&
       PostCardProps.token !== "" &&
       PostCardProps.token !== undefined
     ) {
-      const fetchData = async () => {
-        const data = await fetchFavouritedEvents();
-        checkIfLiked(data, PostCardProps.id);
-      };
-
-      fetchData();
+      fetchLikedEventIds(PostCardProps.token)
+        .then((ids) => setIsLiked(ids.includes(PostCardProps.id)))
+        .catch((error) =>
+          console.error("An error occurred while fetching liked events", error)
+        );
     }
-  }, [PostCardProps.id]);
+  }, [PostCardProps.id, PostCardProps.liked]);
 
   function parseDateString(dateString: string): Date {
     const [datePart, timePart] = dateString.split(" ");
@@ -148,7 +167,11 @@ const PostCard: React.FC<PostCardProps> = (PostCardProps: any) => {
       <Link to={`/post/${PostCardProps.id}`} className="text-decoration-none">
         <div className="card">
           <img
-            src={imageFile ? URL.createObjectURL(imageFile) : defaultImage}
+            src={
+              imageFile
+                ? URL.createObjectURL(imageFile)
+                : PostCardProps.image_placeholder || defaultImage
+            }
             className="card-img-top rounded-top-34"
             alt="..."
           />
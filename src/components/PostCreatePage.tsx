@@ -10,6 +10,7 @@ import "../styles/PostCreatePage.css";
 import AutoSizeTextArea from "./AutoSizeTextArea";
 import { FontAwesomeIcon } from "@fortawesome/react-fontawesome";
 import API_URL from "../config";
+import waitForImageJob from "./waitForImageJob";
 import { ToastContainer, toast } from 'react-toastify';
 const imageTemplate = require("../assets/post-template.jpg");
 
@@ -255,19 +256,26 @@ const PostCreatePage: React.FC<PostDetailsProps> = ({
         }
       );
 
+      // the image is processed after the upload, so wait for it to be stored
+      let imageError = "";
+      try {
+        await waitForImageJob(postImageResponse);
+      } catch (error) {
+        imageError = (error as Error).message;
+      }
+
       setIsButtonDisabled(false);
-      if (postImageResponse.ok) {
+      if (!imageError) {
         setAlertMessage({ titleAlert: "", summaryAlert: "" });
         navigate("/dashboard");
         toast.success(`Posted ${editedPost.title}!`, {
           position: toast.POSITION.TOP_CENTER,
         });
       } else {
-        const data = await response.json();
-        toast.error(`Failed to create post.`, {
+        toast.error(`Failed to upload image: ${imageError}`, {
           position: toast.POSITION.TOP_CENTER,
         });
-        throw new Error(data["error message"]);
+        throw new Error(imageError);
       }
     } catch (error) {
       console.error("Create Post Error:", error);
@@ -10,6 +10,7 @@ import AutoSizeTextArea from "./AutoSizeTextArea";
 import DeletePopUp from "./DeletePopUp";
 import { FontAwesomeIcon } from "@fortawesome/react-fontawesome";
 import API_URL from "../config";
+import waitForImageJob from "./waitForImageJob";
 import { ToastContainer, toast } from "react-toastify";
 const defaultImage = require("../assets/image_placeholder.jpeg");
 
@@ -69,9 +70,7 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
   });
 
   const checkIfLiked = (data: any, eventId: string) => {
-    setIsLiked(
-      data && data.some((event: any) => event.id === parseInt(eventId))
-    );
+    setIsLiked(data && data.includes(parseInt(eventId)));
   };
 
   const getTagNames = async (): Promise<any[] | null> => {
@@ -92,22 +91,20 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
     }
   };
 
-  const fetchFavouritedEvents = async () => {
+  const fetchLikedEventIds = async () => {
     try {
-      const response = await fetch(`${API_URL}/api/favourites`, {
+      const response = await fetch(`${API_URL}/api/likes/ids`, {
         headers: {
           Authorization: "Bearer " + token,
         },
       });
       if (response.ok) {
-        const data = await response.json();
-        data.access_token && setAuth(data.access_token, user);
-        return data;
+        return await response.json();
       } else {
         toast.error(`Oops, something went wrong. Please try again later!.`, {
           position: toast.POSITION.TOP_CENTER,
         });
-        throw new Error("Failed to fetch favourited events");
+        throw new Error("Failed to fetch liked event ids");
       }
     } catch (error) {
       console.error(
@@ -158,7 +155,12 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
           const userData = await retrieveUserResponse.json();
           setAuthor(userData.username);
         }
-        const postImageResponse = await fetch(`${API_URL}/api/${postId}/image`);
+        const imageUrl = data.image_url || `/api/${postId}/image`;
+        const separator = imageUrl.includes("?") ? "&" : "?";
+        const postImageResponse = await fetch(
+          `${API_URL}${imageUrl}${separator}size=detail`,
+          { headers: { Accept: "image/avif,image/webp,*/*" } }
+        );
         if (!postImageResponse || !postImageResponse.ok) {
           toast.error(`Oops, something went wrong. Please try again later!.`, {
             position: toast.POSITION.TOP_CENTER,
@@ -170,8 +172,8 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
         const imageBlob = await postImageResponse.blob();
 
         // Create a File object with the image data
-        const imageFile = new File([imageBlob], `image_${postId}.png`, {
-          type: "image/png", // Adjust the type based on your image format
+        const imageFile = new File([imageBlob], `image_${postId}`, {
+          type: imageBlob.type,
         });
 
         // Set the image file in state
@@ -191,7 +193,7 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
   useEffect(() => {
     if (token && token !== "" && token !== undefined) {
       const fetchData = async () => {
-        const data = await fetchFavouritedEvents();
+        const data = await fetchLikedEventIds();
         postId && checkIfLiked(data, postId);
       };
 
@@ -322,18 +324,16 @@ const PostDetailsPage: React.FC<PostDetailsProps> = ({
         }
       );
 
-      if (response.ok) {
-        setIsEditing(false);
-        setPost({ ...editedPost });
-        setAlertMessage({ titleAlert: "", summaryAlert: "" });
-        setBlankMessage({ blankErrorMessage: "" });
-      } else {
-        toast.error(`Failed to update post.`, {
-          position: toast.POSITION.TOP_CENTER,
-        });
-        throw new Error("Failed to update post.");
-      }
+      // the image is processed after the upload, so wait for it to be stored
+      await waitForImageJob(response);
+      setIsEditing(false);
+      setPost({ ...editedPost });
+      setAlertMessage({ titleAlert: "", summaryAlert: "" });
+      setBlankMessage({ blankErrorMessage: "" });
     } catch (error) {
+      toast.error(`Failed to update image: ${(error as Error).message}`, {
+        position: toast.POSITION.TOP_CENTER,
+      });
       console.error("Update Image Error:", error);
     }
   };
@@ -0,0 +1,36 @@
+import API_URL from "../config";
+
+// Milliseconds between two polls of an image job, and polls before giving up
+const POLL_INTERVAL_MS = 1000;
+const MAX_POLLS = 60;
+
+// /api/update-post-image answers 202 once the upload is queued, and the image worker
+// validates and resizes it afterwards. Waits until the upload's job is done, and throws
+// the reason the upload or its job failed otherwise.
+const waitForImageJob = async (uploadResponse: Response): Promise<void> => {
+  const upload = await uploadResponse.json();
+  if (!uploadResponse.ok) {
+    throw new Error(upload["error message"] || "Failed to upload image.");
+  }
+  if (uploadResponse.status !== 202) {
+    return;
+  }
+
+  for (let poll = 0; poll < MAX_POLLS; poll++) {
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+    const response = await fetch(`${API_URL}/api/image-jobs/${upload.job_id}`);
+    const job = await response.json();
+    if (!response.ok) {
+      throw new Error(job["error message"] || "Failed to get image job.");
+    }
+    if (job.status === "done") {
+      return;
+    }
+    if (job.status === "failed") {
+      throw new Error(job["error message"]);
+    }
+  }
+  throw new Error("The image is taking too long to process.");
+};
+
+export default waitForImageJob;
@@ -3,10 +3,14 @@ import { render, fireEvent, waitFor, screen } from "@testing-library/react";
 import LandingPage from "../components/LandingPage";
 import API_URL from "../config";
 
-(global as any).fetch = jest.fn(() =>
+(global as any).fetch = jest.fn((url: string) =>
   Promise.resolve({
     ok: true,
-    json: () => Promise.resolve([]),
+    // Event lists are fetched a page at a time
+    json: () =>
+      Promise.resolve(
+        url.includes("/api/get-all-") ? [] : { results: [], next_cursor: null }
+      ),
   })
 );
 
@@ -17,7 +21,11 @@ describe("LandingPage Component", () => {
 
   test("fetches events on mount", async () => {
     render(<LandingPage token="" user={{ userId: "", username: "" }} setAuth={() => {}} />);
-    await waitFor(() => expect(global.fetch).toHaveBeenCalledWith(`${API_URL}/api/`));
+    await waitFor(() =>
+      expect(global.fetch).toHaveBeenCalledWith(`${API_URL}/api/?limit=30`, {
+        headers: {},
+      })
+    );
   });
 
 });